@@ -0,0 +1,333 @@
+# ann.py
+# Büyük galeriler için saf NumPy yaklaşık en yakın komşu (IVF) indeksi.
+# Kaba k-means kümeleme + ters listeler; son adaylar tam mesafeyle yeniden sıralanır,
+# böylece 0.45 tolerans kararı brute-force ile aynı mesafe değerine bakar.
+import os, sys, time, argparse, threading, weakref
+from collections import OrderedDict
+import numpy as np
+
+from gallery import FaceGallery, LayeredGallery, EMBEDDING_DIM, MAX_PROTOTYPES, QUANT_MODES, load_gallery, unique_people
+
+# "exact" (varsayılan) ya da "ivf"
+GALLERY_INDEX = os.environ.get("GALLERY_INDEX", "exact").lower()
+IVF_NLIST = int(os.environ.get("IVF_NLIST", "0"))  # 0 -> ~sqrt(N)
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", "8"))
+# Bu boyutun altındaki galerilerde indeks kurmaya değmez
+IVF_MIN_SIZE = int(os.environ.get("IVF_MIN_SIZE", "20000"))
+
+# Kesin mesafeyle yeniden sıralanacak aday sayısı (en az k)
+RERANK = int(os.environ.get("IVF_RERANK", "16"))
+
+_ASSIGN_CELLS = 8_000_000
+
+
+def _sq_dist(X, C, c_norms):
+    d2 = X @ C.T
+    d2 *= -2.0
+    d2 += c_norms[None, :]
+    d2 += np.einsum("ij,ij->i", X, X)[:, None]
+    return d2
+
+
+def _assign(X, C):
+    """Her satırı en yakın merkeze ata (bellek sınırlı parçalar halinde)."""
+    c_norms = np.einsum("ij,ij->i", C, C)
+    out = np.empty(len(X), dtype=np.int32)
+    step = max(1, _ASSIGN_CELLS // len(C))
+    for start in range(0, len(X), step):
+        out[start:start + step] = np.argmin(_sq_dist(X[start:start + step], C, c_norms), axis=1)
+    return out
+
+
+def kmeans(X, k, iters=10, seed=0):
+    """Basit Lloyd k-means; boş kalan kümeler rastgele bir noktayla yeniden başlatılır."""
+    rng = np.random.default_rng(seed)
+    C = X[rng.choice(len(X), size=k, replace=False)].copy()
+    for _ in range(iters):
+        labels = _assign(X, C)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(C, dtype=np.float64)
+        np.add.at(sums, labels, X)
+        empty = counts == 0
+        C[~empty] = (sums[~empty] / counts[~empty, None]).astype(np.float32)
+        if empty.any():
+            C[empty] = X[rng.choice(len(X), size=int(empty.sum()), replace=False)]
+    return C
+
+
+class IVFIndex:
+    """
+    FaceGallery üzerine kurulan inverted-file indeksi.
+    search()/search_batch() FaceGallery ile aynı çıktıyı döner.
+    """
+
+    def __init__(self, gallery, nlist=None, nprobe=None, iters=10, seed=0):
+        self.gallery = gallery
+        n = len(gallery)
+        nlist = nlist or IVF_NLIST or int(np.sqrt(n))
+        self.nlist = max(1, min(nlist, n))
+        self.nprobe = nprobe or IVF_NPROBE
+
+        t0 = time.perf_counter()
+        X = gallery.matrix
+        # Eğitim için küme başına ~40 nokta yeterli
+        rng = np.random.default_rng(seed)
+        train_n = min(n, self.nlist * 40)
+        train = X[rng.choice(n, size=train_n, replace=False)] if train_n < n else X
+        self.centroids = kmeans(train, self.nlist, iters=iters, seed=seed)
+        self.c_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+
+        labels = _assign(X, self.centroids)
+        # Ters listeler: satır indeksleri küme sırasına göre, offsets[c]:offsets[c+1]
+        self.order = np.argsort(labels, kind="stable").astype(np.int64)
+        self.offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=self.nlist), out=self.offsets[1:])
+        self.build_seconds = time.perf_counter() - t0
+
+    def __len__(self):
+        return len(self.gallery)
+
+    def _candidates(self, q32, nprobe):
+        d2 = _sq_dist(q32[None, :], self.centroids, self.c_norms)[0]
+        nprobe = min(nprobe, self.nlist)
+        lists = np.argpartition(d2, nprobe - 1)[:nprobe] if nprobe < self.nlist else np.arange(self.nlist)
+        return np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in lists])
+
+    def search(self, query, k=1, nprobe=None):
+        """query: 128-d encoding -> [{index, id, name, distance}, ...] (en fazla k)"""
+        q64 = np.asarray(query, dtype=np.float64).reshape(EMBEDDING_DIM)
+        if len(self) == 0 or k <= 0:
+            return []
+        q32 = q64.astype(np.float32)
+        cand = self._candidates(q32, nprobe or self.nprobe)
+        if len(cand) == 0:
+            return []
+        g = self.gallery
+        # Adaylar önce float32 ile taranır, sonra en iyileri float64 ile kesinleştirilir
+        d2 = g.sq_norms[cand] - 2.0 * (g.matrix[cand] @ q32)
+        # Kişi başına birden fazla prototip olabilir: k farklı kişi için yeterli aday tut
+        m = min(len(cand), max(k * (MAX_PROTOTYPES + 1), RERANK))
+        short = cand[np.argpartition(d2, m - 1)[:m]] if m < len(cand) else cand
+        exact = np.linalg.norm(g.matrix[short].astype(np.float64) - q64, axis=1)
+        order = np.argsort(exact, kind="stable")
+        return unique_people([
+            {"index": int(short[i]), "id": g.ids[short[i]], "name": g.names[short[i]],
+             "distance": float(exact[i])}
+            for i in order
+        ], k)
+
+    def search_batch(self, queries, k=1, nprobe=None):
+        return [self.search(q, k, nprobe) for q in np.asarray(queries).reshape(-1, EMBEDDING_DIM)]
+
+
+# --- Worker içi indeks önbelleği (galeri nesnesi değişince yeniden kurulur) ---
+_lock = threading.Lock()
+# id(galeri) -> (weakref, IVFIndex); shard'lar için birden fazla indeks, en fazla IVF_CACHE_SIZE (LRU).
+# İndeks galeriye güçlü referans tutar: sınır, atılan shard'ların bellekte kalmasını da sınırlar.
+IVF_CACHE_SIZE = int(os.environ.get("IVF_CACHE_SIZE", "4"))
+_indexes = OrderedDict()
+
+
+_building = set()  # id(galeri): arka planda kurulmakta olan indeksler
+
+
+def _build(gallery):
+    """İndeksi _lock dışında kurar (k-means uzun sürer), bitince önbelleğe koyar."""
+    key = id(gallery)
+    try:
+        index = IVFIndex(gallery)
+    except Exception as e:
+        print(f"IVF index build failed: {e}", file=sys.stderr)
+        index = None
+    with _lock:
+        _building.discard(key)
+        if index is not None:
+            _indexes[key] = (weakref.ref(gallery), index)
+            while len(_indexes) > IVF_CACHE_SIZE:
+                _indexes.popitem(last=False)
+    return index
+
+
+def get_searcher(gallery, wait=False):
+    """
+    Yapılandırmaya göre arama nesnesi döner:
+    GALLERY_INDEX=ivf ve galeri IVF_MIN_SIZE'dan büyükse IVFIndex, aksi halde galerinin kendisi.
+    İndeks henüz yoksa arka plan thread'inde kurulur ve o bitene kadar galerinin kendisi
+    (brute-force) döner; istek thread'i k-means'i beklemez. wait=True (warm-up) -> kurulumu bekle.
+    LayeredGallery'de indeks sadece ana katmana kurulur; günlük deltası brute-force taranır.
+    """
+    if isinstance(gallery, LayeredGallery):
+        base = get_searcher(gallery.base, wait)
+        return gallery if base is gallery.base else gallery.with_base(base)
+    if GALLERY_INDEX != "ivf" or len(gallery) < IVF_MIN_SIZE:
+        return gallery
+    key = id(gallery)
+    with _lock:
+        found = _indexes.get(key)
+        if found is not None and found[0]() is gallery:
+            _indexes.move_to_end(key)
+            return found[1]
+        if key in _building:
+            return gallery
+        _building.add(key)
+    if wait:
+        return _build(gallery) or gallery
+    threading.Thread(target=_build, args=(gallery,), daemon=True).start()
+    return gallery
+
+
+# ----------------- RECALL / LATENCY RAPORU -----------------
+def synthetic_gallery(n, seed=0, shift=0.0):
+    """
+    dlib encoding'lerine benzer ölçekte (norm ~1.5) rastgele, kümelenmiş galeri.
+    shift: boyut başına ~N(0, shift) sabit kayma (gerçek encoding'ler sıfır ortalamalı değildir).
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0, 0.13, size=(max(1, n // 50), EMBEDDING_DIM))
+    if shift:
+        centers += rng.normal(0, shift, size=EMBEDDING_DIM)
+    # Parça parça float32 üretim: 1M kişide float64 ara dizi (~1GB) oluşmaz
+    X = np.empty((n, EMBEDDING_DIM), dtype=np.float32)
+    for start in range(0, n, 65536):
+        end = min(n, start + 65536)
+        X[start:end] = centers[rng.integers(0, len(centers), size=end - start)] \
+            + rng.normal(0, 0.06, size=(end - start, EMBEDDING_DIM))
+    ids = [f"{i+1:03d}" for i in range(n)]
+    return FaceGallery(X, [f"person_{i}" for i in ids], ids)
+
+
+def _percentile_ms(samples, p):
+    return round(float(np.percentile(samples, p)) * 1000, 3)
+
+
+def report(g, nprobes, n_queries=200, noise=0.02, tolerance=0.45, nlist=None, seed=1):
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(g), size=min(n_queries, len(g)), replace=False)
+    queries = g.matrix[picks].astype(np.float64) + rng.normal(0, noise, size=(len(picks), EMBEDDING_DIM))
+
+    truth, brute_t = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        truth.append(g.search(q, k=1)[0])
+        brute_t.append(time.perf_counter() - t0)
+    print(f"gallery={len(g)} queries={len(queries)}")
+    print(f"brute-force   p50={_percentile_ms(brute_t, 50)}ms p95={_percentile_ms(brute_t, 95)}ms")
+
+    idx = IVFIndex(g, nlist=nlist)
+    print(f"ivf nlist={idx.nlist} build={idx.build_seconds:.2f}s")
+    for nprobe in nprobes:
+        hits = agree = 0
+        lat = []
+        for q, t in zip(queries, truth):
+            t0 = time.perf_counter()
+            res = idx.search(q, k=1, nprobe=nprobe)
+            lat.append(time.perf_counter() - t0)
+            best = res[0] if res else None
+            hits += best is not None and best["index"] == t["index"]
+            # Tolerans kararı (eşleşti mi + hangi kişi) brute-force ile aynı mı
+            if t["distance"] <= tolerance:
+                agree += best is not None and best["distance"] <= tolerance and best["id"] == t["id"]
+            else:
+                agree += best is None or best["distance"] > tolerance
+        n = len(queries)
+        print(f"nprobe={nprobe:<4} recall@1={hits / n:.4f} decision_agreement={agree / n:.4f} "
+              f"p50={_percentile_ms(lat, 50)}ms p95={_percentile_ms(lat, 95)}ms")
+
+
+def quant_report(g, modes, n_queries=200, noise=0.02, tolerance=0.45, seed=1):
+    """
+    Sıkıştırılmış tarama modlarının bellek / doğruluk / CPU karşılaştırması (referans: float32
+    tarama + float64 yeniden sıralama, yani brute force). scan_only: yeniden sıralama olmadan
+    kodlardaki en yakın satır. cpu: p50 gecikmenin float32 taramaya oranı.
+    resident/saved: bu galerinin gerçekten bellekte tuttuğu bayt (resident_bytes). Kodlar sadece
+    matris memmap'li (.fgal) ise tasarruf sağlar; pickle/DB galerisinde matrise eklenir (RAM artar).
+    Çıktı: {mod: scan_only recall@1 (kodsuz mod için recall@1)}
+    """
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(g), size=min(n_queries, len(g)), replace=False)
+    queries = g.matrix[picks].astype(np.float64) + rng.normal(0, noise, size=(len(picks), EMBEDDING_DIM))
+    exact = g.quantized("none")
+    truth, base_lat = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        truth.append(exact.search(q, k=1)[0])
+        base_lat.append(time.perf_counter() - t0)
+    base_bytes = exact.resident_bytes()
+    base_p50 = float(np.percentile(base_lat, 50))
+    print(f"gallery={len(g)} queries={len(queries)} (legacy float64 pickle: {len(g) * EMBEDDING_DIM * 8 / 2**20:.1f}MB)")
+    recalls, grew = {}, False
+    for mode in modes:
+        gq = g.quantized(mode)
+        hits = agree = scan_hits = 0
+        lat, err = [], []
+        for q, t in zip(queries, truth):
+            t0 = time.perf_counter()
+            best = gq.search(q, k=1)[0]
+            lat.append(time.perf_counter() - t0)
+            hits += best["index"] == t["index"]
+            err.append(abs(best["distance"] - t["distance"]))
+            if t["distance"] <= tolerance:
+                agree += best["distance"] <= tolerance and best["id"] == t["id"]
+            else:
+                agree += best["distance"] > tolerance
+            if gq.codes is not None:
+                d2 = gq.codes.sq_distances(q.astype(np.float32)[None, :])[0]
+                scan_hits += int(np.argmin(d2)) == t["index"]
+        n = len(queries)
+        recalls[mode] = (scan_hits if gq.codes is not None else hits) / n
+        # Kodlu modda tam matris yalnızca yeniden sıralamada okunur (memmap'li .fgal'de page cache'te kalır)
+        scan_bytes = gq.codes.nbytes if gq.codes is not None else base_bytes
+        resident = gq.resident_bytes()
+        grew |= resident > base_bytes
+        scan = f"scan_only@1={scan_hits / n:.4f} " if gq.codes is not None else ""
+        cpu = float(np.percentile(lat, 50)) / base_p50 if base_p50 else 0.0
+        print(f"{mode:<8} scan={scan_bytes / 2**20:8.1f}MB resident={resident / 2**20:8.1f}MB "
+              f"saved={1 - resident / base_bytes:6.1%} "
+              f"recall@1={hits / n:.4f} {scan}decision_agreement={agree / n:.4f} "
+              f"max_distance_err={max(err):.2e} p50={_percentile_ms(lat, 50)}ms p95={_percentile_ms(lat, 95)}ms "
+              f"cpu=x{cpu:.1f}")
+    if grew:
+        print("note: this gallery's float32 matrix is in RAM (pickle/DB backend or synthetic), so codes are "
+              "added on top of it and GALLERY_QUANTIZE increases memory; the scan= saving only applies "
+              "to mmap'd .fgal galleries.")
+    if "float16" in modes:
+        print("note: float16 codes are widened to float32 block by block on every query (NumPy has no "
+              "float16 BLAS), so the scan trades memory for several times the float32 CPU cost; "
+              "int8 widening is cheap.")
+    return recalls
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IVF / quantized storage recall-latency report against brute force")
+    parser.add_argument("--db", help="gallery file (default: FACE_DB_PATH)")
+    parser.add_argument("--synthetic", type=int, help="use a synthetic gallery of N faces instead")
+    parser.add_argument("--shift", type=float, default=0.0,
+                        help="per-dimension mean shift of the synthetic gallery (non-zero-mean data)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nlist", type=int)
+    parser.add_argument("--nprobe", default="1,2,4,8,16,32")
+    parser.add_argument("--quantize", help="compare quantized scan modes instead of IVF, e.g. none,float16,int8")
+    parser.add_argument("--min-recall", type=float,
+                        help="with --quantize: exit 1 if any mode's scan-only recall@1 vs brute force is lower")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        g = synthetic_gallery(args.synthetic, shift=args.shift)
+    else:
+        g = load_gallery(args.db)
+        if isinstance(g, LayeredGallery):
+            sys.exit("Gallery has pending enrollments; run 'python gallery.py compact' first.")
+        if g is None or len(g) == 0:
+            sys.exit("Gallery is empty.")
+    if args.quantize:
+        modes = [m.strip() for m in args.quantize.split(",")]
+        bad = [m for m in modes if m not in QUANT_MODES]
+        if bad:
+            sys.exit(f"Unknown quantize mode(s): {', '.join(bad)} (expected: {', '.join(QUANT_MODES)})")
+        recalls = quant_report(g, modes, n_queries=args.queries)
+        low = {m: r for m, r in recalls.items() if args.min_recall is not None and r < args.min_recall}
+        if low:
+            sys.exit(f"Recall check failed (< {args.min_recall}): "
+                     + ", ".join(f"{m}={r:.4f}" for m, r in low.items()))
+    else:
+        report(g, [int(x) for x in args.nprobe.split(",")], n_queries=args.queries, nlist=args.nlist)
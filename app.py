@@ -1,11 +1,17 @@
 # app.py
-from flask import Flask, render_template_string, request, redirect, url_for, jsonify
+import time
+_BOOT_T0 = time.perf_counter()  # import süresi raporu (bkz. BOOT_STATS)
+from flask import Flask, render_template_string, request, redirect, url_for, jsonify, Response, stream_with_context, g
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, timedelta
-import pickle, os
-from PIL import Image
+from sqlalchemy import select, insert, update, and_, or_, case, func, bindparam
+from sqlalchemy.dialects import postgresql, sqlite
+from datetime import datetime, date, timedelta
+from collections import OrderedDict
+import click
+import os, io, csv, json, threading
 import numpy as np
-import face_recognition
+from PIL import Image
+import gallery, gallerydb, ann, detection, jobs, writebehind, ingest, resultcache, metrics, streaming
 
 # --- Flask app ---
 app = Flask(__name__)
@@ -13,6 +19,104 @@ app.secret_key = os.environ.get("SECRET_KEY", "yoklama123")
 app.config["TEMPLATES_AUTO_RELOAD"] = True
 app.config["MAX_CONTENT_LENGTH"] = 10 * 1024 * 1024  # 10MB payload limiti
 
+# --- Yüz tespiti ölçekleri (endpoint başına; küçükten büyüğe, yüz yoksa sonraki denenir) ---
+# Örn: DETECT_SCALES_ATTENDANCE_PHOTO="0.5,1.0"  (varsayılan DETECT_SCALES)
+_default_scales = os.environ.get("DETECT_SCALES", "0.5,1.0")
+app.config["DETECT_SCALES"] = {
+    ep: detection.parse_scales(os.environ.get(f"DETECT_SCALES_{ep.upper()}"), default)
+    for ep, default in (("attendance_photo", _default_scales),
+                        ("exit_photo", _default_scales),
+                        ("attendance_stream", _default_scales),
+                        # Geniş sınıf fotoğraflarında yüzler küçük -> varsayılan tam çözünürlük
+                        ("attendance_batch", "1.0"),
+                        ("add_user", os.environ.get("DETECT_SCALES", "0.25,0.5,1.0")))
+}
+
+# --- Decode çözünürlüğü (endpoint başına uzun kenar, piksel; 0 = tam çözünürlük) ---
+# JPEG'ler draft modunda bu boyuttan küçük olmayan en küçük DCT ölçeğinde decode edilir
+# (bkz. ingest.py). Örn: INGEST_MAX_SIDE_ADD_USER=1600
+app.config["INGEST_MAX_SIDE"] = {
+    ep: int(os.environ.get(f"INGEST_MAX_SIDE_{ep.upper()}", default))
+    for ep, default in (("attendance_photo", os.environ.get("INGEST_MAX_SIDE", "1280")),
+                        ("exit_photo", os.environ.get("INGEST_MAX_SIDE", "1280")),
+                        # Akış kareleri her karede tespit edilir: kiosk çözünürlüğü yeterli
+                        ("attendance_stream", "640"),
+                        # Geniş sınıf fotoğraflarında küçük yüzler kaybolmasın
+                        ("attendance_batch", "0"),
+                        ("add_user", os.environ.get("INGEST_MAX_SIDE", "1280")))
+}
+
+# --- Tanıma modu ---
+# sync: istek thread'inde işlenir (varsayılan, eski JSON sözleşmesi)
+# async: iş kuyruğa alınır, 202 + job_id döner; sonuç /jobs/<id> ile sorgulanır
+app.config["RECOGNITION_MODE"] = os.environ.get("RECOGNITION_MODE", "sync")
+# thread: CPU aşaması iş thread'inde; process: ayrı proses havuzunda (GIL'den bağımsız)
+app.config["RECOGNITION_EXECUTOR"] = os.environ.get("RECOGNITION_EXECUTOR", "thread")
+recognition_jobs = jobs.JobQueue(
+    workers=int(os.environ.get("RECOGNITION_WORKERS", "2")),
+    max_queue=int(os.environ.get("RECOGNITION_QUEUE", "16")),
+)
+# Sunucu yapısı: gunicorn.conf.py worker başlarken configure_server() ile bildirir.
+# threads=None -> bilinmiyor/sınırsız (flask run'ın thread'li geliştirme sunucusu)
+SERVER = {"workers": 1, "threads": None}
+
+def async_mode_allowed():
+    """
+    Async modda iş kayıtları proses içindedir: /jobs/<id> polling'i başka worker'a düşerse 404,
+    ?wait long-poll'u da tek istek thread'ini bloklar. Bu yüzden sadece tek worker + threads > 1.
+    """
+    return SERVER["workers"] == 1 and (SERVER["threads"] is None or SERVER["threads"] > 1)
+
+def configure_server(workers, threads, log=None):
+    global attendance_buffer
+    SERVER.update(workers=workers, threads=threads)
+    if attendance_buffer is not None and workers > 1:
+        # Tampon ve 2 saat kuralının tampon okuması proses içi: başka worker'daki bekleyen giriş
+        # görülmez (çift giriş, çıkışta no_open_entry). Worker istek almadan önce kapatılır.
+        (log or app.logger).warning(
+            "ATTENDANCE_WRITE_BEHIND=1 needs a single worker (got workers=%s); "
+            "writing attendance synchronously", workers)
+        attendance_buffer.flush()
+        attendance_buffer = None
+    stream_registry.threads = threads
+    if threads is not None and threads <= 1:
+        (log or app.logger).warning(
+            "Stream mode needs GUNICORN_THREADS > 1 (one thread stays free for other requests); "
+            "/attendance_stream will answer 503")
+    if app.config["RECOGNITION_MODE"] == "async" and not async_mode_allowed():
+        (log or app.logger).warning(
+            "RECOGNITION_MODE=async needs a single worker with threads > 1 (got workers=%s, threads=%s); "
+            "falling back to sync recognition", workers, threads)
+
+# --- Galeri shard'ları (site / sınıf / grup) ---
+# İstek 'shard' (virgülle birden fazla) ya da 'kiosk' taşır; kiosk -> shard eşlemesi:
+# KIOSK_SHARDS="bina-a=bina-a,lab1=fizik101+fizik102". Kapsam yoksa global galeri aranır.
+# SHARD_FALLBACK=1: shard'larda eşik içinde eşleşme yoksa global galeride de ara (istekte fallback=0/1).
+KIOSK_SHARDS = {
+    kiosk.strip(): [s.strip() for s in shards.split("+") if s.strip()]
+    for kiosk, _, shards in (item.partition("=") for item in os.environ.get("KIOSK_SHARDS", "").split(","))
+    if kiosk.strip() and shards
+}
+SHARD_FALLBACK = os.environ.get("SHARD_FALLBACK", "0") == "1"
+MATCH_TOLERANCE = 0.45
+# Aynı isimle kayıt: mevcut kişiye bu mesafe içindeyse yeni örnek olarak eklenir (yeni id açılmaz).
+# Eşleşme eşiğinden (ve merge-duplicates varsayılanından) gevşek olmamalı: aynı adlı iki farklı
+# kişi (ör. "Ahmet Yılmaz") tek id'de birleşmesin.
+SAMPLE_TOLERANCE = float(os.environ.get("SAMPLE_TOLERANCE", str(MATCH_TOLERANCE)))
+
+# --- Tanıma sonucu önbelleği (çift tıklama / tekrar gönderilen kareler) ---
+# RESULT_CACHE_TTL=0 -> kapalı. Galeri sürümü değişince eski sonuçlar geçersiz olur.
+# RESULT_CACHE_BITS: varsayılan 0 (sadece birebir aynı hash). Hash tüm karenindir: sabit kamera ve
+# arka planda sıradaki kişinin karesi birkaç bit içinde kalıp öncekinin sonucunu alabilir.
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", "10"))
+recognition_cache = resultcache.RecognitionCache(
+    ttl=RESULT_CACHE_TTL,
+    max_size=int(os.environ.get("RESULT_CACHE_SIZE", "256")),
+    max_distance=int(os.environ.get("RESULT_CACHE_BITS", "0")),
+) if RESULT_CACHE_TTL > 0 else None
+_process_pool = None
+_process_pool_lock = threading.Lock()  # iş thread'leri havuzu aynı anda ilk kez isteyebilir
+
 # --- DB URL (Heroku + local fallback) ---
 db_url = os.environ.get("DATABASE_URL")
 if db_url and db_url.startswith("postgres://"):
@@ -35,6 +139,17 @@ db = SQLAlchemy(app)
 
 # Model
 class Attendance(db.Model):
+    __table_args__ = (
+        # 2 saat kuralı: kişinin son kaydı (person_id eşitliği + entry_time'a göre sıralı)
+        db.Index("ix_attendance_person_entry", "person_id", "entry_time"),
+        # Açık oturumlar (henüz çıkış yapılmamış) için kısmi indeks
+        db.Index("ix_attendance_open", "person_id",
+                 postgresql_where=db.text("exit_time IS NULL"),
+                 sqlite_where=db.text("exit_time IS NULL")),
+        # Dashboard keyset sayfalama: (entry_time, id)
+        db.Index("ix_attendance_entry_id", "entry_time", "id"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     person_id = db.Column(db.String(32))
     name = db.Column(db.String(100))
@@ -42,6 +157,71 @@ class Attendance(db.Model):
     exit_time = db.Column(db.DateTime)
     duration = db.Column(db.Interval)
 
+# Galeri (GALLERY_BACKEND=db): satır başına bir örnek; her yazma monoton artan version alır,
+# silinen satırlar deleted=True + yeni version ile işaretlenir (worker'lar farkı çeker)
+class GalleryFace(db.Model):
+    __tablename__ = "gallery_faces"
+    __table_args__ = (
+        # Artımlı eşitleme: WHERE shard = ? AND version > ?
+        db.Index("ix_gallery_faces_shard_version", "shard", "version"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    shard = db.Column(db.String(64), nullable=False, default="")  # "" -> global galeri
+    person_id = db.Column(db.String(32), nullable=False)
+    name = db.Column(db.String(100))
+    weight = db.Column(db.Float, nullable=False, default=1.0)
+    embedding = db.Column(db.LargeBinary, nullable=False)  # little-endian float32 x 128
+    version = db.Column(db.BigInteger, nullable=False)
+    deleted = db.Column(db.Boolean, nullable=False, default=False)
+
+# Sayaçlar: "version" (galeri sürümü), "person_seq" (son kişi numarası)
+class GalleryMeta(db.Model):
+    __tablename__ = "gallery_meta"
+
+    key = db.Column(db.String(32), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False)
+
+# Kişi x gün özet tablosu: process_photo her giriş/çıkışta artımlı günceller,
+# raporlar ham Attendance yerine bunu okur. Oturum, giriş yaptığı güne sayılır.
+class DailyAttendance(db.Model):
+    __tablename__ = "daily_attendance"
+
+    person_id = db.Column(db.String(32), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    name = db.Column(db.String(100))
+    first_entry = db.Column(db.DateTime)
+    last_exit = db.Column(db.DateTime)
+    total_seconds = db.Column(db.Float, nullable=False, default=0.0)
+    sessions = db.Column(db.Integer, nullable=False, default=0)
+    open_sessions = db.Column(db.Integer, nullable=False, default=0)
+
+# --- Galeri kaynağı ---
+# GALLERY_BACKEND=file (varsayılan): FACE_DB_PATH + kayıt günlüğü (dyno başına, yerel disk)
+# GALLERY_BACKEND=db: gallery_faces tablosu; worker'lar GALLERY_DB_POLL saniyede bir artımlı eşitler
+GALLERY_BACKEND = os.environ.get("GALLERY_BACKEND", "file").lower()
+
+def _gallery_engine():
+    with app.app_context():
+        return db.engine
+
+gallery_db = gallerydb.DbGallery(_gallery_engine, GalleryFace.__table__, GalleryMeta.__table__) \
+    if GALLERY_BACKEND == "db" else None
+
+def load_gallery(shard=None):
+    """Kapsamın (None -> global) galerisi, yapılandırılmış kaynaktan (önbellekli)."""
+    if gallery_db is not None:
+        return gallery_db.load(shard)
+    return gallery.load_gallery(gallery.shard_path(shard) if shard else None)
+
+def gallery_version(shard=None):
+    if gallery_db is not None:
+        return gallery_db.version(shard)
+    return gallery.gallery_version(gallery.shard_path(shard) if shard else None)
+
+def gallery_stats_dict():
+    return gallery_db.stats() if gallery_db is not None else gallery.cache_stats()
+
 # ------------- CONFIDENCE HESAPLAMA -------------
 def face_confidence(face_distance, match_threshold=0.45):
     """
@@ -59,18 +239,146 @@ def face_confidence(face_distance, match_threshold=0.45):
         value = (linear_val + ((1.0 - linear_val) * pow((linear_val - 0.5) * 2, 0.2)))
         return round(max(0.0, min(1.0, value)) * 100, 2)
 
+def _ms(t0):
+    return round((time.perf_counter() - t0) * 1000, 2)
+
+def request_scope():
+    """
+    İstekteki galeri kapsamı (form alanı ya da query parametresi).
+    Çıktı: (shard adları tuple'ı, fallback); () -> global galeri. Geçersiz shard adı -> ValueError
+    """
+    raw = request.values.get("shard", "")
+    if raw.strip():
+        shards = sorted({s.strip() for s in raw.split(",") if s.strip()})
+    else:
+        shards = KIOSK_SHARDS.get(request.values.get("kiosk", "").strip(), [])
+    for shard in shards:
+        gallery.shard_path(shard)
+    fallback = request.values.get("fallback")
+    fallback = SHARD_FALLBACK if fallback is None else fallback.lower() in ("1", "true", "yes")
+    return tuple(shards), fallback
+
+def _load_scope(shards):
+    if not shards:
+        return [(None, load_gallery())]
+    # Shard'lar ilk istekte yüklenir; bellek bütçesi aşılınca en eski kullanılanlar atılır
+    return [(s, load_gallery(s)) for s in shards]
+
+def search_scope(queries, scope, timings):
+    """
+    queries (m, 128) kapsamdaki galerilerde aranır; fallback açıksa shard'larda eşik içinde
+    eşleşmeyen sorgular global galeride tekrar aranır.
+    Çıktı: (yüklü galeri var mı, [en iyi {id, name, distance, shard} ya da None, ...])
+    """
+    shards, fallback = scope
+    t0 = time.perf_counter()
+    galleries = [(name, g) for name, g in _load_scope(shards) if g is not None]
+    timings["gallery_ms"] = _ms(t0)
+
+    t0 = time.perf_counter()
+    best = [None] * len(queries)
+
+    def merge(name, known, rows):
+        # GALLERY_INDEX=ivf ise büyük galerilerde yaklaşık indeks (son adaylar kesin mesafeyle)
+        for i, m in zip(rows, ann.get_searcher(known).search_batch(queries[rows], k=1)):
+            if m and (best[i] is None or m[0]["distance"] < best[i]["distance"]):
+                best[i] = {"id": m[0]["id"], "name": m[0]["name"], "distance": m[0]["distance"], "shard": name}
+
+    for name, known in galleries:
+        merge(name, known, np.arange(len(queries)))
+    if shards and fallback:
+        rows = [i for i, b in enumerate(best) if b is None or b["distance"] > MATCH_TOLERANCE]
+        known = load_gallery() if rows else None
+        if known is not None:
+            galleries.append((None, known))
+            merge(None, known, np.asarray(rows))
+    timings["match_ms"] = _ms(t0)
+    return bool(galleries), best
+
+def decode_image(source, endpoint):
+    """
+    Yüklenen görüntüyü endpoint'in ihtiyaç duyduğu çözünürlükte açar (EXIF yönü uygulanır).
+    Çıktı: PIL RGB görüntü; açılamazsa istisna fırlatır
+    """
+    return ingest.load_image(source, app.config["INGEST_MAX_SIDE"][endpoint])
+
+def encode_faces(image, endpoint, timings, max_faces=None):
+    """
+    image: PIL RGB görüntü
+    Kademeli tespit (DETECT_SCALES[endpoint]) + tam çözünürlükte encoding
+    (max_faces verilirse sadece ilk max_faces yüz encode edilir).
+    Çıktı: (img_array, face_locations, encodings); aşama süreleri timings'e yazılır.
+    """
+    return detection.encode_image(image, app.config["DETECT_SCALES"][endpoint], timings, max_faces)
+
 # Sağlık kontrolü
 @app.route("/health")
 def health():
     return "OK", 200
 
+# ----------------- METRİKLER -----------------
+# Her istek: gecikme histogramı + durum kodu sayacı. Tanıma endpoint'leri aşama sürelerini
+# g.timings'e koyar -> Server-Timing başlığı + aşama histogramları.
+@app.before_request
+def _start_timer():
+    g.request_t0 = time.perf_counter()
+
+@app.after_request
+def _record_metrics(response):
+    endpoint = request.endpoint or "unmatched"
+    t0 = g.get("request_t0")
+    if t0 is not None:
+        metrics.REQUEST_LATENCY.observe(time.perf_counter() - t0, endpoint)
+    metrics.REQUESTS.inc(endpoint, response.status_code)
+    timings = g.get("timings")
+    if timings:
+        metrics.observe_stages(endpoint, timings)
+        response.headers["Server-Timing"] = metrics.server_timing(timings)
+    return response
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Prometheus text formatı: istek/aşama histogramları + galeri, önbellek, kuyruk istatistikleri."""
+    with _last_events_lock:
+        last_event_size = len(_last_events)
+    gauges = {
+        "gallery": gallery_stats_dict(),
+        "last_event_cache": dict(_last_event_stats, size=last_event_size),
+        "jobs": recognition_jobs.stats(),
+    }
+    if recognition_cache is not None:
+        gauges["result_cache"] = recognition_cache.stats()
+    if attendance_buffer is not None:
+        gauges["write_behind"] = attendance_buffer.stats()
+    gauges["streams"] = stream_registry.stats()
+    gauges["boot"] = BOOT_STATS
+    return Response(metrics.render(gauges), mimetype="text/plain; version=0.0.4")
+
 # İlk tablo kurulumu – sadece elle çağır
 @app.route("/initdb")
 def initdb():
     with app.app_context():
         db.create_all()
+        # create_all var olan tabloya indeks eklemez; eksik indeksleri ayrıca kur
+        for index in (*Attendance.__table__.indexes, *GalleryFace.__table__.indexes):
+            index.create(db.engine, checkfirst=True)
     return "DB OK", 200
 
+# Galeri önbellek sayaçları (steady-state'te reloads artmamalı)
+@app.route("/gallery/stats")
+def gallery_stats():
+    return jsonify(gallery_stats_dict()), 200
+
+# Galeriyi elle yeniden yükle (ör. dosya dışarıdan değiştirildiyse)
+@app.route("/gallery/reload", methods=["POST"])
+def gallery_reload():
+    if gallery_db is not None:
+        gallery_db.invalidate()
+    else:
+        gallery.invalidate()
+    load_gallery()
+    return jsonify(gallery_stats_dict()), 200
+
 # ----------------- ORTAK STİL (tek mavi tema) -----------------
 BASE_CSS = """
 <style>
@@ -170,6 +478,7 @@ HOME_HTML = f'''
               <video id="video" autoplay playsinline></video>
               <div class="mt-3 d-flex gap-2 justify-content-center">
                 <button id="snap" class="btn btn-primary">📸 Fotoğraf Çek & Kaydet</button>
+                <button id="streamBtn" class="btn btn-outline">🎥 Sürekli Mod</button>
                 <!-- Form sadece action bilgisini taşımak için var; gönderim fetch ile -->
                 <form id="photoForm" class="d-inline">
                   <input type="hidden" name="action" id="currentAction" value="/attendance_photo">
@@ -182,6 +491,7 @@ HOME_HTML = f'''
           <div class="col-12 col-lg-5">
             <div class="cam-card">
               <img id="preview" src="" style="display:none;">
+              <div id="streamStatus" class="mt-2 text-center" style="display:none;"></div>
             </div>
           </div>
         </div>
@@ -212,7 +522,107 @@ HOME_HTML = f'''
       document.getElementById('cameraArea').scrollIntoView({{behavior:'smooth', block:'center'}});
     }}
 
+    // ----- Sürekli mod: kareler tek bağlantıda akıtılır (uzunluk önekli JPEG), cevap NDJSON -----
+    // Tarayıcıda akışlı istek gövdesi (fetch duplex: 'half') HTTP/2 gerektirir.
+    let streaming = false;
+    let frameInterval = 250;
+
+    function supportsRequestStreams() {{
+      let duplexAccessed = false;
+      const hasContentType = new Request('', {{
+        body: new ReadableStream(), method: 'POST',
+        get duplex() {{ duplexAccessed = true; return 'half'; }}
+      }}).headers.has('Content-Type');
+      return duplexAccessed && !hasContentType;
+    }}
+
+    function grabFrame(video) {{
+      const W = 640;
+      const H = Math.round(W * (video.videoHeight || 540) / (video.videoWidth || 960));
+      const canvas = document.createElement('canvas');
+      canvas.width = W; canvas.height = H;
+      canvas.getContext('2d').drawImage(video, 0, 0, W, H);
+      return new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', 0.7));
+    }}
+
+    function showStreamEvent(ev, status) {{
+      if (ev.event === 'frame') {{
+        frameInterval = Math.max(frameInterval, ev.interval_ms || 0);
+        const names = ev.tracks.filter(t => t.name).map(t => t.name + ' (' + t.confidence + '%)'
+          + (t.status === 'blocked' ? ' - tekrar' : ''));
+        status.textContent = names.length ? '✅ ' + names.join(', ') : (ev.tracks.length ? '🔍 Tanınıyor…' : '👀 Bekleniyor…');
+      }} else if (ev.event === 'start') {{
+        frameInterval = ev.interval_ms || frameInterval;
+      }} else if (ev.event === 'error' && !ev.frame) {{
+        status.textContent = 'Akış hatası: ' + ev.message;
+      }}
+    }}
+
+    async function toggleStream() {{
+      const btn = document.getElementById('streamBtn');
+      if (streaming) {{ streaming = false; return; }}
+      if (!supportsRequestStreams()) {{
+        alert('Bu tarayıcı akışlı gönderimi desteklemiyor; fotoğraf modunu kullanın.');
+        return;
+      }}
+      const video = document.getElementById('video');
+      const status = document.getElementById('streamStatus');
+      const header = new ArrayBuffer(4);
+      streaming = true;
+      btn.textContent = '⏹ Durdur';
+      status.style.display = 'block';
+      status.textContent = '👀 Bekleniyor…';
+
+      const body = new ReadableStream({{
+        async pull(controller) {{
+          await new Promise(r => setTimeout(r, frameInterval));
+          if (!streaming) {{
+            controller.enqueue(new Uint8Array(4));  // uzunluk 0 -> akış sonu
+            controller.close();
+            return;
+          }}
+          const blob = await grabFrame(video);
+          if (!blob) return;
+          const bytes = new Uint8Array(await blob.arrayBuffer());
+          const head = new Uint8Array(4);
+          new DataView(head.buffer).setUint32(0, bytes.length);
+          controller.enqueue(head);
+          controller.enqueue(bytes);
+        }}
+      }});
+
+      const params = new URLSearchParams(window.location.search);
+      const query = new URLSearchParams();
+      query.set('action', document.getElementById('currentAction').value === '/exit_photo' ? 'exit' : 'entry');
+      for (const key of ['kiosk', 'shard', 'camera']) {{
+        if (params.get(key)) query.set(key, params.get(key));
+      }}
+      try {{
+        const res = await fetch('/attendance_stream?' + query.toString(), {{
+          method: 'POST', body, duplex: 'half', headers: {{ 'Content-Type': 'application/octet-stream' }}
+        }});
+        if (!res.ok) throw new Error(res.status + ' ' + await res.text());
+        const reader = res.body.pipeThrough(new TextDecoderStream()).getReader();
+        let buf = '';
+        for (;;) {{
+          const {{ value, done }} = await reader.read();
+          if (done) break;
+          buf += value;
+          const lines = buf.split('\\n');
+          buf = lines.pop();
+          for (const line of lines) if (line) showStreamEvent(JSON.parse(line), status);
+        }}
+      }} catch (err) {{
+        status.textContent = 'Ağ hatası: ' + err;
+      }}
+      streaming = false;
+      btn.textContent = '🎥 Sürekli Mod';
+    }}
+
     document.addEventListener('DOMContentLoaded', () => {{
+      const streamBtn = document.getElementById('streamBtn');
+      if (streamBtn) streamBtn.onclick = (e) => {{ e.preventDefault(); toggleStream(); }};
+
       const snap = document.getElementById('snap');
       if (!snap) return;
 
@@ -249,6 +659,11 @@ HOME_HTML = f'''
           // FormData + Blob gönder
           const fd = new FormData();
           fd.append('photo', blob, 'frame.jpg');
+          // Kiosk kimliği / shard sayfa adresinden iletilir (örn. /?kiosk=bina-a)
+          const page = new URLSearchParams(window.location.search);
+          for (const key of ['kiosk', 'shard']) {{
+            if (page.get(key)) fd.append(key, page.get(key));
+          }}
 
           const url = document.getElementById('currentAction').value;
 
@@ -311,6 +726,25 @@ DASHBOARD_HTML = f'''
     <main class="container py-4">
       <div class="card p-3" style="background:#fff; border:1px solid #e6eefc; border-radius:16px;">
         <h3 class="mb-3">Attendance Table</h3>
+        <form method="get" class="row g-2 mb-3 align-items-end">
+          <div class="col-auto">
+            <label class="form-label">Person ID</label>
+            <input type="text" class="form-control" name="person_id" value="{{{{ filters.person_id or '' }}}}">
+          </div>
+          <div class="col-auto">
+            <label class="form-label">From</label>
+            <input type="date" class="form-control" name="from" value="{{{{ filters['from'] or '' }}}}">
+          </div>
+          <div class="col-auto">
+            <label class="form-label">To</label>
+            <input type="date" class="form-control" name="to" value="{{{{ filters.to or '' }}}}">
+          </div>
+          <div class="col-auto d-flex gap-2">
+            <button class="btn btn-primary" type="submit">Filtrele</button>
+            <a class="btn btn-outline" href="{{{{ url_for('export_attendance', fmt='csv', **filters) }}}}">CSV</a>
+            <a class="btn btn-outline" href="{{{{ url_for('export_attendance', fmt='ndjson', **filters) }}}}">NDJSON</a>
+          </div>
+        </form>
         <div class="table-responsive">
           <table class="table table-hover table-bordered align-middle">
             <thead>
@@ -330,6 +764,14 @@ DASHBOARD_HTML = f'''
             </tbody>
           </table>
         </div>
+        <div class="d-flex gap-2 justify-content-end">
+          {{% if is_filtered_page %}}
+            <a class="btn btn-outline" href="{{{{ url_for('dashboard', **filters) }}}}">« İlk sayfa</a>
+          {{% endif %}}
+          {{% if next_cursor %}}
+            <a class="btn btn-primary" href="{{{{ url_for('dashboard', before=next_cursor, per_page=per_page, **filters) }}}}">Sonraki »</a>
+          {{% endif %}}
+        </div>
       </div>
     </main>
   </div>
@@ -373,6 +815,10 @@ ADD_USER_HTML = f'''
             <label class="form-label">Face Image</label>
             <input type="file" class="form-control" name="face_image" accept="image/*" required>
           </div>
+          <div class="mb-3">
+            <label class="form-label">Shards (optional)</label>
+            <input type="text" class="form-control" name="shards" placeholder="building-a, physics101">
+          </div>
           <button class="btn btn-primary" type="submit">Add</button>
         </form>
       </div>
@@ -388,46 +834,172 @@ ADD_USER_HTML = f'''
 def home():
     return render_template_string(HOME_HTML)
 
+def _int_arg(args, key, default, lo, hi):
+    """Sorgu parametresinden [lo, hi] aralığına kırpılmış tamsayı; boş/geçersizse default."""
+    try:
+        value = int(args.get(key) or default)
+    except ValueError:
+        value = default
+    return max(lo, min(value, hi))
+
+def _attendance_filters(args):
+    """
+    person_id, from, to (YYYY-MM-DD, to dahil) -> (SQL koşulları, geçerli filtreler)
+    Geçersiz tarih yok sayılır.
+    """
+    conds, filters = [], {}
+    person_id = (args.get("person_id") or "").strip()
+    if person_id:
+        conds.append(Attendance.person_id == person_id)
+        filters["person_id"] = person_id
+    for key in ("from", "to"):
+        try:
+            day = datetime.strptime(args.get(key, ""), "%Y-%m-%d")
+        except ValueError:
+            continue
+        filters[key] = args[key]
+        if key == "from":
+            conds.append(Attendance.entry_time >= day)
+        else:
+            conds.append(Attendance.entry_time < day + timedelta(days=1))
+    return conds, filters
+
+def _parse_cursor(value):
+    """ "2025-01-31T08:15:00.123456_42" -> (datetime, id) ya da None """
+    try:
+        ts, _, rid = (value or "").rpartition("_")
+        return datetime.fromisoformat(ts), int(rid)
+    except ValueError:
+        return None
+
 @app.route('/dashboard')
 def dashboard():
-    data = Attendance.query.order_by(Attendance.entry_time.desc()).all()
-    return render_template_string(DASHBOARD_HTML, data=data)
+    """
+    Keyset (seek) sayfalama: (entry_time, id) azalan sırada, ?before=<entry_time>_<id>
+    imlecinden sonraki per_page satır. OFFSET yok; sayfa maliyeti tablo boyutundan bağımsız.
+    """
+    conds, filters = _attendance_filters(request.args)
+    per_page = _int_arg(request.args, "per_page", 50, 1, 500)
+    query = Attendance.query.filter(Attendance.entry_time.isnot(None), *conds)
+
+    cursor = _parse_cursor(request.args.get("before"))
+    if cursor:
+        ts, rid = cursor
+        query = query.filter(or_(
+            Attendance.entry_time < ts,
+            and_(Attendance.entry_time == ts, Attendance.id < rid),
+        ))
+
+    data = query.order_by(Attendance.entry_time.desc(), Attendance.id.desc()).limit(per_page + 1).all()
+    next_cursor = None
+    if len(data) > per_page:
+        data = data[:per_page]
+        last = data[-1]
+        next_cursor = f"{last.entry_time.isoformat()}_{last.id}"
+    return render_template_string(DASHBOARD_HTML, data=data, filters=filters, per_page=per_page,
+                                  next_cursor=next_cursor, is_filtered_page=cursor is not None)
+
+EXPORT_CHUNK = 1000
+EXPORT_COLUMNS = ("id", "person_id", "name", "entry_time", "exit_time", "duration_seconds")
+
+@app.route('/export.<fmt>')
+def export_attendance(fmt):
+    """
+    Filtrelenmiş Attendance'ı CSV ya da NDJSON olarak akıtır (entry_time artan).
+    Satırlar sunucu tarafı cursor'dan (yield_per -> stream_results) EXPORT_CHUNK'lık
+    parçalarla okunur; ORM nesnesi oluşturulmaz, worker belleği tablo boyutuyla büyümez.
+    """
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"status": "error", "message": "Unknown format"}), 404
+    conds, filters = _attendance_filters(request.args)
+    stmt = (
+        select(Attendance.id, Attendance.person_id, Attendance.name,
+               Attendance.entry_time, Attendance.exit_time, Attendance.duration)
+        .where(*conds)
+        .order_by(Attendance.entry_time, Attendance.id)
+        .execution_options(yield_per=EXPORT_CHUNK)
+    )
+
+    def fmt_row(r):
+        return (r.id, r.person_id, r.name,
+                r.entry_time.isoformat() if r.entry_time else None,
+                r.exit_time.isoformat() if r.exit_time else None,
+                r.duration.total_seconds() if r.duration is not None else None)
+
+    def generate():
+        result = db.session.execute(stmt)
+        try:
+            if fmt == "csv":
+                buf = io.StringIO()
+                writer = csv.writer(buf)
+                writer.writerow(EXPORT_COLUMNS)
+                for part in result.partitions():
+                    for r in part:
+                        writer.writerow(["" if v is None else v for v in fmt_row(r)])
+                    yield buf.getvalue()
+                    buf.seek(0)
+                    buf.truncate()
+                yield buf.getvalue()
+            else:
+                for part in result.partitions():
+                    yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, fmt_row(r))), ensure_ascii=False) + "\n"
+                                  for r in part)
+        finally:
+            result.close()
+
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    resp = Response(stream_with_context(generate()), mimetype=mimetype)
+    resp.headers["Content-Disposition"] = f"attachment; filename=attendance.{fmt}"
+    return resp
 
 @app.route('/add_user', methods=['GET', 'POST'])
 def add_user():
     if request.method == 'POST':
         username = request.form.get('username', '').strip()
         file = request.files.get('face_image')
+        # Virgülle ayrılmış shard'lar (site/sınıf/grup); kişi ayrıca global galeriye de eklenir
+        shards = sorted({s.strip() for s in request.form.get('shards', '').split(',') if s.strip()})
         if not username:
             return redirect(url_for('add_user'))
         if not file:
             return redirect(url_for('add_user'))
 
         # Görseli yükle ve encode çıkar
+        timings = {}
+        t0 = time.perf_counter()
         try:
-            img = Image.open(file.stream).convert("RGB")
+            img = decode_image(file.stream, "add_user")
         except Exception:
             return redirect(url_for('add_user'))
+        timings["decode_ms"] = _ms(t0)
 
-        img_np = np.array(img)
-        face_locs = face_recognition.face_locations(img_np)
+        _, face_locs, encodings = encode_faces(img, "add_user", timings, max_faces=1)
+        g.timings = timings
         if not face_locs:
             return redirect(url_for('add_user'))
 
-        enc = face_recognition.face_encodings(img_np, face_locs)[0]
+        enc = encodings[0]
 
-        # Basit pickle veritabanı (ephemeral). Kalıcı istersen tabloya taşıyabiliriz.
-        if os.path.exists("face_db.pickle"):
-            with open("face_db.pickle", "rb") as f:
-                encodings, names, ids = pickle.load(f)
-        else:
-            encodings, names, ids = [], [], []
-        new_id = f"{len(ids)+1:03d}"
-        encodings.append(enc)
-        names.append(username)
-        ids.append(new_id)
-        with open("face_db.pickle", "wb") as f:
-            pickle.dump((encodings, names, ids), f)
+        # Aynı isimli ve yüzü yakın bir kişi varsa örnek ona eklenir (sıkıştırmada prototiplere katlanır)
+        person_id = None
+        known = load_gallery()
+        if known is not None:
+            name = gallery.normalize_name(username)
+            person_id = next((m["id"] for m in ann.get_searcher(known).search(enc, k=5)
+                              if m["distance"] <= SAMPLE_TOLERANCE and gallery.normalize_name(m["name"]) == name), None)
+
+        # Galeri dosyası yeniden yazılmaz: kilitli, append-only kayıt günlüğüne eklenir
+        # (id ataması da kilit altında; arka planda ana galeriye katlanır)
+        t0 = time.perf_counter()
+        try:
+            if gallery_db is not None:
+                gallery_db.enroll(username, enc, shards=shards, person_id=person_id)
+            else:
+                gallery.enroll(username, enc, shards=shards, person_id=person_id)
+        except ValueError:
+            return redirect(url_for('add_user'))
+        timings["enroll_ms"] = _ms(t0)
+        app.logger.info("add_user timings: %s", timings)
 
         return redirect(url_for('add_user'))
 
@@ -442,119 +1014,846 @@ def attendance_photo():
 def exit_photo():
     return process_photo(is_entry=False)
 
+# ----------------- SON OLAY ÖNBELLEĞİ (2 saat kuralı) -----------------
+# person_id -> (son kaydın entry_time, exit_time, önbelleğe alınma anı)
+# Sadece girişlerin "engellendi" kararı önbellekten verilir: başka bir worker'ın yazdığı daha yeni
+# bir kayıt ancak daha yeni bir giriştir ve girişi yine engeller. Çıkışlar için bu geçerli değil
+# (A'da çıkış önbellekte, B'de yeniden giriş, A'da ikinci çıkış DB'ye göre serbest), bu yüzden
+# çıkışlar ve izin verilecek işlemler her zaman DB'ye (indeksli) gider.
+DUPLICATE_WINDOW = timedelta(hours=2)
+LAST_EVENT_TTL = float(os.environ.get("LAST_EVENT_TTL", "300"))
+LAST_EVENT_CACHE_SIZE = int(os.environ.get("LAST_EVENT_CACHE_SIZE", "50000"))
+_last_events = OrderedDict()
+_last_events_lock = threading.Lock()
+_last_event_stats = {"hits": 0, "misses": 0, "db_queries": 0}
+
+def _remember_last_event(person_id, entry_time, exit_time):
+    with _last_events_lock:
+        _last_events[person_id] = (entry_time, exit_time, time.monotonic())
+        _last_events.move_to_end(person_id)
+        while len(_last_events) > LAST_EVENT_CACHE_SIZE:
+            _last_events.popitem(last=False)
+
+def _is_duplicate(entry_time, exit_time, is_entry, now):
+    if is_entry:
+        return entry_time is not None and (now - entry_time) < DUPLICATE_WINDOW
+    return exit_time is not None and (now - exit_time) < DUPLICATE_WINDOW
+
+def apply_attendance(person_id, name, is_entry, now):
+    """
+    2 saat kuralını uygular ve giriş/çıkışı session'a yazar (commit çağıranda).
+    Write-behind modunda olay tampona eklenir, toplu olarak yazılır.
+    Çıktı: "blocked" (tekrarlı işlem), "recorded" ya da "no_open_entry" (açık giriş yok)
+    """
+    with _last_events_lock:
+        cached = _last_events.get(person_id) if is_entry else None
+    if cached is not None and time.monotonic() - cached[2] < LAST_EVENT_TTL \
+            and _is_duplicate(cached[0], cached[1], is_entry, now):
+        _last_event_stats["hits"] += 1
+        return "blocked"
+    _last_event_stats["misses"] += 1
+
+    if attendance_buffer is not None:
+        return _apply_buffered(person_id, name, is_entry, now)
+
+    _last_event_stats["db_queries"] += 1
+    last_record = Attendance.query.filter_by(person_id=person_id).order_by(Attendance.entry_time.desc()).first()
+    if last_record:
+        _remember_last_event(person_id, last_record.entry_time, last_record.exit_time)
+    if last_record and _is_duplicate(last_record.entry_time, last_record.exit_time, is_entry, now):
+        return "blocked"
+
+    if is_entry:
+        db.session.add(Attendance(person_id=person_id, name=name, entry_time=now))
+        apply_rollups([(person_id, name, now, None, True)])
+        _remember_last_event(person_id, now, None)
+        return "recorded"
+    if last_record and last_record.exit_time is None:
+        last_record.exit_time = now
+        last_record.duration = last_record.exit_time - last_record.entry_time
+        apply_rollups([(person_id, last_record.name, last_record.entry_time, now, False)])
+        _remember_last_event(person_id, last_record.entry_time, now)
+        return "recorded"
+    return "no_open_entry"
+
+# ----------------- GÜNLÜK ÖZET (ROLLUP) -----------------
+def _rollup_deltas(events):
+    """
+    events: [(person_id, name, entry_time, exit_time, is_new_entry), ...]
+    is_new_entry: oturum bu olayla açıldı; exit_time doluysa oturum bu olayla kapandı.
+    Çıktı: (person_id, day) -> artış değerleri (aynı batch'te aynı anahtar tek satıra indirgenir)
+    """
+    deltas = {}
+    for person_id, name, entry_time, exit_time, is_new_entry in events:
+        d = deltas.setdefault((person_id, entry_time.date()), {
+            "person_id": person_id, "day": entry_time.date(), "name": name, "first_entry": None,
+            "last_exit": None, "total_seconds": 0.0, "sessions": 0, "open_sessions": 0})
+        if name:
+            d["name"] = name
+        if is_new_entry:
+            d["sessions"] += 1
+            d["open_sessions"] += 1
+            d["first_entry"] = min(filter(None, (d["first_entry"], entry_time)))
+        if exit_time is not None:
+            d["open_sessions"] -= 1
+            d["total_seconds"] += (exit_time - entry_time).total_seconds()
+            d["last_exit"] = max(filter(None, (d["last_exit"], exit_time)))
+    return deltas
+
+def apply_rollups(events):
+    """
+    Attendance yazımıyla aynı transaction içinde DailyAttendance'ı artımlı günceller.
+    Postgres/SQLite'ta tek INSERT .. ON CONFLICT DO UPDATE (worker'lar arası yarışa dayanıklı).
+    open_sessions 0'ın altına inmez: kişi-günün satırı yokken gelen çıkış (backfill öncesi ya da
+    gece yarısını aşan giriş) açık oturum sayısını eksiye düşürmez.
+    """
+    rows = list(_rollup_deltas(events).values())
+    if not rows:
+        return
+    dialect = db.session.get_bind().dialect.name
+    if dialect not in ("postgresql", "sqlite"):
+        for r in rows:
+            row = db.session.get(DailyAttendance, (r["person_id"], r["day"]))
+            if row is None:
+                db.session.add(DailyAttendance(**dict(r, open_sessions=max(0, r["open_sessions"]))))
+                continue
+            row.name = r["name"] or row.name
+            row.first_entry = min(filter(None, (row.first_entry, r["first_entry"])), default=None)
+            row.last_exit = max(filter(None, (row.last_exit, r["last_exit"])), default=None)
+            row.total_seconds += r["total_seconds"]
+            row.sessions += r["sessions"]
+            row.open_sessions = max(0, row.open_sessions + r["open_sessions"])
+        return
+
+    t = DailyAttendance.__table__
+    stmt = (postgresql.insert if dialect == "postgresql" else sqlite.insert)(t)
+    ex = stmt.excluded
+    # Eklenen satırın open_sessions'ı kırpılır; çakışmada ham artış (open_delta) uygulanır
+    opened = t.c.open_sessions + bindparam("open_delta")
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[t.c.person_id, t.c.day],
+        set_={
+            "name": func.coalesce(ex.name, t.c.name),
+            "total_seconds": t.c.total_seconds + ex.total_seconds,
+            "sessions": t.c.sessions + ex.sessions,
+            "open_sessions": case((opened < 0, 0), else_=opened),
+            "first_entry": case(
+                (ex.first_entry.is_(None), t.c.first_entry),
+                (or_(t.c.first_entry.is_(None), ex.first_entry < t.c.first_entry), ex.first_entry),
+                else_=t.c.first_entry),
+            "last_exit": case(
+                (ex.last_exit.is_(None), t.c.last_exit),
+                (or_(t.c.last_exit.is_(None), ex.last_exit > t.c.last_exit), ex.last_exit),
+                else_=t.c.last_exit),
+        },
+    )
+    for r in rows:
+        db.session.execute(stmt, dict(r, open_sessions=max(0, r["open_sessions"]), open_delta=r["open_sessions"]))
+
+def backfill_rollups():
+    """DailyAttendance'ı ham Attendance'tan baştan kurar (satırlar parça parça akıtılır)."""
+    result = db.session.execute(
+        select(Attendance.person_id, Attendance.name, Attendance.entry_time, Attendance.exit_time)
+        .where(Attendance.entry_time.isnot(None))
+        .execution_options(yield_per=EXPORT_CHUNK)
+    )
+    deltas = {}
+    for part in result.partitions():
+        for key, d in _rollup_deltas((r.person_id, r.name, r.entry_time, r.exit_time, True) for r in part).items():
+            acc = deltas.get(key)
+            if acc is None:
+                deltas[key] = d
+                continue
+            acc["name"] = d["name"] or acc["name"]
+            acc["first_entry"] = min(filter(None, (acc["first_entry"], d["first_entry"])), default=None)
+            acc["last_exit"] = max(filter(None, (acc["last_exit"], d["last_exit"])), default=None)
+            for k in ("total_seconds", "sessions", "open_sessions"):
+                acc[k] += d[k]
+    db.session.query(DailyAttendance).delete()
+    rows = list(deltas.values())
+    for start in range(0, len(rows), EXPORT_CHUNK):
+        db.session.execute(insert(DailyAttendance), rows[start:start + EXPORT_CHUNK])
+    db.session.commit()
+    return len(rows)
+
+@app.cli.command("backfill-rollups")
+def backfill_rollups_command():
+    """DailyAttendance özet tablosunu mevcut kayıtlardan yeniden oluştur."""
+    db.create_all()
+    print(f"{backfill_rollups()} person-day rows written.")
+
+@app.cli.command("merge-duplicates")
+@click.option("--max-distance", type=float, default=MATCH_TOLERANCE, show_default=True,
+              help="Max centroid distance for two same-name identities to be merged.")
+@click.option("--dry-run", is_flag=True, help="Only print the id mapping.")
+def merge_duplicates_command(max_distance, dry_run):
+    """Aynı kişinin ayrı id'lerle kayıtlı kopyalarını birleştir (galeri + yoklama kayıtları)."""
+    store = gallery_db if gallery_db is not None else gallery
+    mapping = store.merge_duplicates(max_distance=max_distance, dry_run=dry_run)
+    for old, new in sorted(mapping.items()):
+        print(f"{old} -> {new}")
+    if dry_run or not mapping:
+        print(f"{len(mapping)} duplicate identities{' (dry run)' if dry_run else ''}.")
+        return
+    db.create_all()
+    for old, new in mapping.items():
+        db.session.execute(update(Attendance).where(Attendance.person_id == old).values(person_id=new))
+    db.session.commit()
+    with _last_events_lock:
+        _last_events.clear()
+    print(f"{len(mapping)} identities merged; {backfill_rollups()} person-day rows rebuilt.")
+
+@app.cli.command("gallery-import")
+@click.argument("path", default=gallery.FACE_DB_PATH)
+def gallery_import_command(path):
+    """
+    Dosya galerisini (+ günlük ve shard'lar) gallery_faces tablosuna aktar (GALLERY_BACKEND=db geçişi,
+    embedding.py sonrası). Tablo dosyayla eşitlenir: sadece değişen kişiler yazılır, dosyada olmayanlar silinir.
+    """
+    db.create_all()
+    store = gallery_db or gallerydb.DbGallery(_gallery_engine, GalleryFace.__table__, GalleryMeta.__table__)
+    for shard in [None] + gallery.list_shards(path):
+        src = gallery.shard_path(shard, path) if shard else path
+        g = gallery.rewrite_gallery(lambda g: g, src)
+        store.rewrite(lambda _, g=g: g, shard)
+        print(f"{shard or 'global'}: {len(g)} rows")
+
+@app.cli.command("gallery-compact")
+def gallery_compact_command():
+    """DB galerisinde kişi örneklerini prototiplere sıkıştır (global + tüm shard'lar)."""
+    if gallery_db is None:
+        raise click.ClickException("GALLERY_BACKEND=db değil; dosya galerisi için: python gallery.py compact")
+    for shard in [None] + gallery_db.list_shards():
+        print(f"{shard or 'global'}: {len(gallery_db.rewrite(lambda g: g, shard))} rows")
+
+# ----------------- WRITE-BEHIND (opsiyonel) -----------------
+# ATTENDANCE_WRITE_BEHIND=1: olaylar tamponda birikir, ATTENDANCE_FLUSH_EVENTS olayda ya da
+# ATTENDANCE_FLUSH_SECONDS saniyede bir toplu INSERT/UPDATE + tek commit ile yazılır.
+# 2 saat kuralı önce tampondaki (henüz yazılmamış) olaya bakar. Tampon proses içidir: birden
+# fazla worker'da kapatılır (bkz. configure_server), olaylar doğrudan yazılır.
+def _flush_attendance(events):
+    entries = [
+        {"person_id": e["person_id"], "name": e["name"], "entry_time": e["entry_time"],
+         "exit_time": e["exit_time"], "duration": e["duration"]}
+        for e in events if e["kind"] == "entry"
+    ]
+    exits = [
+        {"id": e["row_id"], "exit_time": e["exit_time"], "duration": e["duration"]}
+        for e in events if e["kind"] == "exit"
+    ]
+    with app.app_context():
+        try:
+            if entries:
+                db.session.execute(insert(Attendance), entries)
+            if exits:
+                db.session.execute(update(Attendance), exits)
+            apply_rollups([
+                (e["person_id"], e.get("name"), e["entry_time"], e["exit_time"], e["kind"] == "entry")
+                for e in events
+            ])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
+
+attendance_buffer = None
+if os.environ.get("ATTENDANCE_WRITE_BEHIND", "0") == "1":
+    attendance_buffer = writebehind.WriteBehindBuffer(
+        _flush_attendance,
+        max_events=int(os.environ.get("ATTENDANCE_FLUSH_EVENTS", "100")),
+        max_delay=float(os.environ.get("ATTENDANCE_FLUSH_SECONDS", "1.0")),
+    )
+
+def _apply_buffered(person_id, name, is_entry, now):
+    pending = attendance_buffer.latest(person_id)
+    if pending is not None:
+        # Tampondaki olay DB'deki her şeyden yeni
+        entry_time, exit_time = pending["entry_time"], pending["exit_time"]
+        row_id = pending.get("row_id")
+    else:
+        _last_event_stats["db_queries"] += 1
+        last = db.session.execute(
+            select(Attendance.id, Attendance.entry_time, Attendance.exit_time)
+            .where(Attendance.person_id == person_id)
+            .order_by(Attendance.entry_time.desc()).limit(1)
+        ).first()
+        entry_time, exit_time, row_id = (last.entry_time, last.exit_time, last.id) if last else (None, None, None)
+    if entry_time is not None:
+        _remember_last_event(person_id, entry_time, exit_time)
+    if _is_duplicate(entry_time, exit_time, is_entry, now):
+        return "blocked"
+
+    if is_entry:
+        attendance_buffer.add(person_id, {"kind": "entry", "person_id": person_id, "name": name,
+                                          "entry_time": now, "exit_time": None, "duration": None})
+        _remember_last_event(person_id, now, None)
+        return "recorded"
+    if entry_time is None or exit_time is not None:
+        return "no_open_entry"
+    changes = {"exit_time": now, "duration": now - entry_time}
+    if pending is not None and pending["kind"] == "entry":
+        # Giriş henüz yazılmadı: çıkışı aynı INSERT'e kat
+        if not attendance_buffer.merge(person_id, pending, changes):
+            # Bu arada yazılmaya başladı -> DB'den tekrar değerlendir
+            return _apply_buffered(person_id, name, is_entry, now)
+    else:
+        attendance_buffer.add(person_id, dict({"kind": "exit", "person_id": person_id, "row_id": row_id,
+                                               "entry_time": entry_time}, **changes))
+    _remember_last_event(person_id, entry_time, now)
+    return "recorded"
+
+def _rollup_json(r):
+    return {
+        "person_id": r.person_id, "name": r.name, "day": r.day.isoformat(),
+        "first_entry": r.first_entry.isoformat() if r.first_entry else None,
+        "last_exit": r.last_exit.isoformat() if r.last_exit else None,
+        "hours": round(r.total_seconds / 3600.0, 2),
+        "sessions": r.sessions, "open_sessions": r.open_sessions,
+    }
+
+@app.route('/reports/daily')
+def report_daily():
+    """
+    DailyAttendance'tan rapor. Parametreler: from, to (YYYY-MM-DD), person_id,
+    group=day|week|month (varsayılan day), late_after=HH:MM (ilk giriş bu saatten sonraysa late).
+    """
+    conds = []
+    person_id = (request.args.get("person_id") or "").strip()
+    if person_id:
+        conds.append(DailyAttendance.person_id == person_id)
+    try:
+        if request.args.get("from"):
+            conds.append(DailyAttendance.day >= date.fromisoformat(request.args["from"]))
+        if request.args.get("to"):
+            conds.append(DailyAttendance.day <= date.fromisoformat(request.args["to"]))
+        late_after = datetime.strptime(request.args.get("late_after", "09:00"), "%H:%M").time()
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid date/time"}), 400
+    group = request.args.get("group", "day")
+    if group not in ("day", "week", "month"):
+        return jsonify({"status": "error", "message": "group must be day, week or month"}), 400
+
+    rows = (DailyAttendance.query.filter(*conds)
+            .order_by(DailyAttendance.day, DailyAttendance.person_id).all())
+    if group == "day":
+        out = []
+        for r in rows:
+            item = _rollup_json(r)
+            item["late"] = bool(r.first_entry and r.first_entry.time() > late_after)
+            out.append(item)
+        return jsonify({"status": "ok", "group": "day", "rows": out}), 200
+
+    periods = {}
+    for r in rows:
+        if group == "week":
+            y, w, _ = r.day.isocalendar()
+            period = f"{y}-W{w:02d}"
+        else:
+            period = r.day.strftime("%Y-%m")
+        p = periods.setdefault((period, r.person_id), {
+            "period": period, "person_id": r.person_id, "name": r.name,
+            "hours": 0.0, "days_present": 0, "sessions": 0, "late_days": 0})
+        p["hours"] += r.total_seconds / 3600.0
+        p["days_present"] += 1 if r.sessions else 0
+        p["sessions"] += r.sessions
+        p["late_days"] += 1 if r.first_entry and r.first_entry.time() > late_after else 0
+    out = [dict(p, hours=round(p["hours"], 2)) for p in periods.values()]
+    return jsonify({"status": "ok", "group": group, "rows": out}), 200
+
+@app.route('/reports/inside')
+def report_inside():
+    """Hâlâ içeride olanlar (açık oturumu olan kişi-günler, son ?days=N gün; varsayılan 1)."""
+    days = _int_arg(request.args, "days", 1, 1, 31)
+    since = date.today() - timedelta(days=days - 1)
+    rows = (DailyAttendance.query
+            .filter(DailyAttendance.day >= since, DailyAttendance.open_sessions > 0)
+            .order_by(DailyAttendance.first_entry).all())
+    return jsonify({"status": "ok", "count": len(rows), "rows": [_rollup_json(r) for r in rows]}), 200
+
+@app.route('/attendance/cache_stats')
+def attendance_cache_stats():
+    with _last_events_lock:
+        size = len(_last_events)
+    out = dict(_last_event_stats, size=size, ttl=LAST_EVENT_TTL)
+    if attendance_buffer is not None:
+        out["write_behind"] = attendance_buffer.stats()
+    return jsonify(out), 200
+
+@app.route('/recognition/cache_stats')
+def recognition_cache_stats():
+    """Tanıma sonucu önbelleği: hits, misses, hit_rate, saved_ms (atlanan tespit+encoding süresi)."""
+    if recognition_cache is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify(dict(recognition_cache.stats(), enabled=True)), 200
+
 def process_photo(is_entry: bool):
     """
     Yeni yöntem: JPEG Blob (multipart/form-data) bekler: field adı 'photo'
-    JSON döner: {status, action, name, confidence, recognized, person_id?}
+    JSON döner: {status, action, name, confidence, recognized, person_id?, timings}
+    RECOGNITION_MODE=async (ya da ?mode=async) ise iş kuyruğa alınır: 202 + job_id
+    (sunucu yapısı izin vermiyorsa, bkz. async_mode_allowed(), sync işlenir).
+    Kısa süre önce tanınmış (algısal hash'i yakın) kare önbellekten cevaplanır (bkz. resultcache.py).
     """
     file = request.files.get('photo')
     if not file:
         return jsonify({"status": "error", "message": "No photo"}), 400
 
     try:
-        image = Image.open(file.stream).convert("RGB")
+        scope = request_scope()
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    data = file.read()
+    timings = g.timings = {}
+    cache_key = None
+    if recognition_cache is not None:
+        t0 = time.perf_counter()
+        try:
+            action = f"{request.endpoint}:{','.join(scope[0])}:{int(scope[1])}"
+            cache_key = (resultcache.frame_hash(data), action, _gallery_version(scope))
+        except Exception:
+            return jsonify({"status": "error", "message": "Invalid image"}), 400
+        timings["hash_ms"] = _ms(t0)
+        outcome = recognition_cache.get(*cache_key)
+        if outcome is not None:
+            # Aynı kare kısa süre önce tanındı: face_recognition çalıştırılmaz, kurallar yeniden uygulanır
+            timings["cache"] = "hit"
+            return jsonify(photo_result(outcome, is_entry, timings)), 200
+
+    if request.args.get("mode", app.config["RECOGNITION_MODE"]) == "async" and async_mode_allowed():
+        return submit_photo_job(data, is_entry, request.endpoint, cache_key, scope)
+
+    t0 = time.perf_counter()
+    try:
+        image = decode_image(io.BytesIO(data), request.endpoint)
     except Exception:
         return jsonify({"status": "error", "message": "Invalid image"}), 400
+    timings["decode_ms"] = _ms(t0)
 
-    img_array = np.array(image)
+    _, _, encodings = encode_faces(image, request.endpoint, timings, max_faces=1)
+    outcome = match_frame(encodings, timings, scope)
+    _cache_outcome(cache_key, outcome, timings)
+    return jsonify(photo_result(outcome, is_entry, timings)), 200
 
-    face_locs = face_recognition.face_locations(img_array)
-    if not face_locs:
-        return jsonify({
-            "status": "ok",
-            "action": "Görüntü",
-            "name": "Yüz bulunamadı",
-            "confidence": 0.0,
-            "recognized": False
-        }), 200
+def _gallery_version(scope):
+    """Önbellek anahtarı için kapsamdaki galerilerin güncel sürümleri (yükleme kontrolü önce yapılır)."""
+    shards, fallback = scope
+    scopes = list(shards)
+    if not shards or fallback:
+        scopes.append(None)
+    for shard in scopes:
+        load_gallery(shard)
+    return tuple(gallery_version(shard) for shard in scopes)
 
-    face_enc = face_recognition.face_encodings(img_array, face_locs)[0]
+def _cache_outcome(cache_key, outcome, timings):
+    if cache_key is not None:
+        cost = sum(timings.get(k, 0.0) for k in ("decode_ms", "detect_ms", "encode_ms", "match_ms"))
+        recognition_cache.put(*cache_key, outcome, cost_ms=cost)
 
-    if not os.path.exists("face_db.pickle"):
-        return jsonify({
-            "status": "ok",
-            "action": "Görüntü",
-            "name": "Veritabanı boş",
-            "confidence": 0.0,
-            "recognized": False
-        }), 200
+def _cpu_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            _process_pool = ProcessPoolExecutor(max_workers=recognition_jobs.workers)
+        return _process_pool
 
-    with open("face_db.pickle", "rb") as f:
-        known_encodings, known_names, known_ids = pickle.load(f)
+def _run_photo_job(data, is_entry, scales, max_side, cache_key=None, scope=((), False)):
+    """Arka plan işi: CPU aşaması (thread ya da proses havuzu) + eşleştirme/kayıt (app context'te)."""
+    if app.config["RECOGNITION_EXECUTOR"] == "process":
+        encodings, timings = _cpu_pool().submit(detection.recognize_bytes, data, scales, 1, max_side).result()
+    else:
+        encodings, timings = detection.recognize_bytes(data, scales, 1, max_side)
+    if encodings is None:
+        return {"status": "error", "message": "Invalid image"}, 400
+    with app.app_context():
+        try:
+            outcome = match_frame(encodings, timings, scope)
+            _cache_outcome(cache_key, outcome, timings)
+            result = photo_result(outcome, is_entry, timings)
+            # İstek çoktan döndü: aşama süreleri iş bitince kaydedilir
+            metrics.observe_stages("photo_job", timings)
+            return result, 200
+        finally:
+            db.session.remove()
 
-    # Eşik (tolerance) ve confidence uyumlu
-    tolerance = 0.45
-    distances = face_recognition.face_distance(known_encodings, face_enc)
+def submit_photo_job(data, is_entry, endpoint, cache_key=None, scope=((), False)):
+    job = recognition_jobs.submit(_run_photo_job, data, is_entry, app.config["DETECT_SCALES"][endpoint],
+                                  app.config["INGEST_MAX_SIDE"][endpoint], cache_key, scope)
+    if job is None:
+        # Kuyruk dolu: zaman aşımına düşmek yerine açıkça reddet
+        retry = recognition_jobs.retry_after()
+        resp = jsonify({"status": "busy", "message": "Recognition queue is full", "retry_after": retry})
+        resp.headers["Retry-After"] = str(retry)
+        return resp, 429
+    resp = jsonify({"status": "queued", "job_id": job.id, "poll": url_for('job_status', job_id=job.id)})
+    resp.headers["Location"] = url_for('job_status', job_id=job.id)
+    return resp, 202
 
-    if len(distances) == 0:
-        return jsonify({
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """
+    İş sonucu. ?wait=N ile en fazla N saniye (<= 25) sonucu bekler (long-poll).
+    Bitmişse: işin JSON sonucu (+ job bilgisi); bitmemişse 202 {status: pending}.
+    """
+    job = recognition_jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job"}), 404
+    try:
+        wait = min(float(request.args.get("wait", 0) or 0), 25.0)
+    except ValueError:
+        wait = 0.0
+    if wait > 0:
+        job.done.wait(wait)
+    if job.finished is None:
+        return jsonify({"status": "pending", "job": job.to_dict()}), 202
+    if job.error is not None:
+        return jsonify({"status": "error", "message": job.error, "job": job.to_dict()}), 500
+    payload, code = job.result
+    return jsonify(dict(payload, job=job.to_dict())), code
+
+@app.route('/jobs/stats')
+def job_stats():
+    return jsonify(recognition_jobs.stats()), 200
+
+def match_frame(encodings, timings, scope=((), False)):
+    """
+    Encode edilmiş kareyi kapsamdaki galeride arar (önbelleğe alınabilen kısım; DB'ye dokunmaz).
+    Çıktı: ("no_face" | "empty_db" | "no_people", None) ya da ("match", {id, name, distance, shard})
+    """
+    if not encodings:
+        return ("no_face", None)
+
+    # Galeriler worker belleğinde tutulur; dosya değişmedikçe diskten okunmaz
+    loaded, best = search_scope(np.asarray(encodings[:1]), scope, timings)
+    if not loaded:
+        return ("empty_db", None)
+    if best[0] is None:
+        return ("no_people", None)
+    return ("match", best[0])
+
+def photo_result(outcome, is_entry, timings):
+    """
+    match_frame sonucundan eşik + 2 saat kuralı + kayıt (önbellek isabetinde de her seferinde).
+    Çıktı: JSON gövdesi (dict)
+    """
+    kind, best = outcome
+    if kind != "match":
+        return {
             "status": "ok",
             "action": "Görüntü",
-            "name": "Kayıtlı kişi yok",
+            "name": {"no_face": "Yüz bulunamadı", "empty_db": "Veritabanı boş",
+                     "no_people": "Kayıtlı kişi yok"}[kind],
             "confidence": 0.0,
-            "recognized": False
-        }), 200
+            "recognized": False,
+            "timings": timings
+        }
 
-    best_idx = int(np.argmin(distances))
-    best_dist = float(distances[best_idx])
+    # Eşik (tolerance) ve confidence uyumlu
+    tolerance = MATCH_TOLERANCE
+    best_dist = best["distance"]
     conf = face_confidence(best_dist, match_threshold=tolerance)  # % değer
 
     is_match = best_dist <= tolerance
     action_text = "Giriş" if is_entry else "Çıkış"
 
     if is_match:
-        name_only = known_names[best_idx]
-        person_id = known_ids[best_idx]
+        name_only = best["name"]
+        person_id = best["id"]
         now = datetime.now()
 
         # 2 saat kuralı
-        last_record = Attendance.query.filter_by(person_id=person_id).order_by(Attendance.entry_time.desc()).first()
-        if last_record and (
-            (is_entry and last_record.entry_time and (now - last_record.entry_time) < timedelta(hours=2)) or
-            ((not is_entry) and last_record.exit_time and (now - last_record.exit_time) < timedelta(hours=2))
-        ):
+        t0 = time.perf_counter()
+        status = apply_attendance(person_id, name_only, is_entry, now)
+        if status == "blocked":
+            timings["db_ms"] = _ms(t0)
             # Eşleşme var ama tekrar işlem
-            return jsonify({
+            return {
                 "status": "ok",
                 "action": action_text,
                 "name": f"{name_only} ({conf}%) - Tekrarlı işlem engellendi",
                 "confidence": conf,
                 "recognized": True,
-                "person_id": person_id
-            }), 200
-
-        # Kayıt yaz
-        if is_entry:
-            yeni = Attendance(person_id=person_id, name=name_only, entry_time=now)
-            db.session.add(yeni)
-            db.session.commit()
-        else:
-            if last_record and last_record.exit_time is None:
-                last_record.exit_time = now
-                last_record.duration = last_record.exit_time - last_record.entry_time
-                db.session.commit()
+                "person_id": person_id,
+                "timings": timings
+            }
+        db.session.commit()
+        timings["db_ms"] = _ms(t0)
 
-        return jsonify({
+        return {
             "status": "ok",
             "action": action_text,
             "name": f"{name_only} ({conf}%)",
             "confidence": conf,
             "recognized": True,
-            "person_id": person_id
-        }), 200
+            "person_id": person_id,
+            "timings": timings
+        }
 
     else:
         # Eşleşme yok
-        return jsonify({
+        return {
             "status": "ok",
             "action": action_text,
             "name": f"Unknown ({conf}%)",
             "confidence": conf,
-            "recognized": False
+            "recognized": False,
+            "timings": timings
+        }
+
+# ----------------- TOPLU (SINIF) YOKLAMA -----------------
+@app.route('/attendance_batch', methods=['POST'])
+def attendance_batch():
+    """
+    Birden fazla kare (field adı 'photos', çoklu) + action=entry|exit.
+    Tüm karelerdeki tüm yüzler tek vektörel aramayla eşleştirilir; her tanınan kişiye
+    giriş/çıkış ve 2 saat kuralı uygulanır, kayıtlar tek transaction'da yazılır.
+    JSON döner: {status, action, frames, faces, recognized, unknown, results: [...], timings}
+    """
+    files = request.files.getlist('photos')
+    if not files:
+        return jsonify({"status": "error", "message": "No photos"}), 400
+    try:
+        scope = request_scope()
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    is_entry = request.form.get('action', 'entry') != 'exit'
+    action_text = "Giriş" if is_entry else "Çıkış"
+
+    timings = g.timings = {"decode_ms": 0.0, "detect_ms": 0.0, "encode_ms": 0.0}
+    all_encodings, frame_of = [], []
+    for i, file in enumerate(files):
+        t0 = time.perf_counter()
+        try:
+            image = decode_image(file.stream, "attendance_batch")
+        except Exception:
+            return jsonify({"status": "error", "message": f"Invalid image #{i}"}), 400
+        timings["decode_ms"] += _ms(t0)
+
+        frame_t = {}
+        _, _, encodings = encode_faces(image, "attendance_batch", frame_t)
+        timings["detect_ms"] += frame_t["detect_ms"]
+        timings["encode_ms"] += frame_t.get("encode_ms", 0.0)
+        all_encodings.extend(encodings)
+        frame_of.extend([i] * len(encodings))
+
+    loaded, matches = search_scope(np.asarray(all_encodings), scope, timings) if all_encodings else (False, [])
+    if not loaded:
+        return jsonify({
+            "status": "ok", "action": action_text, "frames": len(files), "faces": len(all_encodings),
+            "recognized": 0, "unknown": len(all_encodings), "results": [], "timings": timings
         }), 200
 
+    tolerance = MATCH_TOLERANCE
+
+    # Aynı kişi birden fazla karede/yüzde çıkarsa en yakın eşleşme kullanılır
+    best_by_person, unknown = {}, 0
+    for frame, m in zip(frame_of, matches):
+        if m is None or m["distance"] > tolerance:
+            unknown += 1
+            continue
+        best = best_by_person.get(m["id"])
+        if best is None or m["distance"] < best[0]["distance"]:
+            best_by_person[m["id"]] = (m, frame)
+
+    t0 = time.perf_counter()
+    now = datetime.now()
+    results = []
+    for person_id, (m, frame) in best_by_person.items():
+        status = apply_attendance(person_id, m["name"], is_entry, now)
+        results.append({
+            "person_id": person_id,
+            "name": m["name"],
+            "confidence": face_confidence(m["distance"], match_threshold=tolerance),
+            "status": status,
+            "frame": frame
+        })
+    db.session.commit()
+    timings["db_ms"] = _ms(t0)
+
+    return jsonify({
+        "status": "ok",
+        "action": action_text,
+        "frames": len(files),
+        "faces": len(all_encodings),
+        "recognized": len(results),
+        "unknown": unknown,
+        "results": results,
+        "timings": {k: round(v, 2) if isinstance(v, float) else v for k, v in timings.items()}
+    }), 200
+
+# ----------------- SÜREKLİ AKIŞ MODU -----------------
+# Gövde: uzunluk önekli JPEG kareler (bkz. streaming.py), cevap: satır başına bir JSON olay (NDJSON).
+# Akış bir worker thread'ini bağlantı boyunca tutar: gunicorn'da GUNICORN_THREADS > kamera sayısı
+# olmalı (gthread; sync worker uzun istekte GUNICORN_TIMEOUT ile öldürülür). Bir thread her zaman
+# diğer istekler için ayrılır: threads - açık akış <= 1 ise yeni akış 503 alır.
+stream_registry = streaming.StreamRegistry()
+
+def _stream_frame(tracker, frame_no, data, scope, is_entry, st):
+    """
+    Tek kare: tespit + iz eşleme her karede; encoding + galeri araması sadece encode isteyen izlerde.
+    Tanınan iz için giriş/çıkış (2 saat kuralıyla) bir kez uygulanır. Çıktı: "frame" olayı
+    """
+    timings = {}
+    t0 = time.perf_counter()
+    image = decode_image(io.BytesIO(data), "attendance_stream")
+    timings["decode_ms"] = _ms(t0)
+    boxes, det = detection.detect_faces(image, app.config["DETECT_SCALES"]["attendance_stream"])
+    timings.update(det)
+    tracks = tracker.update(boxes)
+    st.counters["tracks"] = tracker.created
+
+    pending = [t for t in tracks if t.needs_encoding(frame_no)]
+    if pending:
+        t0 = time.perf_counter()
+        encodings = detection.load_models().face_encodings(ingest.to_array(image), [t.box for t in pending])
+        timings["encode_ms"] = _ms(t0)
+        st.counters["frames_encoded"] += 1
+        st.counters["faces_encoded"] += len(pending)
+        _, matches = search_scope(np.asarray(encodings), scope, timings)
+        now, recorded, identified = datetime.now(), False, []
+        t0 = time.perf_counter()
+        try:
+            for track, m in zip(pending, matches):
+                track.attempts += 1
+                track.last_try = frame_no
+                if m is None or m["distance"] > MATCH_TOLERANCE:
+                    continue
+                track.status = apply_attendance(m["id"], m["name"], is_entry, now)
+                track.match = m
+                identified.append(track)
+                recorded |= track.status != "blocked"
+            # Transaction her karede biter: sadece okuma yapılan karede (hepsi "blocked") bağlantı
+            # akış boyunca "idle in transaction" kalmasın
+            if recorded:
+                db.session.commit()
+            else:
+                db.session.rollback()
+        except Exception:
+            db.session.rollback()
+            for track in identified:
+                # Kayıt yazılamadı: iz tanınmamış sayılır, sonraki denemede yeniden uygulanır
+                track.match = track.status = None
+            raise
+        st.counters["identified"] += len(identified)
+        timings["db_ms"] = _ms(t0)
+    metrics.observe_stages("attendance_stream", timings)
+
+    return {
+        "event": "frame",
+        "frame": frame_no,
+        "encoded": len(pending),
+        "tracks": [
+            {"track": t.id, "box": list(t.box),
+             "person_id": t.match["id"] if t.match else None,
+             "name": t.match["name"] if t.match else None,
+             "confidence": face_confidence(t.match["distance"], match_threshold=MATCH_TOLERANCE) if t.match else 0.0,
+             "status": t.status}
+            for t in tracks
+        ],
+        "interval_ms": round(stream_registry.interval() * 1000),
+        "timings": timings,
+    }
+
+def _stream_events(body, scope, is_entry, st):
+    tracker = streaming.FaceTracker()
+    action_text = "Giriş" if is_entry else "Çıkış"
+    yield {"event": "start", "stream": st.stream_id, "action": action_text,
+           "interval_ms": round(stream_registry.interval() * 1000)}
+    next_due, frame_no = 0.0, 0
+    try:
+        for data in streaming.read_frames(body):
+            frame_no += 1
+            st.counters["frames_received"] += 1
+            st.counters["bytes"] += len(data)
+            now = time.monotonic()
+            if now < next_due:
+                # Bütçe aşıldı: kare decode edilmeden atılır
+                st.counters["frames_dropped"] += 1
+                continue
+            next_due = now + stream_registry.interval()
+            t0 = time.perf_counter()
+            try:
+                event = _stream_frame(tracker, frame_no, data, scope, is_entry, st)
+            except (OSError, Image.DecompressionBombError):
+                event = {"event": "error", "frame": frame_no, "message": "Invalid image"}
+            except Exception:
+                # DB hatası vb.: session temizlenir, akış sonraki karelerle sürer (sonda yine "end")
+                db.session.rollback()
+                app.logger.exception("Stream %s: frame %s failed", st.stream_id, frame_no)
+                event = {"event": "error", "frame": frame_no, "message": "Frame processing failed"}
+            st.counters["frames_processed"] += 1
+            st.counters["process_ms"] += _ms(t0)
+            yield event
+    except streaming.FrameError as e:
+        yield {"event": "error", "message": str(e)}
+    yield dict(st.snapshot(), event="end")
+
+@app.route('/attendance_stream', methods=['POST'])
+def attendance_stream():
+    """
+    Sürekli ("kameranın önünden geç") mod: tek kalıcı bağlantı, gövde chunked uzunluk önekli JPEG'ler.
+    action=entry|exit, camera=<ad>, kiosk/shard (bkz. request_scope) query parametresi olarak.
+    Cevap: application/x-ndjson; start, kare başına frame ve sonda end (akış istatistikleri) olayları.
+    """
+    try:
+        scope = request_scope()
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    is_entry = request.args.get("action", "entry") != "exit"
+    st = stream_registry.open(request.args.get("camera") or request.remote_addr)
+    if st is None:
+        return jsonify({"status": "error", "message": "Too many streams", "limit": stream_registry.limit}), 503
+    # Akışın toplam boyutu sınırsız; kare başına sınır STREAM_MAX_FRAME_BYTES
+    request.max_content_length = None
+    body = request.stream
+
+    def generate():
+        try:
+            for event in _stream_events(body, scope, is_entry, st):
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        finally:
+            # Akış biter bitmez thread'i ve akış yuvasını bırak (response kapanışını bekleme)
+            stream_registry.close(st)
+
+    response = Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+    response.headers["X-Accel-Buffering"] = "no"
+    # Üreteç hiç başlamasa da (istemci erken koptu) akış kaydı kapanır
+    response.call_on_close(lambda: stream_registry.close(st))
+    return response
+
+@app.route('/attendance_stream/stats')
+def attendance_stream_stats():
+    return jsonify(stream_registry.stats()), 200
+
+# ----------------- BOOT / WARM-UP -----------------
+# Modeller (face_recognition) lazy import edilir. gunicorn.conf.py warm_up()'ı preload modunda
+# master'da (fork'tan önce, port açılmadan), değilse her worker'da istek kabul etmeden çağırır.
+BOOT_STATS = {"app_import_ms": round((time.perf_counter() - _BOOT_T0) * 1000, 2), "warm": False}
+
+def warm_up():
+    """Model import + dummy encode + galeri yükleme. Çıktı: BOOT_STATS"""
+    detection.warm_up()
+    t0 = time.perf_counter()
+    known = load_gallery()
+    if known is not None:
+        ann.get_searcher(known, wait=True)  # IVF indeksi (açıksa) istekler gelmeden kurulur
+    BOOT_STATS.update(detection.MODEL_STATS, gallery_load_ms=_ms(t0),
+                      gallery_size=len(known) if known is not None else 0, warm=True)
+    return BOOT_STATS
+
+@app.route("/health/ready")
+def health_ready():
+    """Hazırlık kontrolü: warm-up bittiyse 200, yoksa 503; import/boot süreleri raporlanır."""
+    body = dict(BOOT_STATS, status="ready" if BOOT_STATS["warm"] else "warming",
+                models_loaded=detection.face_recognition is not None, pid=os.getpid())
+    return jsonify(body), 200 if BOOT_STATS["warm"] else 503
+
 # ----------------- MAIN -----------------
 if __name__ == '__main__':
     # Lokal geliştirme için. Heroku'da Gunicorn Procfile ile başlatır.
     port = int(os.environ.get("PORT", 5000))
+    warm_up()
     app.run(host="0.0.0.0", port=port, debug=True)
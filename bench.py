@@ -0,0 +1,349 @@
+# bench.py
+# Tekrarlanabilir benchmark: sentetik galeriler (face_db.pickle düzeninde, 1k..1M kişi) ve
+# sentetik yoklama geçmişi üzerinde, Flask test client + SQLite ile endpoint'ler sürülür.
+# Aşama başına p50/p95/p99 (Server-Timing başlığından) ve çekirdek başına throughput raporlanır;
+# sonuçlar JSON'a yazılır. Eşik dosyası ya da baseline aşılırsa çıkış kodu 1. Ağ gerekmez.
+#
+#   python bench.py --image face.jpg --out bench.json
+#   python bench.py --sizes 1000,10000 --baseline bench.json --tolerance 0.25
+#   python bench.py --thresholds limits.json   # {"endpoint/attendance_photo/*/total/p95_ms": 800, ...}
+import os, sys, json, time, random, fnmatch, platform, tempfile, argparse
+import multiprocessing as mp
+from datetime import datetime, timedelta
+import numpy as np
+
+DEFAULT_SIZES = "1000,10000,100000,1000000"
+READ_ENDPOINTS = ("/dashboard", "/reports/daily?group=week", "/reports/inside", "/export.csv")
+
+
+def summarize(samples_ms):
+    if not samples_ms:
+        return {"n": 0}
+    a = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        "n": len(a),
+        "mean_ms": round(float(a.mean()), 3),
+        "p50_ms": round(float(np.percentile(a, 50)), 3),
+        "p95_ms": round(float(np.percentile(a, 95)), 3),
+        "p99_ms": round(float(np.percentile(a, 99)), 3),
+    }
+
+
+def parse_server_timing(header):
+    """ "decode;dur=1.7, detect;dur=32.5, cache;desc=..." -> {"decode": 1.7, "detect": 32.5} """
+    stages = {}
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur":
+                stages[name] = float(value)
+    return stages
+
+
+def cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# ----------------- SENTETİK VERİ -----------------
+def build_gallery(n, probe=None, seed=0):
+    """ann.synthetic_gallery + (varsa) gerçek yüz encoding'i ilk satıra: eşleşme yolu da ölçülür."""
+    import ann
+    from gallery import FaceGallery
+    g = ann.synthetic_gallery(n, seed=seed)
+    if probe is None:
+        return g
+    matrix = np.array(g.matrix, dtype=np.float32)
+    matrix[0] = probe
+    names = list(g.names)
+    names[0] = "bench_person"
+    return FaceGallery(matrix, names, list(g.ids))
+
+
+def build_history(app_module, people, days, seed=0):
+    """
+    people x days sentetik Attendance satırı (~%80 katılım, son gün bir kısmı içeride) + DailyAttendance.
+    Çıktı: {"rows", "insert_s", "backfill_s"}
+    """
+    from sqlalchemy import insert
+    A = app_module
+    rng = random.Random(seed)
+    start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days)
+    rows, total = [], 0
+    t0 = time.perf_counter()
+    for day in range(days + 1):
+        base = start + timedelta(days=day)
+        for p in range(people):
+            if rng.random() > 0.8:
+                continue
+            entry = base + timedelta(hours=8, minutes=rng.randint(0, 90))
+            exit_ = None if day == days and rng.random() < 0.5 else entry + timedelta(minutes=rng.randint(240, 540))
+            rows.append({"person_id": f"h{p:05d}", "name": f"history_{p}", "entry_time": entry,
+                         "exit_time": exit_, "duration": exit_ - entry if exit_ else None})
+            if len(rows) >= 5000:
+                A.db.session.execute(insert(A.Attendance), rows)
+                total += len(rows)
+                rows = []
+    if rows:
+        A.db.session.execute(insert(A.Attendance), rows)
+        total += len(rows)
+    A.db.session.commit()
+    insert_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    A.backfill_rollups()
+    return {"rows": total, "insert_s": round(insert_s, 3), "backfill_s": round(time.perf_counter() - t0, 3)}
+
+
+# ----------------- ÖLÇÜM -----------------
+def bench_match(g, n_queries=200, batch=64, seed=1):
+    """Galeri araması (uygulamanın kullandığı searcher) tek sorgu + toplu sorgu."""
+    import ann
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(g), size=n_queries)
+    queries = g.matrix[picks].astype(np.float64) + rng.normal(0, 0.02, size=(n_queries, g.matrix.shape[1]))
+    searcher = ann.get_searcher(g, wait=True)
+    lat = []
+    for q in queries:
+        t0 = time.perf_counter()
+        searcher.search(q, k=1)
+        lat.append((time.perf_counter() - t0) * 1000)
+    t0 = time.perf_counter()
+    searcher.search_batch(queries[:batch], k=1)
+    batch_s = time.perf_counter() - t0
+    out = summarize(lat)
+    out["index"] = type(searcher).__name__
+    out["batch_queries_per_s"] = round(min(batch, n_queries) / batch_s, 1) if batch_s else None
+    return out
+
+
+_client = None
+
+
+def _post_photo(args):
+    path, frame = args
+    from io import BytesIO
+    t0 = time.perf_counter()
+    r = _client.post(path, data={"photo": (BytesIO(frame), "frame.jpg")}, content_type="multipart/form-data")
+    total = (time.perf_counter() - t0) * 1000
+    return r.status_code, total, parse_server_timing(r.headers.get("Server-Timing"))
+
+
+def _child_init(app_module):
+    # Fork edilen proseste üst prosesin DB bağlantıları kullanılmaz
+    global _client
+    with app_module.app.app_context():
+        app_module.db.engine.dispose()
+    _client = app_module.app.test_client()
+
+
+def bench_photo(app_module, path, frame, requests, procs):
+    """
+    Fotoğraf endpoint'i: toplam gecikme + Server-Timing aşamaları.
+    procs > 1 ise istekler fork edilen proseslere dağıtılır (çekirdek başına throughput).
+    """
+    global _client
+    jobs_ = [(path, frame)] * requests
+    t0 = time.perf_counter()
+    if procs > 1:
+        with mp.get_context("fork").Pool(procs, _child_init, (app_module,)) as pool:
+            results = pool.map(_post_photo, jobs_, chunksize=1)
+    else:
+        _client = app_module.app.test_client()
+        results = [_post_photo(j) for j in jobs_]
+    wall = time.perf_counter() - t0
+
+    stages = {}
+    for _, _, st in results:
+        for name, ms in st.items():
+            stages.setdefault(name, []).append(ms)
+    errors = sum(1 for status, _, _ in results if status >= 400)
+    rps = requests / wall if wall else 0.0
+    return {
+        "total": summarize([t for _, t, _ in results]),
+        "stages": {name: summarize(v) for name, v in stages.items()},
+        "errors": errors,
+        "procs": procs,
+        "throughput_rps": round(rps, 2),
+        "throughput_per_core_rps": round(rps / min(procs, cpu_count()), 2),
+    }
+
+
+def bench_read(client, url, requests):
+    lat = []
+    status = None
+    for _ in range(requests):
+        t0 = time.perf_counter()
+        r = client.get(url)
+        r.get_data()  # akış (export) yanıtları sonuna kadar okunur
+        lat.append((time.perf_counter() - t0) * 1000)
+        status = r.status_code
+    return dict(summarize(lat), status=status)
+
+
+# ----------------- EŞİK / BASELINE -----------------
+def flatten(prefix, value, out):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            flatten(f"{prefix}/{k}" if prefix else str(k), v, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+    return out
+
+
+def check(results, thresholds=None, baseline=None, tolerance=0.25):
+    """
+    thresholds: {"<metrik yolu glob>": üst sınır} (…_ms ve diğerleri için üst sınır; *_rps için alt sınır)
+    baseline: önceki çalıştırmanın sonuçları; _ms metrikleri (1+tolerance) katını, _rps metrikleri
+              (1-tolerance) katını aşmamalı. Çıktı: ihlal mesajları listesi
+    """
+    flat = flatten("", results, {})
+    violations = []
+    for pattern, limit in (thresholds or {}).items():
+        for key in fnmatch.filter(flat, pattern):
+            value = flat[key]
+            if key.endswith("_rps") and value < limit:
+                violations.append(f"{key}={value} < {limit} (threshold)")
+            elif not key.endswith("_rps") and value > limit:
+                violations.append(f"{key}={value} > {limit} (threshold)")
+    if baseline:
+        old = flatten("", baseline, {})
+        for key, value in flat.items():
+            ref = old.get(key)
+            if not ref:
+                continue
+            if key.endswith("p95_ms") and value > ref * (1 + tolerance):
+                violations.append(f"{key}={value} > baseline {ref} * {1 + tolerance:g}")
+            elif key.endswith("_rps") and value < ref * (1 - tolerance):
+                violations.append(f"{key}={value} < baseline {ref} * {1 - tolerance:g}")
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recognition / attendance benchmark suite")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="synthetic gallery sizes")
+    parser.add_argument("--image", help="JPEG with one face (default: synthetic face-less frame; "
+                                        "encode/match stages are then skipped by the endpoints)")
+    parser.add_argument("--requests", type=int, default=20, help="photo requests per endpoint and size")
+    parser.add_argument("--read-requests", type=int, default=20)
+    parser.add_argument("--procs", type=int, default=1, help="parallel processes for photo endpoints")
+    parser.add_argument("--history-people", type=int, default=500)
+    parser.add_argument("--history-days", type=int, default=30)
+    parser.add_argument("--format", choices=("pickle", "fgal"), default="pickle", help="gallery file format")
+    parser.add_argument("--workdir", help="scratch directory (default: a new temp dir)")
+    parser.add_argument("--out", default="bench.json")
+    parser.add_argument("--thresholds", help="JSON {metric path glob: limit}")
+    parser.add_argument("--baseline", help="previous results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="attendance-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    db_path = os.path.join(workdir, "bench.db")
+    gallery_path = os.path.join(workdir, "face_db." + args.format)
+    for path in (db_path, gallery_path):
+        if os.path.exists(path):
+            os.remove(path)
+    # Uygulama import edilmeden önce: izole SQLite + galeri, sonuç önbelleği kapalı (her istek tam boru hattı)
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ["FACE_DB_PATH"] = gallery_path
+    os.environ.setdefault("RESULT_CACHE_TTL", "0")
+    os.environ.setdefault("RECOGNITION_MODE", "sync")
+
+    import app as A
+    import gallery, detection, ingest
+
+    if args.image:
+        with open(args.image, "rb") as f:
+            frame = f.read()
+        encodings, _ = detection.recognize_bytes(frame, [1.0], 1)
+        if not encodings:
+            sys.exit(f"No face found in {args.image}.")
+        probe = np.asarray(encodings[0], dtype=np.float32)
+    else:
+        frame, probe = ingest.synthetic_jpeg(640, 480, 80, seed=args.seed), None
+
+    results = {"meta": {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": cpu_count(),
+        "image": os.path.basename(args.image) if args.image else None,
+        "gallery_format": args.format,
+        "requests": args.requests,
+        "procs": args.procs,
+    }}
+
+    with A.app.app_context():
+        A.db.create_all()
+        print(f"Generating attendance history ({args.history_people} people x {args.history_days} days)...")
+        results["history"] = build_history(A, args.history_people, args.history_days, seed=args.seed)
+        print(f"  {results['history']}")
+
+    client = A.app.test_client()
+    results["match"], results["endpoint"] = {}, {}
+    for n in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        key = f"n={n}"
+        print(f"\nGallery n={n}")
+        t0 = time.perf_counter()
+        g = build_gallery(n, probe, seed=args.seed)
+        build_s = time.perf_counter() - t0
+        gallery.save_gallery(g, gallery_path)  # .fgal uzantısı -> binary format
+        del g
+        gallery.invalidate()
+        t0 = time.perf_counter()
+        loaded = gallery.load_gallery()
+        load_s = time.perf_counter() - t0
+
+        match = bench_match(loaded, seed=args.seed + 1)
+        match.update(build_s=round(build_s, 3), load_ms=round(load_s * 1000, 3),
+                     file_mb=round(os.path.getsize(gallery_path) / 2**20, 2))
+        results["match"][key] = match
+        print(f"  load={match['load_ms']}ms search p50={match['p50_ms']}ms p95={match['p95_ms']}ms "
+              f"p99={match['p99_ms']}ms ({match['index']})")
+        del loaded
+
+        for path in ("/attendance_photo", "/exit_photo"):
+            res = bench_photo(A, path, frame, args.requests, args.procs)
+            results["endpoint"].setdefault(path.strip("/"), {})[key] = res
+            stages = " ".join(f"{s}={v['p50_ms']}" for s, v in res["stages"].items())
+            print(f"  {path:<18} p50={res['total']['p50_ms']}ms p95={res['total']['p95_ms']}ms "
+                  f"p99={res['total']['p99_ms']}ms {res['throughput_per_core_rps']} req/s/core [{stages}]")
+
+    results["read"] = {}
+    for url in READ_ENDPOINTS:
+        res = bench_read(client, url, args.read_requests)
+        results["read"][url.strip("/")] = res
+        print(f"{url:<28} p50={res['p50_ms']}ms p95={res['p95_ms']}ms p99={res['p99_ms']}ms")
+
+    thresholds = baseline = None
+    if args.thresholds:
+        with open(args.thresholds) as f:
+            thresholds = json.load(f)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for field in ("image", "gallery_format", "procs", "cpu_count"):
+            if baseline.get("meta", {}).get(field) != results["meta"][field]:
+                print(f"Warning: baseline {field}={baseline.get('meta', {}).get(field)!r} differs "
+                      f"from this run ({results['meta'][field]!r}); comparison may not be meaningful.")
+    violations = check({k: v for k, v in results.items() if k != "meta"}, thresholds,
+                       baseline and {k: v for k, v in baseline.items() if k != "meta"}, args.tolerance)
+    results["violations"] = violations
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.out}")
+    if violations:
+        print(f"{len(violations)} regression(s):")
+        for v in violations:
+            print(f"  {v}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+# detection.py
+# Kademeli yüz tespiti: HOG önce küçültülmüş kopyada çalışır, kutular tam çözünürlüğe
+# geri ölçeklenir (encoding tam çözünürlükte yapılır). Yüz bulunamazsa bir sonraki,
+# daha büyük ölçek denenir.
+# face_recognition (dlib + modeller, ~1-2 sn) ilk kullanımda import edilir: /health, /dashboard
+# gibi hafif route'lar bunu beklemez. gunicorn preload modunda master'da bir kez yüklenir
+# (bkz. gunicorn.conf.py) ve fork edilen worker'larla copy-on-write paylaşılır.
+import time
+import numpy as np
+from PIL import Image
+import ingest
+
+face_recognition = None
+MODEL_STATS = {"import_ms": None, "warmup_ms": None}
+
+
+def load_models():
+    """face_recognition modülü (ilk çağrıda import edilir; import süresi MODEL_STATS'a yazılır)."""
+    global face_recognition
+    if face_recognition is None:
+        t0 = time.perf_counter()
+        import face_recognition as fr
+        MODEL_STATS["import_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+        face_recognition = fr
+    return face_recognition
+
+
+def warm_up():
+    """
+    Boş bir karede tespit + tek encoding: HOG, landmark ve ResNet modellerinin ilk çağrı
+    maliyeti istek gelmeden ödenir. Çıktı: MODEL_STATS
+    """
+    fr = load_models()
+    t0 = time.perf_counter()
+    blank = np.zeros((160, 160, 3), dtype=np.uint8)
+    fr.face_locations(blank)
+    fr.face_encodings(blank, [(16, 144, 144, 16)])
+    MODEL_STATS["warmup_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    return MODEL_STATS
+
+
+def parse_scales(value, default="1.0"):
+    """ "0.5,1.0" -> [0.5, 1.0] (küçükten büyüğe, 0 < s <= 1) """
+    scales = sorted({float(s) for s in (value or default).split(",") if s.strip()})
+    if not scales or scales[0] <= 0 or scales[-1] > 1:
+        raise ValueError(f"geçersiz tespit ölçeği: {value!r}")
+    return scales
+
+
+def _downscale(image, scale):
+    w, h = image.size
+    factor = 1.0 / scale
+    if abs(factor - round(factor)) < 1e-6:
+        # Tam sayı oranlarda Image.reduce (kutu filtresi) resize'dan çok daha hızlı
+        return image.reduce(int(round(factor)))
+    return image.resize((max(1, round(w * scale)), max(1, round(h * scale))), Image.BILINEAR)
+
+
+def detect_faces(image, scales=(1.0,), upsample=1):
+    """
+    image: PIL RGB görüntü (tam çözünürlük)
+    scales: denenecek ölçekler, küçükten büyüğe
+    Çıktı: (face_locations [(top, right, bottom, left), ...] tam çözünürlükte,
+            {"detect_ms": toplam, "detect_scale": kullanılan ölçek, "detect_tries": deneme})
+    """
+    w, h = image.size
+    t0 = time.perf_counter()
+    locs, used, tries = [], None, 0
+    for scale in scales:
+        tries += 1
+        used = scale
+        small = image if scale >= 1.0 else _downscale(image, scale)
+        found = load_models().face_locations(ingest.to_array(small), number_of_times_to_upsample=upsample)
+        if found:
+            sx, sy = w / small.size[0], h / small.size[1]
+            locs = [
+                (max(0, int(t * sy)), min(w, int(round(r * sx))), min(h, int(round(b * sy))), max(0, int(l * sx)))
+                for t, r, b, l in found
+            ]
+            break
+    timings = {
+        "detect_ms": round((time.perf_counter() - t0) * 1000, 2),
+        "detect_scale": used,
+        "detect_tries": tries,
+    }
+    return locs, timings
+
+
+def encode_image(image, scales, timings, max_faces=None):
+    """
+    Kademeli tespit + tam çözünürlükte encoding (max_faces verilirse ilk max_faces yüz).
+    Çıktı: (img_array, face_locations, encodings); aşama süreleri timings'e yazılır.
+    """
+    face_locs, det = detect_faces(image, scales)
+    timings.update(det)
+    if not face_locs:
+        return None, [], []
+    t0 = time.perf_counter()
+    img_array = ingest.to_array(image)
+    encodings = load_models().face_encodings(img_array, face_locs[:max_faces])
+    timings["encode_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    return img_array, face_locs, encodings
+
+
+def recognize_bytes(data, scales, max_faces=None, max_side=None):
+    """
+    Arka plan havuzunda (thread ya da proses) çalışan CPU aşaması: decode + tespit + encoding.
+    max_side: JPEG'i bu uzun kenara yakın decode et (bkz. ingest.load_image)
+    Çıktı: (encodings, timings); görüntü açılamazsa encodings None
+    """
+    timings = {}
+    t0 = time.perf_counter()
+    try:
+        image = ingest.load_image(data, max_side)
+    except Exception:
+        return None, timings
+    timings["decode_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    _, _, encodings = encode_image(image, scales, timings, max_faces)
+    return encodings, timings
@@ -1,36 +1,171 @@
 import face_recognition
-import pickle
-import os
+import os, sys, time, json, pickle, hashlib, argparse
+import multiprocessing as mp
+import numpy as np
+import gallery, ingest
 
 FACES_DIR = "faces"
+# .fgal uzantılı hedef -> mmap'lenebilir binary galeri (bkz. gallery.py)
+OUTPUT_PATH = os.environ.get("FACE_DB_PATH", "face_db.pickle")
+IMAGE_EXTS = ('.jpg', '.png', '.jpeg')
 
-known_face_encodings = []
-known_face_names = []
-known_face_ids = []
+# Manifest: içerik hash'i -> {file, name, id}; aynı içerikli dosya bir daha encode edilmez.
+# Checkpoint: bu çalıştırmada biten sonuçlar (pickle akışı); yarıda kalan iş kaldığı yerden sürer.
 
-person_files = [f for f in os.listdir(FACES_DIR) if f.lower().endswith(('.jpg', '.png', '.jpeg'))]
-person_files.sort()
 
-for i, file in enumerate(person_files):
-    file_path = os.path.join(FACES_DIR, file)
-    name = os.path.splitext(file)[0]
-    face_id = str(i+1).zfill(3)
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def encode_file(job):
+    """Worker prosesi: (hash, path) -> (hash, dosya adı, encoding ya da None, hata, pid, süre)"""
+    digest, file_path = job
+    t0 = time.perf_counter()
+    enc, err = None, None
     try:
-        image = face_recognition.load_image_file(file_path)
+        # Kayıt fotoğrafları tam çözünürlükte, EXIF yönü uygulanarak açılır
+        image = ingest.to_array(ingest.load_image(file_path))
         encodings = face_recognition.face_encodings(image)
-        if len(encodings) == 0:
-            print(f"Face not found: {file}, skipped.")
-            continue
-        known_face_encodings.append(encodings[0])
-        known_face_names.append(name)
-        known_face_ids.append(face_id)
-        print(f"Added: ID={face_id}, Name={name}")
+        if encodings:
+            enc = encodings[0]
     except Exception as e:
-        print(f"Error ({file}): {e}")
+        err = str(e)
+    return digest, os.path.basename(file_path), enc, err, os.getpid(), time.perf_counter() - t0
+
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def load_checkpoint(path):
+    """Yarıda kalmış çalıştırmanın sonuçları; sondaki yarım kayıt atlanır."""
+    done = {}
+    try:
+        with open(path, "rb") as f:
+            while True:
+                try:
+                    digest, file, enc, err = pickle.load(f)
+                except (EOFError, pickle.UnpicklingError):
+                    break
+                done[digest] = (file, enc, err)
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def merge_results(g, results, manifest, new_id):
+    """
+    Yeni/değişen dosyaları galeriye uygular. Kişi id'leri kalıcıdır:
+    aynı isim zaten galerideyse dosyadaki encoding kişiye yeni örnek olarak eklenir ve
+    compress() ile prototiplerine katlanır (id ve önceki örnekler korunur), yoksa new_id() ile
+    yeni id alınır. Aynı adlı birden fazla dosya (alice.jpg + alice.png) aynı kişiye ayrı örnekler olur.
+    Çıktı: (yeni galeri, eklenen, güncellenen)
+    """
+    id_of = {}
+    for n, pid in zip(g.names, g.ids):
+        id_of.setdefault(n, pid)
+    samples, added, updated = [], 0, 0
+
+    for digest, (file, enc, err) in results.items():
+        name = os.path.splitext(file)[0]
+        entry = {"file": file, "name": name, "id": None}
+        if enc is not None:
+            if name in id_of:
+                updated += 1
+            else:
+                id_of[name] = new_id()
+                added += 1
+            samples.append((name, enc))
+            entry["id"] = id_of[name]
+        if err is None:
+            # Hatalı okunan dosyalar manifest'e yazılmaz, bir sonraki çalıştırmada tekrar denenir
+            manifest[digest] = entry
+
+    if not samples:
+        return g, added, updated
+    names = [n for n, _ in samples]
+    ids = [id_of[n] for n in names]
+    new = g.extended(np.asarray([enc for _, enc in samples], dtype=np.float32), names, ids)
+    new = gallery.compress(new, touched=set(ids))
+    return new, added, updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel, incremental face encoder")
+    parser.add_argument("--faces-dir", default=FACES_DIR)
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunksize", type=int, default=4)
+    args = parser.parse_args()
+
+    manifest_path = f"{args.output}.manifest.json"
+    checkpoint_path = f"{args.output}.checkpoint"
+    manifest = load_manifest(manifest_path)
+    done = load_checkpoint(checkpoint_path)
+
+    person_files = sorted(f for f in os.listdir(args.faces_dir) if f.lower().endswith(IMAGE_EXTS))
+    jobs = []
+    for file in person_files:
+        file_path = os.path.join(args.faces_dir, file)
+        digest = file_hash(file_path)
+        if digest in manifest or digest in done:
+            continue
+        jobs.append((digest, file_path))
+
+    print(f"{len(person_files)} files, {len(person_files) - len(jobs)} already encoded, "
+          f"{len(jobs)} to encode with {args.workers} workers"
+          + (f" (resuming, {len(done)} from checkpoint)" if done else ""))
+
+    per_worker = {}  # pid -> [görüntü, meşgul süre]
+    t0 = time.perf_counter()
+    if jobs:
+        with open(checkpoint_path, "ab") as ckpt, mp.Pool(args.workers) as pool:
+            for digest, file, enc, err, pid, elapsed in pool.imap_unordered(encode_file, jobs, args.chunksize):
+                if err is not None:
+                    print(f"Error ({file}): {err}")
+                elif enc is None:
+                    print(f"Face not found: {file}, skipped.")
+                done[digest] = (file, enc, err)
+                pickle.dump((digest, file, enc, err), ckpt)
+                ckpt.flush()
+                stat = per_worker.setdefault(pid, [0, 0.0])
+                stat[0] += 1
+                stat[1] += elapsed
+    wall = time.perf_counter() - t0
+
+    if done:
+        counts = {}
+
+        def apply(g):
+            new, counts["added"], counts["updated"] = merge_results(
+                g, done, manifest, lambda: gallery.allocate_id(args.output))
+            return new
+
+        g = gallery.rewrite_gallery(apply, args.output)
+        tmp = f"{manifest_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, manifest_path)
+        os.remove(checkpoint_path)
+        print(f"\nAdded {counts['added']} people, {counts['updated']} samples to existing people; "
+              f"{args.output} now has {len(g)} faces (existing ids kept).")
+    else:
+        print("\nNothing to do.")
 
-print(f"\nTotal {len(known_face_encodings)} saved successfully.")
+    if per_worker:
+        n = sum(c for c, _ in per_worker.values())
+        print(f"\nThroughput: {n} images in {wall:.1f}s = {n / wall:.2f} images/sec total")
+        for pid, (count, busy) in sorted(per_worker.items()):
+            print(f"  worker {pid}: {count} images, {count / busy if busy else 0:.2f} images/sec")
 
-with open("face_db.pickle", "wb") as f:
-    pickle.dump((known_face_encodings, known_face_names, known_face_ids), f)
 
-print("\nface_db.pickle created with auto ID!")
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,972 @@
+# gallery.py
+# Yüz galerisi: tek parça float32 N x 128 matris + worker içi bellek önbelleği.
+# Her gunicorn worker'ı galeriyi bir kez yükler; dosya değişmedikçe diske gitmez.
+import os, re, sys, glob, pickle, struct, threading, time, argparse, contextlib, fcntl
+import numpy as np
+
+FACE_DB_PATH = os.environ.get("FACE_DB_PATH", "face_db.pickle")
+
+# Dosya sürümünü en fazla bu sıklıkta (saniye) stat ile kontrol et
+CHECK_INTERVAL = float(os.environ.get("GALLERY_CHECK_INTERVAL", "1.0"))
+# Kayıt günlüğü bu boyutu (bayt) geçince arka planda ana galeriye katlanır
+COMPACT_BYTES = int(os.environ.get("ENROLL_COMPACT_BYTES", str(256 * 1024)))
+# Shard'lar (site/sınıf/grup): <kök>.shard-<ad><uzantı> dosyaları, ilk istekte yüklenir.
+# Bellekteki shard'ların toplamı bu sınırı aşarsa en uzun süredir kullanılmayanlar atılır.
+SHARD_BUDGET_BYTES = int(float(os.environ.get("GALLERY_SHARD_BUDGET_MB", "256")) * 2**20)
+_SHARD_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# Kişi başına örnekler sıkıştırmada en fazla bu kadar prototipe (+ ağırlıklı merkez satırı) indirgenir
+MAX_PROTOTYPES = int(os.environ.get("GALLERY_MAX_PROTOTYPES", "3"))
+# Sıkıştırılmış tarama: "none" (float32), "float16" ya da "int8" (boyut başına ölçekli).
+# Mesafe taraması kodlar üzerinde yapılır, en iyi QUANT_RERANK aday tam hassasiyetle yeniden sıralanır.
+GALLERY_QUANTIZE = os.environ.get("GALLERY_QUANTIZE", "none").lower()
+QUANT_RERANK = int(os.environ.get("GALLERY_QUANT_RERANK", "32"))
+QUANT_MODES = ("none", "float16", "int8")
+if GALLERY_QUANTIZE not in QUANT_MODES:
+    raise ValueError(f"GALLERY_QUANTIZE: {GALLERY_QUANTIZE!r} (beklenen: {', '.join(QUANT_MODES)})")
+
+_lock = threading.Lock()
+_cache = {}  # path -> {"key", "base", "data", "checked_at", "used_at", "version", "log_ino", "log_offset", "delta"}
+_stats = {"hits": 0, "reloads": 0, "invalidations": 0, "stats_calls": 0,
+          "log_reads": 0, "log_records": 0, "enrollments": 0, "compactions": 0, "shard_evictions": 0}
+_version = [0]  # tüm yükleme/yazmalarda artan sayaç (invalidate sonrası da geri gitmez)
+
+
+def _next_version():
+    _version[0] += 1
+    return _version[0]
+
+
+EMBEDDING_DIM = 128
+
+# search_batch'te tek seferde oluşturulacak en fazla (sorgu x galeri) mesafe hücresi
+_BATCH_CELLS = 4_000_000
+# Kodlar bu kadar satırlık parçalar halinde float32'ye açılır (~4MB geçici blok, önbellekte kalır)
+_DECODE_ROWS = 8192
+
+
+def _file_backed(a):
+    """Dizi (ya da bir görünümü) np.memmap üzerinde mi (sayfaları page cache'ten, geri alınabilir)"""
+    while a is not None:
+        if isinstance(a, np.memmap):
+            return True
+        a = getattr(a, "base", None)
+    return False
+
+
+class QuantizedCodes:
+    """
+    Galeri matrisinin sıkıştırılmış kopyası (tarama için).
+    float16: x ≈ kod;  int8: x ≈ offset + scale * kod (boyut başına min/max ölçekleme, [-127, 127]).
+    sq_norms: float16'da ||x̂||², int8'de offset'e göre merkezli ||scale * kod||² (sq_distances
+    sorguyu offset kadar kaydırır: ||q - x̂||² = ||(q - offset) - scale * kod||²).
+    float16 taramasında her blok her sorguda float32'ye açılır (NumPy'da float16 BLAS yok): bellek
+    yarıya iner ama tarama float32'den birkaç kat fazla CPU harcar. int8 açılışı ucuzdur.
+    """
+
+    def __init__(self, mode, codes, sq_norms, scale=None, offset=None):
+        self.mode = mode
+        self.codes = codes
+        self.sq_norms = sq_norms
+        self.scale = scale
+        self.offset = offset
+
+    @classmethod
+    def quantize(cls, matrix, mode):
+        """matrix: (N, 128) float32 -> QuantizedCodes (parça parça; float64 ara dizi oluşmaz)"""
+        n = len(matrix)
+        scale = offset = None
+        if mode == "float16":
+            codes = np.empty((n, EMBEDDING_DIM), dtype=np.float16)
+        elif mode == "int8":
+            codes = np.empty((n, EMBEDDING_DIM), dtype=np.int8)
+            lo = np.full(EMBEDDING_DIM, np.inf, dtype=np.float32)
+            hi = np.full(EMBEDDING_DIM, -np.inf, dtype=np.float32)
+            for start in range(0, n, _DECODE_ROWS):
+                part = matrix[start:start + _DECODE_ROWS]
+                np.minimum(lo, part.min(axis=0), out=lo)
+                np.maximum(hi, part.max(axis=0), out=hi)
+            offset = ((hi + lo) / 2).astype(np.float32) if n else np.zeros(EMBEDDING_DIM, np.float32)
+            scale = np.maximum((hi - lo) / 254, 1e-12).astype(np.float32) if n else np.ones(EMBEDDING_DIM, np.float32)
+        else:
+            raise ValueError(f"bilinmeyen quantize modu: {mode!r}")
+        out = cls(mode, codes, np.empty(n, dtype=np.float32), scale, offset)
+        for start in range(0, n, _DECODE_ROWS):
+            part = np.asarray(matrix[start:start + _DECODE_ROWS], dtype=np.float32)
+            if mode == "float16":
+                codes[start:start + len(part)] = part
+            else:
+                codes[start:start + len(part)] = np.clip(np.rint((part - offset) / scale), -127, 127)
+        out.fill_norms()
+        return out
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        extra = 0 if self.scale is None else self.scale.nbytes + self.offset.nbytes
+        return self.codes.nbytes + self.sq_norms.nbytes + extra
+
+    def fill_norms(self):
+        """sq_norms'u kodlardan (yeniden) hesaplar; int8'de offset'siz (scale * kod)."""
+        for start in range(0, len(self), _DECODE_ROWS):
+            x = self.codes[start:start + _DECODE_ROWS].astype(np.float32)
+            if self.mode == "int8":
+                x *= self.scale
+            self.sq_norms[start:start + len(x)] = np.einsum("ij,ij->i", x, x)
+
+    def sq_distances(self, queries):
+        """queries: (m, 128) float32 -> (m, N) yaklaşık kare mesafe"""
+        q = queries
+        if self.mode == "int8":
+            # (q - offset)·(scale * kod): ölçek sorguya katlanır, kod doğrudan çarpılır
+            q = (queries - self.offset) * self.scale
+        d2 = np.empty((len(queries), len(self)), dtype=np.float32)
+        for start in range(0, len(self), _DECODE_ROWS):
+            end = min(len(self), start + _DECODE_ROWS)
+            np.matmul(q, self.codes[start:end].astype(np.float32).T, out=d2[:, start:end])
+        d2 *= -2.0
+        d2 += self.sq_norms[None, :]
+        shifted = queries if self.mode != "int8" else queries - self.offset
+        d2 += np.einsum("ij,ij->i", shifted, shifted)[:, None]
+        np.maximum(d2, 0.0, out=d2)
+        return d2
+
+
+class FaceGallery:
+    """
+    Tüm encoding'leri tek bir C-contiguous float32 (N, 128) matriste tutar;
+    satır kare normları önceden hesaplanır. Mesafe: ||q||² + ||x||² - 2·q·x (tek BLAS çağrısı),
+    en iyi k aday ayrıca tam hassasiyetle yeniden hesaplanır.
+    Bir kişinin birden fazla satırı olabilir (prototipler + merkez); arama kişi başına en yakın
+    satırı döner. weights: satırın temsil ettiği örnek sayısı (0 -> türetilmiş merkez satırı).
+    codes (QuantizedCodes) varsa tarama kodlar üzerinde yapılır; matris yalnızca yeniden sıralamada
+    okunur (memmap'li galeride sayfaları bellekte kalmak zorunda değildir).
+    Nesne değişmez kabul edilir; ekleme yeni bir FaceGallery döner (okuyanlar etkilenmez).
+    """
+
+    def __init__(self, encodings=None, names=None, ids=None, sq_norms=None, weights=None, codes=None):
+        if encodings is None or len(encodings) == 0:
+            matrix = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        else:
+            # np.memmap float32 ise kopyalanmaz (worker'lar aynı page-cache sayfalarını paylaşır)
+            matrix = np.asarray(encodings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        self.matrix = np.ascontiguousarray(matrix)
+        if sq_norms is None:
+            sq_norms = np.einsum("ij,ij->i", self.matrix, self.matrix)
+        self.sq_norms = sq_norms
+        self.names = list(names or [])
+        self.ids = list(ids or [])
+        self.weights = np.ones(len(self.matrix), dtype=np.float32) if weights is None else weights
+        if not (len(self.names) == len(self.ids) == len(self.matrix) == len(self.weights)):
+            raise ValueError("encodings, names, ids ve weights aynı uzunlukta olmalı")
+        if codes is not None and len(codes) != len(self.matrix):
+            raise ValueError("codes galeriyle aynı uzunlukta olmalı")
+        self.codes = codes
+
+    @classmethod
+    def from_legacy(cls, data):
+        """Eski (encodings, names, ids) tuple formatından dönüştür."""
+        encodings, names, ids = data
+        return cls(encodings, names, ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getstate__(self):
+        # Normlar (ve kodlar) yüklemede yeniden hesaplanır; dosyada sadece matris + etiketler
+        # np.asarray: memmap'li galeri de düz ndarray olarak yazılır
+        return {"format": 2, "matrix": np.asarray(self.matrix), "names": self.names, "ids": self.ids,
+                "weights": np.asarray(self.weights)}
+
+    def __setstate__(self, state):
+        # weights'siz eski dosyalar: her satır tek örnek
+        self.__init__(state["matrix"], state["names"], state["ids"], weights=state.get("weights"))
+
+    def added(self, encoding, name, person_id):
+        """Tek kişi eklenmiş yeni galeri döner."""
+        return self.extended([encoding], [name], [person_id])
+
+    def extended(self, encodings, names, ids, weights=None):
+        """Verilen satırlar (yeni kişi ya da mevcut kişiye yeni örnek) eklenmiş yeni galeri döner."""
+        rows = np.asarray(encodings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        w = np.ones(len(rows), dtype=np.float32) if weights is None else np.asarray(weights, dtype=np.float32)
+        return FaceGallery(np.vstack([self.matrix, rows]), self.names + list(names), self.ids + list(ids),
+                           weights=np.concatenate([np.asarray(self.weights, dtype=np.float32), w]))
+
+    def subset(self, rows):
+        """Seçili satırlardan yeni galeri (rows: indeks dizisi ya da bool maske)."""
+        rows = np.flatnonzero(rows) if np.asarray(rows).dtype == bool else np.asarray(rows, dtype=np.int64)
+        return FaceGallery(self.matrix[rows], [self.names[i] for i in rows], [self.ids[i] for i in rows],
+                           weights=np.asarray(self.weights)[rows])
+
+    def quantized(self, mode):
+        """Aynı diziler + mode kodları (mode "none" -> kodsuz). Kodlar zaten o moddaysa self."""
+        if (mode == "none" and self.codes is None) or (self.codes is not None and self.codes.mode == mode):
+            return self
+        codes = None if mode == "none" else QuantizedCodes.quantize(self.matrix, mode)
+        return FaceGallery(self.matrix, self.names, self.ids, sq_norms=self.sq_norms,
+                           weights=self.weights, codes=codes)
+
+    def resident_bytes(self):
+        """Tarama sırasında bellekte olması gereken bayt (kodlu + memmap'li matris -> sadece kodlar)."""
+        scan = self.codes.nbytes if self.codes is not None else self.matrix.nbytes + self.sq_norms.nbytes
+        if self.codes is not None and not _file_backed(self.matrix):
+            scan += self.matrix.nbytes + self.sq_norms.nbytes
+        return scan
+
+    def _sq_distances(self, queries):
+        """queries: (m, 128) float32 -> (m, N) kare mesafe"""
+        if self.codes is not None:
+            return self.codes.sq_distances(queries)
+        d2 = queries @ self.matrix.T
+        d2 *= -2.0
+        d2 += self.sq_norms[None, :]
+        d2 += np.einsum("ij,ij->i", queries, queries)[:, None]
+        np.maximum(d2, 0.0, out=d2)
+        return d2
+
+    def _top_k(self, query64, d2_row, k):
+        n = d2_row.shape[0]
+        # Kişi başına birden fazla satır olabilir: k kişi için yeterli aday satır al
+        m = k if k == 1 else k * (MAX_PROTOTYPES + 1)
+        if self.codes is not None:
+            # Yaklaşık mesafede sıra kayabilir: yeniden sıralamaya daha fazla aday gönder
+            m = max(m, QUANT_RERANK)
+        if m < n:
+            cand = np.argpartition(d2_row, m - 1)[:m]
+        else:
+            cand = np.arange(n)
+        # Adayları float64 ile kesin mesafeye göre sırala (tolerans kararı bu değere bakar)
+        exact = np.linalg.norm(self.matrix[cand].astype(np.float64) - query64, axis=1)
+        order = np.argsort(exact, kind="stable")
+        return unique_people(
+            ({"index": int(cand[i]), "id": self.ids[cand[i]], "name": self.names[cand[i]],
+              "distance": float(exact[i])} for i in order), k)
+
+    def search(self, query, k=1):
+        """
+        query: 128-d encoding
+        Çıktı: mesafeye göre artan [{index, id, name, distance}, ...] (en fazla k)
+        """
+        return self.search_batch(np.asarray(query).reshape(1, EMBEDDING_DIM), k)[0]
+
+    def search_batch(self, queries, k=1):
+        """queries: (m, 128) -> her sorgu için search() çıktısı listesi"""
+        q64 = np.asarray(queries, dtype=np.float64).reshape(-1, EMBEDDING_DIM)
+        if len(self) == 0 or k <= 0:
+            return [[] for _ in range(len(q64))]
+        q32 = q64.astype(np.float32)
+        step = max(1, _BATCH_CELLS // len(self))
+        results = []
+        for start in range(0, len(q32), step):
+            d2 = self._sq_distances(q32[start:start + step])
+            for j, row in enumerate(d2):
+                results.append(self._top_k(q64[start + j], row, k))
+        return results
+
+
+class LayeredGallery:
+    """
+    Değişmeyen ana galeri + kayıt günlüğünden gelen küçük delta.
+    Yeni kişiler ana galeri yeniden yüklenmeden görünür; sonuçlar iki katmandan birleştirilir.
+    "index" değerleri delta için len(base) kadar kaydırılır.
+    """
+
+    def __init__(self, base, delta):
+        self.base = base
+        self.delta = delta
+
+    def __len__(self):
+        return len(self.base) + len(self.delta)
+
+    def with_base(self, base):
+        return LayeredGallery(base, self.delta)
+
+    def search(self, query, k=1):
+        return self.search_batch(np.asarray(query).reshape(1, EMBEDDING_DIM), k)[0]
+
+    def search_batch(self, queries, k=1):
+        offset = len(self.base)
+        out = []
+        for ra, rb in zip(self.base.search_batch(queries, k), self.delta.search_batch(queries, k)):
+            for r in rb:
+                r["index"] += offset
+            out.append(unique_people(sorted(ra + rb, key=lambda r: r["distance"]), k))
+        return out
+
+
+def unique_people(results, k):
+    """Mesafeye göre sıralı sonuçlardan her kişinin (id) en yakın satırı, en fazla k kişi."""
+    seen, out = set(), []
+    for r in results:
+        if r["id"] not in seen:
+            seen.add(r["id"])
+            out.append(r)
+            if len(out) == k:
+                break
+    return out
+
+
+def _layer(base, delta):
+    if delta is None or len(delta) == 0:
+        return base
+    if base is None:
+        return delta
+    return LayeredGallery(base, delta)
+
+
+# ----------------- BİNARY (MMAP) GALERİ FORMATI -----------------
+# <path>      : 64 baytlık başlık + float32 (N, 128) matris + float32 (N,) kare normlar
+#               (+ flags & FLAG_WEIGHTS ise float32 (N,) satır ağırlıkları)
+#               (+ FLAG_FLOAT16: float16 (N, 128) kodlar + float32 (N,) kod normları
+#                  FLAG_INT8: float32 (128,) scale + float32 (128,) offset + int8 (N, 128) kodlar + normlar;
+#                  FLAG_INT8_CENTRED yoksa int8 normları eski (offset'li) hesaptır, okurken yeniden hesaplanır)
+# <path>.ids  : 64 baytlık başlık + satır başına "id\tname\n" (utf-8)
+# İki dosyanın başlığındaki generation aynı olmalı (yarım kalmış yazma kontrolü).
+BINARY_MAGIC = b"FGAL"
+IDS_MAGIC = b"FGID"
+BINARY_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sHHIQQ")  # magic, format, dim, flags, count, generation
+_HEADER_SIZE = 64
+FLAG_WEIGHTS = 1
+FLAG_FLOAT16 = 2
+FLAG_INT8 = 4
+FLAG_INT8_CENTRED = 8
+_QUANT_FLAGS = {"float16": FLAG_FLOAT16, "int8": FLAG_INT8 | FLAG_INT8_CENTRED}
+
+
+def _pack_header(magic, count, generation, flags=0):
+    return _HEADER.pack(magic, BINARY_FORMAT_VERSION, EMBEDDING_DIM, flags, count, generation).ljust(_HEADER_SIZE, b"\0")
+
+
+def _unpack_header(raw, magic, path):
+    got, fmt, dim, flags, count, generation = _HEADER.unpack(raw[:_HEADER.size])
+    if got != magic:
+        raise ValueError(f"{path}: galeri dosyası değil")
+    if fmt != BINARY_FORMAT_VERSION or dim != EMBEDDING_DIM:
+        raise ValueError(f"{path}: desteklenmeyen format={fmt} dim={dim}")
+    return count, generation, flags
+
+
+def is_binary_gallery(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(4) == BINARY_MAGIC
+    except FileNotFoundError:
+        return path.endswith(".fgal")
+
+
+def write_binary(g, path, quantize=None):
+    """
+    FaceGallery'yi binary formatta atomik yazar (önce .ids, sonra ana dosya).
+    quantize (varsayılan GALLERY_QUANTIZE): tam matrise ek olarak tarama kodları da yazılır.
+    """
+    mode = quantize or GALLERY_QUANTIZE
+    codes = g.quantized(mode).codes if mode != "none" else None
+    flags = FLAG_WEIGHTS | _QUANT_FLAGS.get(mode, 0)
+    generation = time.time_ns()
+    tmp_ids = f"{path}.ids.tmp.{os.getpid()}"
+    with open(tmp_ids, "wb") as f:
+        f.write(_pack_header(IDS_MAGIC, len(g), generation))
+        f.write("".join(f"{i}\t{n}\n" for i, n in zip(g.ids, g.names)).encode("utf-8"))
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(_pack_header(BINARY_MAGIC, len(g), generation, flags))
+        f.write(np.ascontiguousarray(g.matrix, dtype="<f4").tobytes())
+        f.write(np.ascontiguousarray(g.sq_norms, dtype="<f4").tobytes())
+        f.write(np.ascontiguousarray(g.weights, dtype="<f4").tobytes())
+        if codes is not None:
+            if codes.mode == "int8":
+                f.write(np.ascontiguousarray(codes.scale, dtype="<f4").tobytes())
+                f.write(np.ascontiguousarray(codes.offset, dtype="<f4").tobytes())
+            f.write(np.ascontiguousarray(codes.codes, dtype="<f2" if codes.mode == "float16" else "i1").tobytes())
+            f.write(np.ascontiguousarray(codes.sq_norms, dtype="<f4").tobytes())
+    os.replace(tmp_ids, f"{path}.ids")
+    os.replace(tmp, path)
+
+
+def read_binary(path):
+    """
+    Binary galeriyi np.memmap ile açar: matris ve normlar kopyalanmaz,
+    aynı dosyayı açan tüm worker'lar aynı fiziksel sayfaları kullanır.
+    """
+    with open(path, "rb") as f:
+        count, generation, flags = _unpack_header(f.read(_HEADER_SIZE), BINARY_MAGIC, path)
+    with open(f"{path}.ids", "rb") as f:
+        ids_count, ids_generation, _ = _unpack_header(f.read(_HEADER_SIZE), IDS_MAGIC, f"{path}.ids")
+        lines = f.read().decode("utf-8").splitlines()
+    if ids_generation != generation or ids_count != count or len(lines) != count:
+        raise ValueError(f"{path}: .ids dosyası galeriyle uyuşmuyor (yazma sürüyor olabilir)")
+    ids, names = [], []
+    for line in lines:
+        i, _, n = line.partition("\t")
+        ids.append(i)
+        names.append(n)
+    if count == 0:
+        return FaceGallery()
+    matrix = np.memmap(path, dtype="<f4", mode="r", offset=_HEADER_SIZE, shape=(count, EMBEDDING_DIM))
+    sq_norms = np.memmap(path, dtype="<f4", mode="r",
+                         offset=_HEADER_SIZE + count * EMBEDDING_DIM * 4, shape=(count,))
+    weights = None
+    offset = _HEADER_SIZE + count * (EMBEDDING_DIM + 1) * 4
+    if flags & FLAG_WEIGHTS:
+        weights = np.memmap(path, dtype="<f4", mode="r", offset=offset, shape=(count,))
+        offset += count * 4
+    codes = None
+    if flags & (FLAG_FLOAT16 | FLAG_INT8):
+        scale = shift = None
+        if flags & FLAG_INT8:
+            scale = np.memmap(path, dtype="<f4", mode="r", offset=offset, shape=(EMBEDDING_DIM,))
+            shift = np.memmap(path, dtype="<f4", mode="r", offset=offset + EMBEDDING_DIM * 4, shape=(EMBEDDING_DIM,))
+            offset += EMBEDDING_DIM * 8
+        dtype = "<f2" if flags & FLAG_FLOAT16 else "i1"
+        raw = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count, EMBEDDING_DIM))
+        offset += raw.nbytes
+        code_norms = np.memmap(path, dtype="<f4", mode="r", offset=offset, shape=(count,))
+        codes = QuantizedCodes("float16" if flags & FLAG_FLOAT16 else "int8", raw, code_norms, scale, shift)
+        if flags & FLAG_INT8 and not flags & FLAG_INT8_CENTRED:
+            codes.sq_norms = np.empty(count, dtype=np.float32)
+            codes.fill_norms()
+    return FaceGallery(matrix, names, ids, sq_norms=sq_norms, weights=weights, codes=codes)
+
+
+def migrate(src, dst):
+    """Eski pickle (tuple ya da FaceGallery) galeriyi, bekleyen günlüğüyle birlikte binary formata çevirir."""
+    g = _folded(src)
+    write_binary(g, dst)
+    return len(g)
+
+
+def _file_key(path):
+    """
+    Dosyanın sürüm anahtarı: (inode, mtime_ns, boyut).
+    os.replace ile yazılan yeni dosya yeni inode alır, bu yüzden mtime çözünürlüğü
+    yetmese de değişiklik yakalanır. Dosya yoksa None.
+    """
+    _stats["stats_calls"] += 1
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _read(path):
+    if is_binary_gallery(path):
+        g = read_binary(path)
+    else:
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        # embedding.py / add_user'ın eski tuple formatı
+        g = FaceGallery.from_legacy(data) if isinstance(data, tuple) else data
+    # Dosyada kod yoksa (pickle / eski .fgal) yüklemede üretilir; pickle'da tam matris yine bellektedir
+    return g.quantized(GALLERY_QUANTIZE)
+
+
+# ----------------- KAYIT GÜNLÜĞÜ (APPEND-ONLY) -----------------
+# <path>.log  : ardışık kayıtlar; "FREC" + id_len(u16) + name_len(u16) + id + name + float32[128]
+# <path>.seq  : son verilen kişi numarası (kilit altında artırılır)
+# <path>.lock : flock ile worker/proses arası kilit
+_REC = struct.Struct("<4sHH")
+_REC_MAGIC = b"FREC"
+_compacting = threading.Lock()
+
+
+def log_path(path=None):
+    return f"{path or FACE_DB_PATH}.log"
+
+
+@contextlib.contextmanager
+def _file_lock(path, blocking=True):
+    """Galeri dosyası için proseslerarası özel kilit (LOCK_NB ile alınamazsa BlockingIOError)."""
+    fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        yield
+    finally:
+        os.close(fd)
+
+
+def _pack_record(person_id, name, encoding):
+    pid_b, name_b = person_id.encode("utf-8"), name.encode("utf-8")
+    vec = np.asarray(encoding, dtype="<f4").reshape(EMBEDDING_DIM)
+    return _REC.pack(_REC_MAGIC, len(pid_b), len(name_b)) + pid_b + name_b + vec.tobytes()
+
+
+def _parse_log(raw):
+    """
+    Çıktı: (encodings, names, ids, kullanılan_bayt)
+    Sondaki yarım kayıt (yazma sürüyor) atlanır; bir sonraki okumada tamamlanır.
+    """
+    encs, names, ids = [], [], []
+    pos = 0
+    while pos + _REC.size <= len(raw):
+        magic, pid_len, name_len = _REC.unpack_from(raw, pos)
+        if magic != _REC_MAGIC:
+            raise ValueError(f"bozuk kayıt günlüğü (offset {pos})")
+        end = pos + _REC.size + pid_len + name_len + EMBEDDING_DIM * 4
+        if end > len(raw):
+            break
+        p = pos + _REC.size
+        ids.append(raw[p:p + pid_len].decode("utf-8"))
+        names.append(raw[p + pid_len:p + pid_len + name_len].decode("utf-8"))
+        encs.append(np.frombuffer(raw, dtype="<f4", count=EMBEDDING_DIM, offset=p + pid_len + name_len))
+        pos = end
+    return encs, names, ids, pos
+
+
+def _read_log(path, offset=0):
+    try:
+        with open(log_path(path), "rb") as f:
+            f.seek(offset)
+            raw = f.read()
+    except FileNotFoundError:
+        return [], [], [], 0
+    return _parse_log(raw)
+
+
+def _sync_log(path, entry):
+    """Günlükte son okumadan sonra eklenen kayıtları delta galeriye ekler (ana galeri yeniden okunmaz)."""
+    try:
+        st = os.stat(log_path(path))
+        ino, size = st.st_ino, st.st_size
+    except FileNotFoundError:
+        ino, size = None, 0
+
+    changed = False
+    if ino != entry["log_ino"] or size < entry["log_offset"]:
+        # Günlük sıkıştırma ile yenilendi -> baştan oku
+        changed = entry["delta"] is not None
+        entry.update(log_ino=ino, log_offset=0, delta=None)
+    if size > entry["log_offset"]:
+        encs, names, ids, used = _read_log(path, entry["log_offset"])
+        _stats["log_reads"] += 1
+        if ids:
+            entry["delta"] = (entry["delta"] or FaceGallery()).extended(encs, names, ids)
+            _stats["log_records"] += len(ids)
+            changed = True
+        entry["log_offset"] += used
+    if changed:
+        entry["data"] = _layer(entry["base"], entry["delta"])
+        entry["version"] = _next_version()
+
+
+def load_gallery(path=None):
+    """
+    Önbellekli galeri okuma (ana dosya + kayıt günlüğü).
+    Çıktı: FaceGallery / LayeredGallery ya da hiç kayıt yoksa None (paylaşımlı nesne, değiştirme)
+    """
+    path = path or FACE_DB_PATH
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(path)
+        if entry is not None and now - entry["checked_at"] < CHECK_INTERVAL:
+            _stats["hits"] += 1
+            entry["used_at"] = now
+            return entry["data"]
+
+        key = _file_key(path)
+        if entry is not None and entry["key"] == key:
+            _stats["hits"] += 1
+        else:
+            try:
+                base = _read(path) if key is not None else None
+            except ValueError:
+                # Binary galeri o an yazılıyor olabilir; eldeki kopyayla devam, sonra tekrar dene
+                if entry is None:
+                    raise
+                return entry["data"]
+            entry = {"key": key, "base": base, "data": base, "version": _next_version(),
+                     "log_ino": None, "log_offset": 0, "delta": None}
+            _cache[path] = entry
+            _stats["reloads"] += 1
+        entry["checked_at"] = entry["used_at"] = now
+        _sync_log(path, entry)
+        if _is_shard(path):
+            _evict_shards(keep=path)
+        return entry["data"]
+
+
+def _write(data, path):
+    if is_binary_gallery(path):
+        write_binary(data, path)
+    else:
+        tmp = f"{path}.tmp.{os.getpid()}"
+        with open(tmp, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+
+def _reset_log(path):
+    """Günlüğü boş bir dosyayla değiştirir (yeni inode -> okuyucular baştan okur)."""
+    tmp = f"{log_path(path)}.tmp.{os.getpid()}"
+    open(tmp, "wb").close()
+    os.replace(tmp, log_path(path))
+
+
+def save_gallery(data, path=None):
+    """
+    Galeriyi baştan yazar (embedding.py toplu üretim). Atomik yazılır (geçici dosya + os.replace);
+    bekleyen kayıt günlüğü ve id sayacı sıfırlanır. Diğer worker'lar sürüm değişikliğini görüp yükler.
+    """
+    path = path or FACE_DB_PATH
+    with _file_lock(path):
+        _write(data, path)
+        _reset_log(path)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(f"{path}.seq")
+    invalidate(path)
+
+
+def _allocate_id(path):
+    """Kilit altında çağrılır: .seq sayacını artırıp yeni kişi id'sini döner."""
+    seq_path = f"{path}.seq"
+    try:
+        with open(seq_path) as f:
+            last = int(f.read().strip() or 0)
+    except FileNotFoundError:
+        # İlk kullanım: mevcut galeri + günlükteki en büyük sayısal id
+        g = _read(path) if os.path.exists(path) else None
+        ids = list(g.ids) if g is not None else []
+        ids += _read_log(path)[2]
+        last = max((int(i) for i in ids if i.isdigit()), default=0)
+    new = last + 1
+    tmp = f"{seq_path}.tmp.{os.getpid()}"
+    with open(tmp, "w") as f:
+        f.write(str(new))
+    os.replace(tmp, seq_path)
+    return f"{new:03d}"
+
+
+def _mark_stale(path):
+    """Bu worker'ın yaptığı değişiklik CHECK_INTERVAL beklenmeden görünsün."""
+    with _lock:
+        entry = _cache.get(path)
+        if entry is not None:
+            entry["checked_at"] = float("-inf")
+
+
+def _append(path, person_id, name, encoding):
+    """Dosya kilidi tutulurken günlüğe tek kayıt ekler. Çıktı: günlük boyutu"""
+    fd = os.open(log_path(path), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, _pack_record(person_id, name, encoding))
+        return os.fstat(fd).st_size
+    finally:
+        os.close(fd)
+
+
+def _after_append(path, log_size):
+    _mark_stale(path)
+    if log_size >= COMPACT_BYTES:
+        threading.Thread(target=_background_compact, args=(path,), daemon=True).start()
+
+
+def enroll(name, encoding, path=None, shards=(), person_id=None):
+    """
+    Tek örneği kayıt günlüğüne ekler; maliyet galeri boyutundan bağımsızdır.
+    person_id verilirse örnek o kişiye eklenir (sıkıştırmada prototiplerine katlanır), yoksa
+    yeni id atanır; id ataması ve ekleme aynı dosya kilidi altında yapılır.
+    shards: örnek aynı person_id ile bu shard'lara da eklenir (global galeri herkesi içerir).
+    Çıktı: person_id
+    """
+    path = path or FACE_DB_PATH
+    shard_paths = [shard_path(s, path) for s in shards]  # geçersiz ad -> hiçbir şey yazılmadan ValueError
+    with _file_lock(path):
+        if person_id is None:
+            person_id = _allocate_id(path)
+        log_size = _append(path, person_id, name, encoding)
+    _stats["enrollments"] += 1
+    _after_append(path, log_size)
+    for sp in shard_paths:
+        with _file_lock(sp):
+            log_size = _append(sp, person_id, name, encoding)
+        _after_append(sp, log_size)
+    return person_id
+
+
+# ----------------- ÇOKLU ÖRNEK / PROTOTİP SIKIŞTIRMA -----------------
+def _compress_person(X, w):
+    """
+    X: (m, 128) kişinin satırları, w: ağırlıklar (0 -> eski merkez satırı, yeniden hesaplanır).
+    En yakın iki prototip ağırlıklı ortalamayla birleştirilerek MAX_PROTOTYPES'a inilir;
+    birden fazla prototip kalırsa ağırlıklı merkez de (ağırlık 0) eklenir.
+    Çıktı: (satırlar float32, ağırlıklar float32)
+    """
+    keep = w > 0
+    protos = [x for x in X[keep]] or [x for x in X]
+    weights = list(w[keep]) or [1.0] * len(X)
+    limit = max(1, MAX_PROTOTYPES)
+    while len(protos) > limit:
+        A = np.asarray(protos)
+        d2 = np.einsum("ijk,ijk->ij", A[:, None, :] - A[None, :, :], A[:, None, :] - A[None, :, :])
+        np.fill_diagonal(d2, np.inf)
+        i, j = sorted(np.unravel_index(np.argmin(d2), d2.shape))
+        wi, wj = weights[i], weights[j]
+        merged = (protos[i] * wi + protos[j] * wj) / (wi + wj)
+        del protos[j], weights[j], protos[i], weights[i]
+        protos.append(merged)
+        weights.append(wi + wj)
+    rows, weights = np.asarray(protos, dtype=np.float64), np.asarray(weights, dtype=np.float64)
+    if len(rows) > 1:
+        centroid = (rows * weights[:, None]).sum(axis=0) / weights.sum()
+        rows, weights = np.vstack([rows, centroid]), np.append(weights, 0.0)
+    return rows.astype(np.float32), weights.astype(np.float32)
+
+
+def compress(g, touched=None):
+    """
+    Birden fazla satırı olan kişileri en fazla MAX_PROTOTYPES prototip + merkeze indirger
+    (arama maliyeti fotoğraf değil kişi sayısıyla büyür). touched: sadece bu id'ler (None -> hepsi).
+    Sıkıştırılan kişilerin satırları galerinin sonuna taşınır. Çıktı: yeni galeri (değişiklik yoksa g)
+    """
+    groups = {}
+    for i, pid in enumerate(g.ids):
+        if touched is None or pid in touched:
+            groups.setdefault(pid, []).append(i)
+    groups = {pid: rows for pid, rows in groups.items() if len(rows) > 1}
+    if not groups:
+        return g
+    W = np.asarray(g.weights, dtype=np.float64)
+    drop = np.zeros(len(g), dtype=bool)
+    rows_out, w_out, names, ids = [], [], [], []
+    for pid, rows in groups.items():
+        drop[rows] = True
+        protos, weights = _compress_person(np.asarray(g.matrix[rows], dtype=np.float64), W[rows])
+        rows_out.append(protos)
+        w_out.append(weights)
+        names += [g.names[rows[-1]]] * len(protos)  # en son örnekteki isim
+        ids += [pid] * len(protos)
+    return g.subset(~drop).extended(np.vstack(rows_out), names, ids, np.concatenate(w_out))
+
+
+def normalize_name(name):
+    return " ".join(name.split()).casefold()
+
+
+def duplicate_map(g, max_distance=0.45):
+    """
+    Aynı isimli (boşluk/büyük-küçük harf farkı yok sayılır) ve örnek merkezleri max_distance
+    içinde olan kimlikler; aynı isimli ama farklı yüzler ayrı kalır.
+    Çıktı: {eski_id: kalan_id} (kalan: en küçük id)
+    """
+    by_name = {}
+    for i, (pid, name) in enumerate(zip(g.ids, g.names)):
+        by_name.setdefault(normalize_name(name), {}).setdefault(pid, []).append(i)
+    W = np.asarray(g.weights, dtype=np.float64)
+    mapping = {}
+    for people in by_name.values():
+        if len(people) < 2:
+            continue
+        kept = []  # (id, merkez)
+        for pid in sorted(people, key=lambda p: (len(p), p)):
+            rows = people[pid]
+            w = W[rows] if W[rows].sum() > 0 else np.ones(len(rows))
+            c = (np.asarray(g.matrix[rows], dtype=np.float64) * w[:, None]).sum(axis=0) / w.sum()
+            target = next((k for k, kc in kept if np.linalg.norm(c - kc) <= max_distance), None)
+            if target is None:
+                kept.append((pid, c))
+            else:
+                mapping[pid] = target
+    return mapping
+
+
+def relabel(g, mapping):
+    """mapping'deki id'lerin satırlarını hedef kişiye (id + isim) taşır ve hedefleri sıkıştırır."""
+    if not mapping:
+        return g
+    targets = set(mapping.values())
+    name_of = {}
+    for pid, name in zip(g.ids, g.names):
+        if pid in targets:
+            name_of.setdefault(pid, name)
+    ids = [mapping.get(pid, pid) for pid in g.ids]
+    names = [name_of.get(mapping[pid], name) if pid in mapping else name for pid, name in zip(g.ids, g.names)]
+    g = FaceGallery(g.matrix, names, ids, sq_norms=g.sq_norms, weights=g.weights)
+    return compress(g, touched=targets)
+
+
+def merge_duplicates(path=None, max_distance=0.45, dry_run=False):
+    """
+    Galeri (ve shard'lar) içindeki yinelenen kimlikleri birleştirir (bkz. duplicate_map).
+    Çıktı: {eski_id: kalan_id}; Attendance kayıtlarının taşınması çağıranın işi (app.py komutu)
+    """
+    path = path or FACE_DB_PATH
+    if dry_run:
+        with _file_lock(path):
+            return duplicate_map(_folded(path), max_distance)
+    mapping = {}
+
+    def transform(g):
+        mapping.update(duplicate_map(g, max_distance))
+        return relabel(g, mapping)
+
+    rewrite_gallery(transform, path)
+    if mapping:
+        for shard in list_shards(path):
+            rewrite_gallery(lambda g: relabel(g, mapping), shard_path(shard, path))
+    return mapping
+
+
+# ----------------- SHARD'LAR -----------------
+def shard_path(shard, path=None):
+    """ "bina-a" -> face_db.shard-bina-a.pickle (uzantı korunur: .fgal shard'lar da binary) """
+    if not _SHARD_NAME.match(shard or ""):
+        raise ValueError(f"geçersiz shard adı: {shard!r}")
+    root, ext = os.path.splitext(path or FACE_DB_PATH)
+    return f"{root}.shard-{shard}{ext}"
+
+
+def _is_shard(path):
+    return ".shard-" in os.path.basename(path)
+
+
+def list_shards(path=None):
+    """Diskteki shard adları (henüz sıkıştırılmamış, sadece günlüğü olanlar dahil)."""
+    root, ext = os.path.splitext(path or FACE_DB_PATH)
+    prefix, names = f"{root}.shard-", set()
+    for suffix in (ext, f"{ext}.log"):
+        for file in glob.glob(glob.escape(prefix) + "*" + suffix):
+            name = file[len(prefix):-len(suffix)]
+            if _SHARD_NAME.match(name):
+                names.add(name)
+    return sorted(names)
+
+
+def _entry_bytes(entry):
+    total = 0
+    for g in (entry["base"], entry["delta"]):
+        if g is not None:
+            # İsim/id listeleri için kişi başına kaba tahmin
+            total += g.resident_bytes() + 128 * len(g)
+    return total
+
+
+def _evict_shards(keep):
+    """_lock tutulurken: shard'ların toplam boyutu bütçeyi aşarsa en eski kullanılanları at."""
+    shards = [(e["used_at"], p, _entry_bytes(e)) for p, e in _cache.items() if _is_shard(p)]
+    total = sum(b for _, _, b in shards)
+    for _, p, size in sorted(shards):
+        if total <= SHARD_BUDGET_BYTES:
+            break
+        if p == keep:
+            continue
+        del _cache[p]
+        total -= size
+        _stats["shard_evictions"] += 1
+
+
+def compact(path=None, blocking=True):
+    """
+    Kayıt günlüğünü ana galeriye katlar ve günlüğü boşaltır.
+    Çıktı: katlanan kayıt sayısı (blocking=False iken kilit alınamazsa None)
+    """
+    path = path or FACE_DB_PATH
+    try:
+        with _file_lock(path, blocking=blocking):
+            encs, names, ids, _ = _read_log(path)
+            if not ids:
+                return 0
+            base = _read(path) if os.path.exists(path) else FaceGallery()
+            _write(compress(base.extended(encs, names, ids), touched=set(ids)), path)
+            # Önce ana dosya, sonra günlük: arada okuyan worker kısa süre çift kayıt görür, eksik değil
+            _reset_log(path)
+    except BlockingIOError:
+        return None
+    _stats["compactions"] += 1
+    return len(ids)
+
+
+def rewrite_gallery(transform, path=None):
+    """
+    Kilit altında ana galeri + günlüğü tek galeriye katlar, transform(g) -> yeni galeri
+    uygular ve yazar (toplu güncellemeler için; aradaki kayıtlar kaybolmaz).
+    transform içinde allocate_id() ile yeni id alınabilir (kilit zaten tutuluyor).
+    """
+    path = path or FACE_DB_PATH
+    with _file_lock(path):
+        new = transform(_folded(path))
+        _write(new, path)
+        _reset_log(path)
+    invalidate(path)
+    return new
+
+
+def _folded(path):
+    """Ana galeri + günlük tek galeride; günlükte örneği gelen kişiler sıkıştırılır."""
+    base = _read(path) if os.path.exists(path) else FaceGallery()
+    encs, names, ids, _ = _read_log(path)
+    if not ids:
+        return base
+    return compress(base.extended(encs, names, ids), touched=set(ids))
+
+
+def allocate_id(path=None):
+    """rewrite_gallery transform'u içinden çağrılır (dosya kilidi tutulurken)."""
+    return _allocate_id(path or FACE_DB_PATH)
+
+
+def _background_compact(path):
+    if not _compacting.acquire(blocking=False):
+        return
+    try:
+        compact(path, blocking=False)
+    except Exception as e:
+        print(f"Gallery compaction failed: {e}", file=sys.stderr)
+    finally:
+        _compacting.release()
+
+
+def invalidate(path=None):
+    """Önbelleği boşalt; bir sonraki load_gallery() dosyayı yeniden okur."""
+    with _lock:
+        if path is None:
+            _cache.clear()
+        else:
+            _cache.pop(path, None)
+        _stats["invalidations"] += 1
+
+
+def gallery_version(path=None):
+    """Bu worker'da yüklü galerinin sürüm sayacı (yüklenmediyse 0)."""
+    entry = _cache.get(path or FACE_DB_PATH)
+    return entry["version"] if entry is not None else 0
+
+
+def cache_stats():
+    """Önbellek sayaçları: hits, reloads, invalidations, stats_calls (+ size, version)."""
+    with _lock:
+        out = dict(_stats)
+        entry = _cache.get(FACE_DB_PATH)
+        out["version"] = entry["version"] if entry is not None else 0
+        out["size"] = len(entry["data"]) if entry is not None and entry["data"] is not None else 0
+        shards = {p: e for p, e in _cache.items() if _is_shard(p)}
+        out["shards_loaded"] = len(shards)
+        out["shard_bytes"] = sum(_entry_bytes(e) for e in shards.values())
+        out["shard_budget_bytes"] = SHARD_BUDGET_BYTES
+        out["quantize"] = GALLERY_QUANTIZE
+        out["resident_bytes"] = _entry_bytes(entry) if entry is not None else 0
+        out["pid"] = os.getpid()
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Face gallery tools")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_mig = sub.add_parser("migrate", help="convert a pickle gallery to the mmap binary format")
+    p_mig.add_argument("src", nargs="?", default="face_db.pickle")
+    p_mig.add_argument("dst", nargs="?", default="face_db.fgal")
+    p_cmp = sub.add_parser("compact", help="fold the enrollment log into the main gallery")
+    p_cmp.add_argument("path", nargs="?", default=FACE_DB_PATH)
+    args = parser.parse_args()
+
+    if args.cmd == "migrate":
+        if not os.path.exists(args.src):
+            sys.exit(f"{args.src} not found.")
+        n = migrate(args.src, args.dst)
+        print(f"{n} faces written to {args.dst} (+ {args.dst}.ids)")
+
+    elif args.cmd == "compact":
+        n = compact(args.path)
+        print(f"{n} enrollments folded into {args.path}")
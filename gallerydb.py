@@ -0,0 +1,315 @@
+# gallerydb.py
+# Veritabanı destekli galeri (GALLERY_BACKEND=db). Heroku'da dosya sistemi dyno başına ve
+# geçicidir; encoding'ler gallery_faces tablosunda (float32 x 128, 512 baytlık binary kolon)
+# tutulur ve her worker bellekteki kopyasını sürüm numarasıyla artımlı olarak eşitler:
+#   - her yazma işlemi tek, monoton artan bir version alır (ekleme ya da silindi işareti)
+#   - worker POLL_INTERVAL'da bir sadece "version > son görülen" satırlarını çeker
+#   - soğuk başlangıçta galeri tek bir akışlı (server-side cursor) sorguyla yüklenir
+# Sürüm sayacı gallery_meta satırındadır; satır kilidi commit'e kadar tutulduğu için sürümler
+# commit sırasıyla görünür (bir okuyucu 8'i görüp henüz commit edilmemiş 7'yi kaçıramaz).
+import os, sys, time, threading
+import numpy as np
+from sqlalchemy import select, insert, update, func, case, bindparam
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+
+import gallery
+from gallery import FaceGallery, LayeredGallery, EMBEDDING_DIM
+
+POLL_INTERVAL = float(os.environ.get("GALLERY_DB_POLL", "2.0"))
+# Soğuk yüklemede sürücüden parça parça alınacak satır sayısı
+STREAM_ROWS = int(os.environ.get("GALLERY_DB_STREAM_ROWS", "5000"))
+# Delta bu kadar satırı geçince ana katmana katlanır (her kayıtta N satırlık kopya yapılmaz)
+DELTA_ROWS = int(os.environ.get("GALLERY_DB_DELTA_ROWS", "1024"))
+
+GLOBAL = ""  # global galerinin shard kolonu değeri
+
+
+def pack(encoding):
+    """128-d encoding -> 512 bayt (little-endian float32)"""
+    return np.asarray(encoding, dtype="<f4").reshape(EMBEDDING_DIM).tobytes()
+
+
+def _unpack(blobs):
+    return np.frombuffer(b"".join(blobs), dtype="<f4").reshape(-1, EMBEDDING_DIM)
+
+
+def _layer(base, delta):
+    if delta is None or len(delta) == 0:
+        return base if len(base) else None
+    return LayeredGallery(base, delta) if len(base) else delta
+
+
+class DbGallery:
+    """
+    engine_fn: SQLAlchemy engine döndüren çağrılabilir (Flask app context'ini app.py sağlar)
+    faces / meta: gallery_faces ve gallery_meta tabloları (app.py'deki modellerin __table__'ı)
+    load(shard) gallery.load_gallery ile aynı nesneleri döner (FaceGallery / LayeredGallery / None).
+    """
+
+    def __init__(self, engine_fn, faces, meta, poll_interval=None):
+        self.engine_fn = engine_fn
+        self.faces = faces
+        self.meta = meta
+        self.poll_interval = POLL_INTERVAL if poll_interval is None else poll_interval
+        self._lock = threading.Lock()
+        # shard -> {"version", "checked_at", "base", "base_rows", "delta", "delta_rows", "data"}
+        self._shards = {}
+        self._stats = {"full_loads": 0, "last_load_ms": 0.0, "polls": 0, "poll_rows": 0,
+                       "tombstones": 0, "folds": 0, "enrollments": 0, "rewrites": 0, "sync_errors": 0}
+
+    # ----------------- OKUMA / EŞİTLEME -----------------
+    def load(self, shard=None):
+        """Kapsamın bellekteki galerisi; POLL_INTERVAL dolduysa önce yeni sürümler çekilir."""
+        key = shard or GLOBAL
+        now = time.monotonic()
+        with self._lock:
+            state = self._shards.get(key)
+            if state is not None and now - state["checked_at"] < self.poll_interval:
+                return state["data"]
+            try:
+                if state is None:
+                    state = self._shards[key] = self._full_load(key)
+                else:
+                    self._poll(key, state)
+            except SQLAlchemyError as e:
+                # DB geçici olarak erişilemiyor (ya da tablo henüz yok): eldeki kopyayla devam
+                self._stats["sync_errors"] += 1
+                print(f"Gallery sync failed: {e}", file=sys.stderr)
+                return state["data"] if state is not None else None
+            state["checked_at"] = now
+            return state["data"]
+
+    def version(self, shard=None):
+        """Bu worker'ın gördüğü son DB sürümü (yüklenmediyse 0)."""
+        state = self._shards.get(shard or GLOBAL)
+        return state["version"] if state is not None else 0
+
+    def _full_load(self, key):
+        """Tek akışlı sorgu: satırlar STREAM_ROWS'luk parçalarla önceden ayrılmış matrise yazılır."""
+        t0 = time.perf_counter()
+        f = self.faces.c
+        with self.engine_fn().connect() as conn:
+            live, top = conn.execute(
+                select(func.sum(case((f.deleted.is_(False), 1), else_=0)), func.max(f.version))
+                .where(f.shard == key)
+            ).one()
+            live, top = int(live or 0), int(top or 0)
+            # version <= top: sonradan değişen satırlar sadece top'tan büyük sürüm alır, yani
+            # akıştaki canlı satırlar yukarıda sayılanların alt kümesidir (matris taşmaz)
+            result = conn.execution_options(stream_results=True, yield_per=STREAM_ROWS).execute(
+                select(f.id, f.person_id, f.name, f.weight, f.embedding)
+                .where(f.shard == key, f.deleted.is_(False), f.version <= top)
+            )
+            matrix = np.empty((live, EMBEDDING_DIM), dtype=np.float32)
+            weights = np.empty(live, dtype=np.float32)
+            rows = np.empty(live, dtype=np.int64)
+            names, ids, n = [], [], 0
+            for part in result.partitions():
+                end = n + len(part)
+                matrix[n:end] = _unpack([r.embedding for r in part])
+                weights[n:end] = [r.weight for r in part]
+                rows[n:end] = [r.id for r in part]
+                names += [r.name or "" for r in part]
+                ids += [r.person_id for r in part]
+                n = end
+        base = FaceGallery(matrix[:n], names, ids, weights=weights[:n]).quantized(gallery.GALLERY_QUANTIZE)
+        self._stats["full_loads"] += 1
+        self._stats["last_load_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+        return {"version": top, "checked_at": 0.0, "base": base, "base_rows": rows[:n],
+                "delta": None, "delta_rows": [], "data": _layer(base, None)}
+
+    def _poll(self, key, state):
+        f = self.faces.c
+        with self.engine_fn().connect() as conn:
+            changes = conn.execute(
+                select(f.id, f.person_id, f.name, f.weight, f.embedding, f.version, f.deleted)
+                .where(f.shard == key, f.version > state["version"])
+                .order_by(f.version)
+            ).all()
+        self._stats["polls"] += 1
+        if not changes:
+            return
+        self._stats["poll_rows"] += len(changes)
+        state["version"] = changes[-1].version
+        gone = {r.id for r in changes if r.deleted}
+        new = [r for r in changes if not r.deleted]
+        if gone:
+            self._stats["tombstones"] += len(gone)
+            self._fold(state, drop=gone)
+        if new:
+            delta = state["delta"] or FaceGallery()
+            state["delta"] = delta.extended(_unpack([r.embedding for r in new]), [r.name or "" for r in new],
+                                            [r.person_id for r in new], [r.weight for r in new])
+            state["delta_rows"] += [r.id for r in new]
+            if len(state["delta"]) > DELTA_ROWS:
+                self._fold(state)
+        state["data"] = _layer(state["base"], state["delta"])
+
+    def _fold(self, state, drop=()):
+        """Deltayı ana katmana katlar; drop'taki satır id'leri çıkarılır."""
+        base, rows = state["base"], state["base_rows"]
+        delta = state["delta"]
+        if delta is not None and len(delta):
+            base = base.extended(delta.matrix, delta.names, delta.ids, delta.weights)
+            rows = np.concatenate([rows, np.asarray(state["delta_rows"], dtype=np.int64)])
+        if drop:
+            keep = ~np.isin(rows, np.fromiter(drop, dtype=np.int64, count=len(drop)))
+            base, rows = base.subset(keep), rows[keep]
+        state.update(base=base.quantized(gallery.GALLERY_QUANTIZE), base_rows=rows, delta=None, delta_rows=[])
+        self._stats["folds"] += 1
+
+    def _mark_stale(self, keys):
+        """Bu worker'ın yazdığı değişiklik POLL_INTERVAL beklenmeden görünsün."""
+        with self._lock:
+            for key in keys:
+                state = self._shards.get(key)
+                if state is not None:
+                    state["checked_at"] = float("-inf")
+
+    # ----------------- YAZMA -----------------
+    def _bump(self, conn, key, n, initial):
+        """gallery_meta[key] sayacını n artırır (satır kilidi commit'e kadar tutulur). Çıktı: yeni değer"""
+        m = self.meta.c
+        if conn.execute(update(self.meta).where(m.key == key).values(value=m.value + n)).rowcount == 0:
+            conn.execute(insert(self.meta).values(key=key, value=initial(conn) + n))
+        return conn.execute(select(m.value).where(m.key == key)).scalar_one()
+
+    def _max_version(self, conn):
+        return conn.execute(select(func.max(self.faces.c.version))).scalar() or 0
+
+    def _max_person(self, conn):
+        ids = conn.execute(select(self.faces.c.person_id).distinct()).scalars()
+        return max((int(i) for i in ids if i.isdigit()), default=0)
+
+    def _transaction(self, fn):
+        for attempt in (0, 1):
+            try:
+                with self.engine_fn().begin() as conn:
+                    return fn(conn)
+            except IntegrityError:
+                # İlk kullanımda iki worker sayaç satırını aynı anda eklemeye çalıştı: bir kez tekrar dene
+                if attempt:
+                    raise
+
+    def enroll(self, name, encoding, shards=(), person_id=None):
+        """
+        Tek örneği global galeriye ve shard'lara (aynı person_id ile) tek transaction'da ekler.
+        person_id verilmezse DB sayacından yeni id alınır. Çıktı: person_id
+        """
+        for shard in shards:
+            gallery.shard_path(shard)  # geçersiz ad -> hiçbir şey yazılmadan ValueError
+        keys = [GLOBAL] + sorted(set(shards))
+        blob = pack(encoding)
+
+        def write(conn):
+            version = self._bump(conn, "version", 1, self._max_version)
+            pid = person_id or f"{self._bump(conn, 'person_seq', 1, self._max_person):03d}"
+            conn.execute(insert(self.faces), [
+                {"shard": key, "person_id": pid, "name": name, "weight": 1.0, "embedding": blob,
+                 "version": version, "deleted": False}
+                for key in keys
+            ])
+            return pid
+
+        pid = self._transaction(write)
+        self._stats["enrollments"] += 1
+        self._mark_stale(keys)
+        return pid
+
+    def _read_live(self, conn, key):
+        f = self.faces.c
+        rows = conn.execute(
+            select(f.id, f.person_id, f.name, f.weight, f.embedding)
+            .where(f.shard == key, f.deleted.is_(False)).order_by(f.id)
+        ).all()
+        g = FaceGallery(_unpack([r.embedding for r in rows]) if rows else None, [r.name or "" for r in rows],
+                        [r.person_id for r in rows], weights=np.asarray([r.weight for r in rows], dtype=np.float32))
+        return g, rows
+
+    def rewrite(self, transform, shard=None):
+        """
+        Kapsamın canlı satırlarını (prototipleri sıkıştırılmış) galeri olarak okur, transform(g)
+        uygular ve sadece farkı yazar: satırları değişen kişilerin eski satırları silindi olarak
+        işaretlenir, yenileri eklenir (worker'lar sadece bu satırları çeker). Çıktı: yeni galeri
+        """
+        key = shard or GLOBAL
+        if shard:
+            gallery.shard_path(shard)
+        f = self.faces.c
+
+        def people(g):
+            out = {}
+            for i, pid in enumerate(g.ids):
+                out.setdefault(pid, []).append((g.names[i], float(g.weights[i]), pack(g.matrix[i])))
+            return {pid: sorted(v) for pid, v in out.items()}
+
+        def write(conn):
+            # Sayaç önce kilitlenir: okuma ile yazma arasında başka bir kayıt araya giremez
+            version = self._bump(conn, "version", 1, self._max_version)
+            old, rows = self._read_live(conn, key)
+            new = transform(gallery.compress(old))
+            before, after = people(old), people(new)
+            changed = {pid for pid in before.keys() | after.keys() if before.get(pid) != after.get(pid)}
+            dead = [{"row_id": r.id} for r in rows if r.person_id in changed]
+            if dead:
+                conn.execute(update(self.faces).where(f.id == bindparam("row_id"))
+                             .values(deleted=True, version=version), dead)
+            added = [
+                {"shard": key, "person_id": pid, "name": name, "weight": w, "embedding": blob,
+                 "version": version, "deleted": False}
+                for pid in changed for name, w, blob in after.get(pid, ())
+            ]
+            if added:
+                conn.execute(insert(self.faces), added)
+                # Dışarıdan gelen id'ler (gallery-import) sonraki kayıtlarla çakışmasın
+                top = max((int(r["person_id"]) for r in added if r["person_id"].isdigit()), default=0)
+                m = self.meta.c
+                conn.execute(update(self.meta).where(m.key == "person_seq", m.value < top).values(value=top))
+            return new
+
+        new = self._transaction(write)
+        self._stats["rewrites"] += 1
+        self._mark_stale([key])
+        return new
+
+    def list_shards(self):
+        f = self.faces.c
+        with self.engine_fn().connect() as conn:
+            return sorted(conn.execute(
+                select(f.shard).distinct().where(f.shard != GLOBAL, f.deleted.is_(False))).scalars())
+
+    def merge_duplicates(self, max_distance=0.45, dry_run=False):
+        """gallery.merge_duplicates'in DB karşılığı. Çıktı: {eski_id: kalan_id}"""
+        if dry_run:
+            with self.engine_fn().connect() as conn:
+                return gallery.duplicate_map(gallery.compress(self._read_live(conn, GLOBAL)[0]), max_distance)
+        mapping = {}
+
+        def transform(g):
+            mapping.update(gallery.duplicate_map(g, max_distance))
+            return gallery.relabel(g, mapping)
+
+        self.rewrite(transform)
+        if mapping:
+            for shard in self.list_shards():
+                self.rewrite(lambda g: gallery.relabel(g, mapping), shard)
+        return mapping
+
+    def stats(self):
+        """gallery.cache_stats() ile aynı rolde: eşitleme sayaçları + yüklü kapsamlar."""
+        with self._lock:
+            out = dict(self._stats)
+            state = self._shards.get(GLOBAL)
+            out["backend"] = "db"
+            out["version"] = state["version"] if state is not None else 0
+            out["size"] = len(state["data"]) if state is not None and state["data"] is not None else 0
+            out["delta_size"] = len(state["delta"]) if state is not None and state["delta"] is not None else 0
+            out["shards_loaded"] = sum(1 for k in self._shards if k != GLOBAL)
+            out["quantize"] = gallery.GALLERY_QUANTIZE
+            out["pid"] = os.getpid()
+        return out
+
+    def invalidate(self):
+        """Bellekteki kopyaları at; bir sonraki load() tam yükleme yapar."""
+        with self._lock:
+            self._shards.clear()
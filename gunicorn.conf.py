@@ -0,0 +1,57 @@
+# gunicorn.conf.py
+# Hızlı soğuk başlangıç: uygulama master'da bir kez yüklenir (preload), modeller + galeri
+# fork'tan önce ısıtılır ve worker'larla copy-on-write paylaşılır. Port, warm-up bittikten
+# sonra açılır; böylece dyno yeniden başlarken ilk istekler model yüklemesini beklemez.
+# GUNICORN_PRELOAD=0 -> her worker kendi modellerini yükler (istek kabul etmeden önce).
+import os, gc, time
+
+_t0 = time.perf_counter()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+# /attendance_stream her kamera için bir thread'i bağlantı boyunca tutar: sürekli modda
+# GUNICORN_THREADS kamera sayısından büyük olmalı (threads > 1 -> gthread worker). Bir thread
+# kiosk/dashboard/sağlık kontrolleri için ayrılır; threads=1 iken akışlar 503 ile reddedilir.
+threads = int(os.environ.get("GUNICORN_THREADS", "1"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+warmup = os.environ.get("WARMUP", "1") == "1"
+
+
+def _warm_up(log):
+    import app
+    stats = app.warm_up()
+    log.info("Warm-up done in pid %s: app import %sms, model import %sms, dummy encode %sms, "
+             "gallery %sms (%s faces)", os.getpid(), stats["app_import_ms"], stats["import_ms"],
+             stats["warmup_ms"], stats["gallery_load_ms"], stats["gallery_size"])
+
+
+def on_starting(server):
+    # preload: uygulama zaten import edildi; socket'ler henüz açılmadı
+    if preload_app and warmup:
+        _warm_up(server.log)
+        # Isınmış nesneleri GC taramasından çıkar: worker'larda refcount/GC yazmaları sayfaları kopyalatmasın
+        gc.freeze()
+    server.log.info("Master boot: %.0fms", (time.perf_counter() - _t0) * 1000)
+
+
+def post_fork(server, worker):
+    worker.fork_t0 = time.perf_counter()
+    if preload_app:
+        # Master'da açılmış olabilecek DB bağlantıları worker'lar arasında paylaşılmamalı.
+        # close=False: miras alınan soketler master'la ortak, çocukta kapatılmadan sadece
+        # havuzdan bırakılır (SQLAlchemy'nin multiprocessing önerisi)
+        import app
+        with app.app.app_context():
+            app.db.engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    # Worker istek kabul etmeden hemen önce çağrılır
+    import app
+    if warmup and not app.BOOT_STATS["warm"]:
+        _warm_up(worker.log)
+    app.BOOT_STATS["worker_boot_ms"] = round((time.perf_counter() - worker.fork_t0) * 1000, 2)
+    app.BOOT_STATS["preloaded"] = preload_app
+    app.configure_server(worker.cfg.workers, worker.cfg.threads, worker.log)
+    worker.log.info("Worker %s ready in %sms", os.getpid(), app.BOOT_STATS["worker_boot_ms"])
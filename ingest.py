@@ -0,0 +1,118 @@
+# ingest.py
+# Görüntü alma katmanı: JPEG'ler decoder'ın draft (DCT ölçekleme: 1/2, 1/4, 1/8) moduyla
+# doğrudan gereken çözünürlüğe yakın decode edilir ve EXIF yönü (varsa) yerinde uygulanır.
+# face_recognition'a verilen NumPy dizisi görüntü baytlarından bir kez oluşturulur.
+import io, os, time, argparse
+import numpy as np
+from PIL import Image, ImageOps
+
+
+def load_image(source, max_side=None):
+    """
+    source: dosya yolu, dosya benzeri nesne ya da bytes
+    max_side: uzun kenar için hedef (piksel); JPEG bu boyuttan küçük olmayan en küçük
+              DCT ölçeğinde decode edilir. None/0 -> tam çözünürlük.
+    Çıktı: EXIF yönü düzeltilmiş PIL RGB görüntü
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    image = Image.open(source)
+    if max_side and image.format == "JPEG":
+        w, h = image.size
+        ratio = max_side / max(w, h)
+        if ratio < 1.0:
+            # draft: istenen boyuttan küçük olmayacak şekilde ölçek seçer; renk dönüşümü de decoder'da
+            image.draft("RGB", (max(1, int(w * ratio + 0.5)), max(1, int(h * ratio + 0.5))))
+    # in_place: yön etiketi yoksa (kiosk canvas JPEG'leri) exif_transpose tam kare kopyası döndürmesin
+    ImageOps.exif_transpose(image, in_place=True)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return image
+
+
+def to_array(image):
+    """
+    PIL görüntüden (H, W, 3) uint8 dizi (salt okunur). __array_interface__ pikselleri bir kez bayt
+    tamponuna kopyalar, np.asarray bu tamponu sarar; np.array(image) ikinci bir kopya daha yapar.
+    """
+    return np.asarray(image)
+
+
+# ----------------- MİKRO BENCHMARK -----------------
+def synthetic_jpeg(w, h, quality, orientation=None, seed=0):
+    """Gradyan + gürültü içeren (gerçekçi sıkışan) yüzsüz JPEG baytları; orientation -> EXIF yönü."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:h, 0:w]
+    base = np.stack([(xx * 255 // max(1, w - 1)), (yy * 255 // max(1, h - 1)), ((xx + yy) % 256)], axis=-1)
+    noise = rng.integers(0, 40, size=(h, w, 3))
+    img = Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8))
+    buf = io.BytesIO()
+    exif = None
+    if orientation:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+    img.save(buf, "JPEG", quality=quality, **({"exif": exif} if exif is not None else {}))
+    return buf.getvalue()
+
+
+def _reset_peak():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _rss_kb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def _measure(fn, data, repeat):
+    """Çıktı: (medyan decode ms, medyan tepe RSS artışı MB, dizi boyutu)"""
+    times, peaks, shape = [], [], None
+    for _ in range(repeat):
+        # clear_refs=5 VmHWM'yi sıfırlar; Pillow tamponları tracemalloc'a görünmediği için RSS ölçülür
+        can_peak = _reset_peak()
+        before = _rss_kb("VmRSS")
+        t0 = time.perf_counter()
+        arr = fn(data)
+        times.append(time.perf_counter() - t0)
+        peaks.append(_rss_kb("VmHWM") - before if can_peak else float("nan"))
+        shape = arr.shape
+        del arr
+    return float(np.median(times)) * 1000, float(np.median(peaks)) / 1024, shape
+
+
+def benchmark(cases, repeat=7):
+    legacy = lambda d: np.array(Image.open(io.BytesIO(d)).convert("RGB"))
+    print(f"{'input':<28}{'path':<20}{'shape':<18}{'decode ms':>10}{'peak MB':>10}")
+    for label, data, max_side in cases:
+        new = lambda d, m=max_side: to_array(load_image(d, m))
+        for path, fn in (("legacy np.array", legacy), (f"draft max={max_side}", new)):
+            ms, peak, shape = _measure(fn, data, repeat)
+            print(f"{label:<28}{path:<20}{str(shape):<18}{ms:>10.2f}{peak:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode time / peak memory micro-benchmark")
+    parser.add_argument("files", nargs="*", help="JPEG files (default: synthetic kiosk + phone inputs)")
+    parser.add_argument("--max-side", type=int, default=1280)
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    if args.files:
+        cases = []
+        for path in args.files:
+            with open(path, "rb") as f:
+                cases.append((os.path.basename(path)[:27], f.read(), args.max_side))
+    else:
+        cases = [
+            ("kiosk 640x360 q70", synthetic_jpeg(640, 360, 70), 640),
+            ("phone 4032x3024 q90 rot90", synthetic_jpeg(4032, 3024, 90, orientation=6), args.max_side),
+        ]
+    benchmark(cases, repeat=args.repeat)
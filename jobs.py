@@ -0,0 +1,141 @@
+# jobs.py
+# Sınırlı kuyruklu arka plan iş havuzu: istek thread'i işi kuyruğa bırakır (202 + job id),
+# kuyruk doluysa iş reddedilir (429 + Retry-After). Kuyruk derinliği, bekleme ve servis
+# süreleri raporlanır.
+# Not: iş kayıtları proses içindedir; polling aynı worker'a gelmelidir. app.py async modu
+# sadece tek worker + threads > 1 yapısında açar, aksi halde sync'e düşer.
+import os, math, time, uuid, queue, threading
+from collections import deque
+
+
+class Job:
+    def __init__(self, fn, args):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.args = args
+        self.created = time.monotonic()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        out = {"job_id": self.id, "state": self.state}
+        if self.started is not None:
+            out["wait_ms"] = round((self.started - self.created) * 1000, 2)
+        if self.finished is not None:
+            out["service_ms"] = round((self.finished - self.started) * 1000, 2)
+        if self.error is not None:
+            out["error"] = self.error
+        return out
+
+    @property
+    def state(self):
+        if self.finished is not None:
+            return "failed" if self.error is not None else "done"
+        return "running" if self.started is not None else "queued"
+
+
+class JobQueue:
+    """
+    workers: eşzamanlı iş sayısı (thread)
+    max_queue: bekleyen iş sınırı; doluysa submit() None döner
+    ttl: biten işlerin sonucunun tutulacağı süre (saniye)
+    """
+
+    def __init__(self, workers=2, max_queue=16, ttl=300.0, window=200):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.ttl = ttl
+        self._q = queue.Queue(maxsize=max_queue)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._wait = deque(maxlen=window)
+        self._service = deque(maxlen=window)
+        self._counts = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0}
+        self._running = 0
+
+    def _ensure_started(self):
+        # Thread'ler fork'tan sonra, ilk kullanımda başlatılır (preload edilen master'da değil)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for i in range(self.workers):
+                threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True).start()
+
+    def _run(self):
+        while True:
+            job = self._q.get()
+            job.started = time.monotonic()
+            with self._lock:
+                self._running += 1
+            try:
+                job.result = job.fn(*job.args)
+            except Exception as e:
+                job.error = str(e)
+            job.finished = time.monotonic()
+            with self._lock:
+                self._running -= 1
+                self._wait.append(job.started - job.created)
+                self._service.append(job.finished - job.started)
+                self._counts["failed" if job.error is not None else "completed"] += 1
+            job.done.set()
+            self._q.task_done()
+
+    def _expire(self, now):
+        old = [jid for jid, j in self._jobs.items() if j.finished is not None and now - j.finished > self.ttl]
+        for jid in old:
+            del self._jobs[jid]
+
+    def submit(self, fn, *args):
+        """İşi kuyruğa ekler; kuyruk doluysa None (çağıran 429 dönmeli)."""
+        self._ensure_started()
+        job = Job(fn, args)
+        with self._lock:
+            self._expire(time.monotonic())
+            try:
+                self._q.put_nowait(job)
+            except queue.Full:
+                self._counts["rejected"] += 1
+                return None
+            self._jobs[job.id] = job
+            self._counts["submitted"] += 1
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def retry_after(self):
+        """Kuyruğun boşalması için tahmini saniye (Retry-After başlığı)."""
+        with self._lock:
+            avg = sum(self._service) / len(self._service) if self._service else 1.0
+        return max(1, math.ceil(avg * (self._q.qsize() + 1) / self.workers))
+
+    def stats(self):
+        def pct(samples, p):
+            if not samples:
+                return 0.0
+            s = sorted(samples)
+            return round(s[min(len(s) - 1, int(p / 100 * len(s)))] * 1000, 2)
+
+        with self._lock:
+            wait, service = list(self._wait), list(self._service)
+            out = dict(self._counts)
+            out.update({
+                "queue_depth": self._q.qsize(),
+                "running": self._running,
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "tracked_jobs": len(self._jobs),
+            })
+        out.update({
+            "wait_ms_p50": pct(wait, 50), "wait_ms_p95": pct(wait, 95),
+            "service_ms_p50": pct(service, 50), "service_ms_p95": pct(service, 95),
+        })
+        return out
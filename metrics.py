@@ -0,0 +1,143 @@
+# metrics.py
+# Hafif, bağımlılıksız Prometheus metrikleri (text exposition format 0.0.4).
+# Sayaçlar proses içindedir: /metrics'e cevap veren worker kendi değerlerini raporlar
+# (anlık gauge'lar "pid" etiketi taşır; çok worker'da scrape'ler worker'lar arasında dağılır).
+import os, threading
+
+# Saniye cinsinden gecikme kovaları (tespit ~30-200ms, encoding ~100-300ms)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    """Tam hassasiyet: tamsayı değerler int, diğerleri repr(float) (:g 6 haneye yuvarlar)."""
+    value = float(value)
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _labels(names, values, extra=()):
+    parts = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_labels(self.label_names, labels)} {_number(value)}"
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [kova sayıları..., toplam, adet]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        # Kova sayıları kümülatif değil tutulur (ikili arama ile tek kova), render'da toplanır
+        lo, hi = 0, len(self.buckets)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if value <= self.buckets[mid]:
+                hi = mid
+            else:
+                lo = mid + 1
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[lo] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        n = len(self.buckets)
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:n + 1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                yield f"{self.name}_bucket{_labels(self.label_names, labels, [('le', le)])} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.label_names, labels)} {series[-2]:.6f}"
+            yield f"{self.name}_count{_labels(self.label_names, labels)} {series[-1]}"
+
+
+REQUEST_LATENCY = Histogram("attendance_request_duration_seconds", "HTTP request latency", ("endpoint",))
+REQUESTS = Counter("attendance_requests_total", "HTTP requests by status code", ("endpoint", "status"))
+STAGE_LATENCY = Histogram("attendance_stage_duration_seconds",
+                          "Recognition pipeline stage latency (decode, detect, encode, gallery, match, db, ...)",
+                          ("endpoint", "stage"))
+_registry = [REQUEST_LATENCY, REQUESTS, STAGE_LATENCY]
+
+
+def stage_items(timings):
+    """timings dict'indeki *_ms aşamaları -> [(aşama, ms), ...]"""
+    return [(k[:-3], v) for k, v in timings.items() if k.endswith("_ms") and isinstance(v, (int, float))]
+
+
+def observe_stages(endpoint, timings):
+    for stage, ms in stage_items(timings):
+        STAGE_LATENCY.observe(ms / 1000.0, endpoint, stage)
+
+
+def server_timing(timings):
+    """Server-Timing başlığı: "decode;dur=1.7, detect;dur=32.5, ..." (+ önbellek isabeti)"""
+    parts = [f"{stage};dur={ms:g}" for stage, ms in stage_items(timings)]
+    if "cache" in timings:
+        parts.append(f'cache;desc="{timings["cache"]}"')
+    return ", ".join(parts)
+
+
+def _flatten(prefix, value, out):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            _flatten(f"{prefix}_{k}", v, out)
+    elif isinstance(value, bool):
+        out.append((prefix, int(value)))
+    elif isinstance(value, (int, float)):
+        out.append((prefix, value))
+
+
+def render(gauges=None):
+    """
+    gauges: {"gallery": {...}, "jobs": {...}} gibi anlık istatistik sözlükleri;
+            sayısal alanlar <grup>_<alan> adlı gauge olarak yazılır.
+    Çıktı: Prometheus text formatında metin
+    """
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    pid = f'pid="{os.getpid()}"'
+    for group, stats in (gauges or {}).items():
+        flat = []
+        _flatten(f"attendance_{group}", stats, flat)
+        for name, value in flat:
+            if name.endswith("_pid"):
+                continue
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name}{{{pid}}} {_number(value)}")
+    return "\n".join(lines) + "\n"
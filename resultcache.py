@@ -0,0 +1,95 @@
+# resultcache.py
+# Kısa ömürlü tanıma sonucu önbelleği: çift tıklama / ağ hatası sonrası tekrar gönderilen,
+# neredeyse aynı kareler için tespit + encoding + eşleştirme tekrar çalıştırılmaz.
+# Anahtar: küçültülmüş karenin algısal hash'i (dHash) + işlem (entry/exit) + galeri sürümü.
+# Sadece eşleşme sonucu tutulur; 2 saat kuralı ve kayıt her istekte yeniden uygulanır.
+import time, threading
+from collections import OrderedDict
+from PIL import Image
+import ingest
+
+HASH_SIZE = 16  # 16x16 = 256 bitlik fark hash'i
+
+
+def frame_hash(data, size=HASH_SIZE):
+    """
+    data: görüntü baytları
+    JPEG 1/8 DCT ölçeğinde decode edilir (birkaç ms), gri tonlamada (size+1)xsize'a küçültülür;
+    yatay komşu pikseller karşılaştırılır.
+    Çıktı: size*size bitlik int (açılamazsa istisna fırlatır)
+    """
+    image = ingest.load_image(data, max_side=size * 8).convert("L").resize((size + 1, size), Image.BILINEAR)
+    px = image.tobytes()
+    bits = 0
+    for y in range(size):
+        row = px[y * (size + 1):(y + 1) * (size + 1)]
+        for x in range(size):
+            bits = (bits << 1) | (row[x] > row[x + 1])
+    return bits
+
+
+class RecognitionCache:
+    """
+    ttl: sonucun geçerli olduğu süre (saniye)
+    max_size: LRU üst sınırı
+    max_distance: aynı kare sayılacak en fazla farklı bit (Hamming); 0 -> birebir eşleşme.
+                  Hash tüm karenin olduğundan > 0 sadece arka planı değişken kameralarda güvenlidir.
+    """
+
+    def __init__(self, ttl=10.0, max_size=256, max_distance=0):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_distance = max_distance
+        self._entries = OrderedDict()  # (hash, action) -> (version, sonuç, son geçerlilik)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "expired": 0, "invalidated": 0,
+                       "saved_ms": 0.0}
+
+    def get(self, key, action, version):
+        """Geçerli önbellek sonucu ya da None. Yakın hash'ler (<= max_distance bit) de eşleşir."""
+        now = time.monotonic()
+        with self._lock:
+            found = self._entries.get((key, action))
+            if found is None and self.max_distance:
+                for (k, a), value in reversed(self._entries.items()):
+                    if a == action and bin(k ^ key).count("1") <= self.max_distance:
+                        key, found = k, value
+                        break
+            if found is not None:
+                entry_version, result, expires, cost_ms = found
+                if entry_version != version:
+                    # Galeri değişti (yeni kayıt / yeniden yükleme) -> eski eşleşme geçersiz
+                    del self._entries[(key, action)]
+                    self._stats["invalidated"] += 1
+                elif expires < now:
+                    del self._entries[(key, action)]
+                    self._stats["expired"] += 1
+                else:
+                    self._entries.move_to_end((key, action))
+                    self._stats["hits"] += 1
+                    self._stats["saved_ms"] += cost_ms
+                    return result
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key, action, version, result, cost_ms=0.0):
+        """cost_ms: sonucu üretmenin maliyeti (isabette tasarruf edilen süre olarak sayılır)."""
+        with self._lock:
+            self._entries[(key, action)] = (version, result, time.monotonic() + self.ttl, cost_ms)
+            self._entries.move_to_end((key, action))
+            self._stats["stores"] += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats, size=len(self._entries), max_size=self.max_size, ttl=self.ttl,
+                       max_distance=self.max_distance)
+        lookups = out["hits"] + out["misses"]
+        out["hit_rate"] = round(out["hits"] / lookups, 4) if lookups else 0.0
+        out["saved_ms"] = round(out["saved_ms"], 2)
+        return out
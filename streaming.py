@@ -0,0 +1,228 @@
+# streaming.py
+# Sürekli akış modu ("kameranın önünden geç"): kiosk tek bir kalıcı bağlantı (chunked HTTP)
+# üzerinden uzunluk önekli JPEG kareler gönderir. Yüzler kareler arasında kutu örtüşmesiyle
+# (IoU) izlenir; face_encodings + galeri araması sadece yeni (ya da henüz tanınmamış) izler için
+# yapılır, tanınmış bir yüzün sonraki kareleri sadece tespit + iz eşleme maliyeti öder.
+# Kare bütçesi: akış başına STREAM_MAX_FPS, worker başına toplam STREAM_FPS_BUDGET; bütçeyi
+# aşan kareler decode edilmeden atılır.
+import os, struct, threading, time, itertools
+
+# Kare: 4 bayt big-endian uzunluk + JPEG baytları; uzunluk 0 -> akış sonu
+FRAME_HEADER = struct.Struct(">I")
+
+STREAM_MAX_FPS = float(os.environ.get("STREAM_MAX_FPS", "4"))
+STREAM_FPS_BUDGET = float(os.environ.get("STREAM_FPS_BUDGET", "0"))  # 0 -> sınırsız
+STREAM_MAX_STREAMS = int(os.environ.get("STREAM_MAX_STREAMS", "4"))  # worker başına eşzamanlı akış
+STREAM_MAX_FRAME_BYTES = int(os.environ.get("STREAM_MAX_FRAME_BYTES", str(2 * 1024 * 1024)))
+
+TRACK_IOU = float(os.environ.get("TRACK_IOU", "0.3"))
+# İz bu kadar işlenen karede görülmezse kapanır (kişi geri gelirse yeni iz -> yeniden tanınır)
+TRACK_MAX_MISSED = int(os.environ.get("TRACK_MAX_MISSED", "3"))
+# Tanınmamış iz her TRACK_RETRY_FRAMES karede bir, en fazla TRACK_MAX_ATTEMPTS kez yeniden encode edilir
+TRACK_RETRY_FRAMES = int(os.environ.get("TRACK_RETRY_FRAMES", "3"))
+TRACK_MAX_ATTEMPTS = int(os.environ.get("TRACK_MAX_ATTEMPTS", "5"))
+
+
+class FrameError(ValueError):
+    pass
+
+
+def _read_exact(stream, n):
+    """Tam n bayt; akış en başta bittiyse None, ortada bittiyse FrameError."""
+    chunks, left = [], n
+    while left:
+        chunk = stream.read(left)
+        if not chunk:
+            if left == n:
+                return None
+            raise FrameError("akış kare ortasında bitti")
+        chunks.append(chunk)
+        left -= len(chunk)
+    return b"".join(chunks)
+
+
+def read_frames(stream, max_bytes=None):
+    """
+    stream: dosya benzeri gövde (request.stream)
+    Çıktı: kare baytları üreteci; bağlantı kapanınca ya da 0 uzunluklu kare gelince biter
+    """
+    max_bytes = max_bytes or STREAM_MAX_FRAME_BYTES
+    while True:
+        header = _read_exact(stream, FRAME_HEADER.size)
+        if header is None:
+            return
+        (size,) = FRAME_HEADER.unpack(header)
+        if size == 0:
+            return
+        if size > max_bytes:
+            raise FrameError(f"kare çok büyük: {size} bayt (sınır {max_bytes})")
+        data = _read_exact(stream, size)
+        if data is None:
+            raise FrameError("akış kare ortasında bitti")
+        yield data
+
+
+def pack_frame(data):
+    """İstemci tarafı: JPEG baytları -> uzunluk önekli kare"""
+    return FRAME_HEADER.pack(len(data)) + data
+
+
+def iou(a, b):
+    """(top, right, bottom, left) kutularının kesişim / birleşim oranı"""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    inter = max(0, bottom - top) * max(0, right - left)
+    if inter == 0:
+        return 0.0
+    area = lambda r: (r[2] - r[0]) * (r[1] - r[3])
+    return inter / float(area(a) + area(b) - inter)
+
+
+class Track:
+    __slots__ = ("id", "box", "missed", "match", "status", "attempts", "last_try")
+
+    def __init__(self, track_id, box):
+        self.id = track_id
+        self.box = box
+        self.missed = 0
+        self.match = None  # tanındıysa {id, name, distance, shard}
+        self.status = None  # apply_attendance sonucu
+        self.attempts = 0
+        self.last_try = None
+
+    def needs_encoding(self, frame_no):
+        """Yeni iz ya da tanınmamış ve yeniden deneme zamanı gelmiş iz"""
+        if self.match is not None or self.attempts >= TRACK_MAX_ATTEMPTS:
+            return False
+        return self.last_try is None or frame_no - self.last_try >= TRACK_RETRY_FRAMES
+
+
+class FaceTracker:
+    """Kareler arası açgözlü IoU eşleme (en yüksek örtüşmeden başlayarak)."""
+
+    def __init__(self, iou_threshold=None, max_missed=None):
+        self.iou_threshold = TRACK_IOU if iou_threshold is None else iou_threshold
+        self.max_missed = TRACK_MAX_MISSED if max_missed is None else max_missed
+        self.tracks = []
+        self.created = 0
+
+    def update(self, boxes):
+        """boxes: bu karedeki yüz kutuları -> aynı sırada Track listesi (yeni kutulara yeni iz)"""
+        pairs = sorted(
+            ((iou(t.box, b), ti, bi) for ti, t in enumerate(self.tracks) for bi, b in enumerate(boxes)),
+            reverse=True,
+        )
+        out, used = [None] * len(boxes), set()
+        for score, ti, bi in pairs:
+            if score < self.iou_threshold:
+                break
+            if ti in used or out[bi] is not None:
+                continue
+            used.add(ti)
+            track = self.tracks[ti]
+            track.box, track.missed = boxes[bi], 0
+            out[bi] = track
+        alive = []
+        for ti, track in enumerate(self.tracks):
+            if ti not in used:
+                track.missed += 1
+            if track.missed <= self.max_missed:
+                alive.append(track)
+        for bi, box in enumerate(boxes):
+            if out[bi] is None:
+                self.created += 1
+                out[bi] = Track(self.created, box)
+                alive.append(out[bi])
+        self.tracks = alive
+        return out
+
+
+_COUNTERS = ("frames_received", "frames_processed", "frames_encoded", "frames_dropped",
+             "faces_encoded", "tracks", "identified", "bytes", "process_ms")
+
+
+class StreamStats:
+    """Tek akışın sayaçları (kare alındı / işlendi / encode edildi / atıldı)."""
+
+    def __init__(self, stream_id, camera):
+        self.stream_id = stream_id
+        self.camera = camera
+        self.started = time.monotonic()
+        self.counters = dict.fromkeys(_COUNTERS, 0)
+
+    def snapshot(self):
+        c = dict(self.counters)
+        seconds = max(1e-9, time.monotonic() - self.started)
+        c["process_ms"] = round(c["process_ms"], 2)
+        c["avg_process_ms"] = round(c["process_ms"] / c["frames_processed"], 2) if c["frames_processed"] else 0.0
+        c["received_fps"] = round(c["frames_received"] / seconds, 2)
+        c["processed_fps"] = round(c["frames_processed"] / seconds, 2)
+        return dict(c, stream=self.stream_id, camera=self.camera, seconds=round(seconds, 1))
+
+
+class StreamRegistry:
+    """
+    Worker içindeki açık akışlar: eşzamanlı akış sınırı ve kare bütçesi.
+    Akış başına kare aralığı: max(1 / max_fps, açık akış sayısı / fps_budget).
+    threads: worker'ın istek thread sayısı (None -> bilinmiyor). Her akış bir thread'i bağlantı
+    boyunca tuttuğundan en az biri kiosk/dashboard/sağlık kontrolleri için ayrılır:
+    eşzamanlı akış sınırı min(max_streams, threads - 1).
+    """
+
+    def __init__(self, max_streams=None, max_fps=None, fps_budget=None):
+        self.max_streams = STREAM_MAX_STREAMS if max_streams is None else max_streams
+        self.max_fps = STREAM_MAX_FPS if max_fps is None else max_fps
+        self.fps_budget = STREAM_FPS_BUDGET if fps_budget is None else fps_budget
+        self.threads = None
+        self._lock = threading.Lock()
+        self._active = {}
+        self._ids = itertools.count(1)
+        self._totals = {"streams_opened": 0, "streams_rejected": 0}
+        self._closed = {}  # kapanan akışların toplam sayaçları
+
+    def open(self, camera):
+        """Yeni akış (StreamStats) ya da sınır doluysa None"""
+        with self._lock:
+            if len(self._active) >= self.limit:
+                self._totals["streams_rejected"] += 1
+                return None
+            st = StreamStats(next(self._ids), camera)
+            self._active[st.stream_id] = st
+            self._totals["streams_opened"] += 1
+            return st
+
+    @property
+    def limit(self):
+        if self.threads is None:
+            return self.max_streams
+        return max(0, min(self.max_streams, self.threads - 1))
+
+    def close(self, st):
+        """Birden fazla çağrılabilir (response kapanışı + üreteç sonu)"""
+        with self._lock:
+            if self._active.pop(st.stream_id, None) is None:
+                return
+            for k, v in st.counters.items():
+                self._closed[k] = self._closed.get(k, 0) + v
+
+    def interval(self):
+        """Bir akışta iki işlenen kare arasındaki en kısa süre (saniye)"""
+        with self._lock:
+            active = max(1, len(self._active))
+        interval = 1.0 / self.max_fps if self.max_fps > 0 else 0.0
+        if self.fps_budget > 0:
+            interval = max(interval, active / self.fps_budget)
+        return interval
+
+    def stats(self):
+        with self._lock:
+            streams = [st.snapshot() for st in self._active.values()]
+            totals = dict(self._closed)
+            out = dict(self._totals, active=len(streams), max_streams=self.max_streams, limit=self.limit,
+                       max_fps=self.max_fps, fps_budget=self.fps_budget, pid=os.getpid())
+        for st in streams:
+            for k in _COUNTERS:
+                totals[k] = totals.get(k, 0) + st[k]
+        out["totals"] = {k: round(v, 2) if isinstance(v, float) else v for k, v in totals.items()}
+        out["streams"] = streams
+        return out
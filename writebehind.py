@@ -0,0 +1,118 @@
+# writebehind.py
+# Sınırlı write-behind tamponu: olaylar bellekte biriktirilir, boyut ya da süre eşiğinde
+# tek seferde flush_fn(events) ile yazılır (toplu INSERT/UPDATE + tek commit).
+# Henüz yazılmamış olaylar latest(key) ile okunabilir (tutarlı okuma için).
+# Tampon proses içidir: diğer proseslerin bekleyen olaylarını görmez (app.py tek worker şartı arar).
+import os, sys, time, atexit, threading
+
+
+class WriteBehindBuffer:
+    """
+    flush_fn: olay listesini kalıcı yazan fonksiyon (hata fırlatırsa olaylar geri kuyruğa alınır)
+    max_events: bu kadar olay birikince hemen yazılır
+    max_delay: en eski olay bu kadar saniye beklediyse arka plan thread'i yazar
+    limit: tampon üst sınırı; aşılırsa add() yazma bitene kadar çağıranı bekletir
+    """
+
+    def __init__(self, flush_fn, max_events=100, max_delay=1.0, limit=None):
+        self.flush_fn = flush_fn
+        self.max_events = max_events
+        self.max_delay = max_delay
+        self.limit = limit or max_events * 10
+        self._events = []
+        self._latest = {}
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pid = None
+        self._stats = {"events": 0, "flushes": 0, "flushed_events": 0, "failed_flushes": 0,
+                       "last_flush_ms": 0.0, "max_batch": 0}
+        atexit.register(self.flush)
+
+    def _ensure_started(self):
+        # Zamanlayıcı thread'i fork'tan sonra, ilk kullanımda başlatılır
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._timer, name="write-behind", daemon=True).start()
+
+    def _timer(self):
+        while True:
+            time.sleep(self.max_delay / 2)
+            with self._lock:
+                due = self._oldest is not None and time.monotonic() - self._oldest >= self.max_delay
+            if due:
+                self.flush()
+
+    def add(self, key, event):
+        """Olayı tampona ekler; key için en güncel bekleyen olay olarak işaretlenir."""
+        self._ensure_started()
+        event["_inflight"] = False
+        with self._lock:
+            self._events.append(event)
+            self._latest[key] = event
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._stats["events"] += 1
+            size = len(self._events)
+        if size >= self.max_events:
+            if size >= self.limit:
+                self.flush()
+            else:
+                threading.Thread(target=self.flush, daemon=True).start()
+
+    def latest(self, key):
+        """
+        key için henüz yazılmamış en güncel olay (yoksa None).
+        Olay o an yazılıyorsa yazma bitene kadar beklenir; sonra DB zaten günceldir.
+        """
+        while True:
+            with self._lock:
+                event = self._latest.get(key)
+                if event is None or not event["_inflight"]:
+                    return event
+            with self._flush_lock:
+                pass
+
+    def merge(self, key, event, changes):
+        """Bekleyen (henüz yazılmaya başlanmamış) olayı yerinde günceller; başarılıysa True."""
+        with self._lock:
+            if self._latest.get(key) is not event or event["_inflight"]:
+                return False
+            event.update(changes)
+            return True
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._events, self._oldest = self._events, [], None
+                for event in batch:
+                    event["_inflight"] = True
+            if not batch:
+                return 0
+            t0 = time.perf_counter()
+            try:
+                self.flush_fn(batch)
+            except Exception as e:
+                print(f"Write-behind flush failed ({len(batch)} events): {e}", file=sys.stderr)
+                with self._lock:
+                    for event in batch:
+                        event["_inflight"] = False
+                    self._events = batch + self._events
+                    self._oldest = time.monotonic()
+                    self._stats["failed_flushes"] += 1
+                return 0
+            with self._lock:
+                for key in [k for k, e in self._latest.items() if e["_inflight"]]:
+                    del self._latest[key]
+                self._stats["flushes"] += 1
+                self._stats["flushed_events"] += len(batch)
+                self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+                self._stats["last_flush_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+            return len(batch)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, pending=len(self._events), max_events=self.max_events,
+                        max_delay=self.max_delay)